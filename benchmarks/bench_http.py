@@ -0,0 +1,104 @@
+"""
+Compare per-request latency and throughput of the keep-alive
+PWI4HttpCommunicator against the previous urlopen-per-request transport.
+
+A small local HTTP/1.1 server answers every request with a canned status
+response, so no PWI4 installation is needed:
+
+    python benchmarks/bench_http.py --requests 2000
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.request import urlopen
+    from urllib.error import HTTPError
+except ImportError:
+    raise SystemExit("This benchmark needs Python 3.7 or newer")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pwi4_client import PWI4HttpCommunicator
+
+STATUS_PAYLOAD = "\n".join("mount.field_%d=%d.123456" % (i, i) for i in range(120)).encode("utf-8")
+
+
+class StatusHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(STATUS_PAYLOAD)))
+        self.end_headers()
+        self.wfile.write(STATUS_PAYLOAD)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class UrlopenCommunicator(PWI4HttpCommunicator):
+    """
+    The transport used before connection pooling: one urlopen() per request
+    """
+
+    def request(self, path, postdata=None, **kwargs):
+        url = self.make_url(path, **kwargs)
+        try:
+            response = urlopen(url, data=postdata, timeout=self.timeout_seconds)
+        except HTTPError as e:
+            raise Exception(str(e))
+        return response.read()
+
+
+def run(comm, requests):
+    latencies = []
+    start = time.perf_counter()
+    for i in range(requests):
+        t0 = time.perf_counter()
+        comm.request("/mount/goto_ra_dec_j2000", ra_hours=12.345678, dec_degs=-30.123456)
+        latencies.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests_per_sec": requests / elapsed,
+        "mean_ms": 1000 * sum(latencies) / len(latencies),
+        "p50_ms": 1000 * latencies[len(latencies) // 2],
+        "p99_ms": 1000 * latencies[int(len(latencies) * 0.99)],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--host", default=None, help="benchmark against a running PWI4 (or simulator) instead of the built-in server")
+    parser.add_argument("--port", type=int, default=8220)
+    args = parser.parse_args()
+
+    server = None
+    host, port = args.host, args.port
+    if host is None:
+        server = ThreadingHTTPServer(("127.0.0.1", 0), StatusHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        host, port = server.server_address
+
+    for name, comm in [("urlopen", UrlopenCommunicator(host, port)), ("keep-alive", PWI4HttpCommunicator(host, port))]:
+        run(comm, min(100, args.requests)) # warm up
+        result = run(comm, args.requests)
+        print("%-10s %8.0f req/s  mean %.3f ms  p50 %.3f ms  p99 %.3f ms" % (
+            name, result["requests_per_sec"], result["mean_ms"], result["p50_ms"], result["p99_ms"]))
+
+    if server is not None:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Benchmark of plot_segment.extract_data(): the vectorized parser against the
+previous row by row parser (strptime and one vector per position and
+tangent), on a synthetic minute-resolution Horizons vector table. Then the
+number of Bézier segments left by plot_segment.decimate(), and the largest
+distance of a sample from the decimated curve relative to the tolerance.
+
+    python benchmarks/bench_plot_segment.py --days 7
+
+The previous parser built Sage vectors; outside of Sage NumPy arrays take
+their place, which is faster than Sage, so the speedup shown is a lower bound.
+"""
+
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy as np
+
+import plot_segment
+
+START = datetime(2023, 7, 17, 8, 0)
+
+
+def synthetic_vectors(rows, step_seconds=60):
+    """
+    The $$SOE..$$EOE block of a CSV vector table (VEC_TABLE=2) of an object orbiting the Earth
+    """
+
+    lines = []
+    for i in range(rows):
+        t = START + timedelta(seconds=i * step_seconds)
+        jd = (t - datetime(2000, 1, 1, 12)).total_seconds() / 86400 + 2451545.0
+        a = i * step_seconds * 2 * np.pi / 86400
+        x, y, z = 4e5 * np.cos(a), 4e5 * np.sin(a), 1e4 * np.sin(a / 3)
+        vx, vy, vz = -4.6 * np.sin(a), 4.6 * np.cos(a), 0.04 * np.cos(a / 3)
+        lines.append("%.9f, A.D. %s.0000, %.16E, %.16E, %.16E, %.16E, %.16E, %.16E," % (
+            jd, t.strftime("%Y-%b-%d %H:%M:%S"), x, y, z, vx, vy, vz))
+    return "\n".join(lines) + "\n"
+
+
+def extract_data_rowwise(data, get_dates=False, obs_start=None, obs_end=None):
+    """
+    plot_segment.extract_data() before it was vectorized
+    """
+
+    data = data.splitlines()
+    data = [s.split(',')[:-1] for s in data]
+
+    start_obs = datetime.strptime(obs_start, "%Y-%b-%d %H:%M").replace(tzinfo=timezone.utc)
+    end_obs = datetime.strptime(obs_end, "%Y-%b-%d %H:%M").replace(tzinfo=timezone.utc)
+
+    pos, tgt, dates, colors = [], [], [], []
+    for row in data:
+        if get_dates:
+            dates.append(f"{row[1]} {float(row[0])}")
+            extracted = row[1].split(" ", 2)[2].split(".")[0]
+            if start_obs and end_obs and start_obs <= datetime.strptime(extracted, "%Y-%b-%d %H:%M:%S").replace(tzinfo=timezone.utc) <= end_obs:
+                colors.append("red")
+            else:
+                colors.append("yellow")
+        row = [float(u) for u in row[2:]]
+        pos.append(np.array(row[:3]))
+        t = np.array(row[3:])
+        tgt.append(t / np.linalg.norm(t))
+    return pos, tgt, dates, colors
+
+
+def max_error(pos, tgt, runs, keeps):
+    """
+    Largest distance of a sample from the decimated curve of its run
+    """
+
+    worst = 0.0
+    for (first, last), keep in zip(runs, keeps):
+        k = np.setdiff1d(np.arange(first, last), keep)
+        if len(k):
+            segment = np.searchsorted(keep, k) - 1
+            worst = max(worst, plot_segment.bezier_error(pos, tgt, keep[segment], keep[segment + 1], k).max())
+    return worst
+
+
+def best_of(function, repeat):
+    best = float("inf")
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=float, default=7, help="length of the table, at one row per minute")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--tolerance", type=float, default=1e-4, help="decimation tolerance, relative to the scene size")
+    args = parser.parse_args()
+
+    rows = int(args.days * 1440)
+    data = synthetic_vectors(rows)
+    obs_start = (START + timedelta(hours=2, minutes=5)).strftime("%Y-%b-%d %H:%M")
+    obs_end = (START + timedelta(hours=3, minutes=3)).strftime("%Y-%b-%d %H:%M")
+    print("%d rows, %.1f MB" % (rows, len(data) / 1e6))
+
+    pos, tgt, dates, colors = plot_segment.extract_data(data, True, obs_start, obs_end)
+    ref_pos, ref_tgt, ref_dates, ref_colors = extract_data_rowwise(data, True, obs_start, obs_end)
+    assert np.array_equal(pos, np.array(ref_pos))
+    assert np.allclose(tgt, np.array(ref_tgt), rtol=0, atol=1e-15)
+    assert colors.tolist() == ref_colors, "observation window differs"
+    assert [d.split(" ", 1)[1] for d in dates] == [d.split(" ", 2)[2].rsplit(" ", 1)[0] for d in ref_dates]
+
+    for name, function in (("row by row", extract_data_rowwise), ("vectorized", plot_segment.extract_data)):
+        seconds = best_of(lambda: function(data, True, obs_start, obs_end), args.repeat)
+        print("%-11s %8.3f s  %10.0f rows/s" % (name, seconds, rows / seconds))
+
+    tolerance = args.tolerance * np.abs(pos).max()
+    runs = plot_segment.colour_runs(colors)
+    start = time.perf_counter()
+    keeps = [first + plot_segment.decimate(pos[first:last], tgt[first:last], tolerance) for first, last in runs]
+    seconds = time.perf_counter() - start
+    print("decimation  %8.3f s  %d -> %d segments" % (seconds, sum(last - first - 1 for first, last in runs), sum(len(keep) - 1 for keep in keeps)))
+    print("max error   %8.2f of the tolerance" % (max_error(pos, tgt, runs, keeps) / tolerance))
+
+
+if __name__ == "__main__":
+    main()
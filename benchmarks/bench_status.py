@@ -0,0 +1,104 @@
+"""
+Micro-benchmark of PWI4.parse_status(): throughput and the number of
+memory blocks each parsed status keeps alive, for three access patterns:
+
+  parse     parse the response, access nothing
+  tracking  parse and read the four fields the tracking loops print
+  all       parse and read every field
+
+    python benchmarks/bench_status.py --count 20000
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pwi4_client import PWI4, PWI4Status, LazySection
+
+
+def sample_response():
+    """
+    A status response containing every keyword PWI4Status reads
+    """
+
+    lines = []
+    for i, key in enumerate(PWI4Status.status_keys()):
+        name = key.rsplit(".", 1)[-1]
+        if name.startswith("is_") or name in ("exists", "success"):
+            value = "true"
+        elif key == "pwi4.version":
+            value = "4.0.99.15"
+        elif "timestamp" in name or name == "filename":
+            value = "2023-07-17 10:05:00.1234"
+        elif key in ("mount.geometry", "m3.port") or "version_field" in key or "num_points" in key:
+            value = str(i % 5)
+        else:
+            value = "%.6f" % (i * 1.2345)
+        lines.append("%s=%s" % (key, value))
+    return "\n".join(lines).encode("utf-8")
+
+
+def read_tracking(s):
+    return (s.mount.ra_j2000_hours, s.mount.dec_j2000_degs,
+            s.mount.axis0.dist_to_target_arcsec, s.mount.axis1.dist_to_target_arcsec)
+
+
+def read_all(section):
+    for name in type(section)._fields:
+        value = getattr(section, name)
+        if isinstance(value, LazySection):
+            read_all(value)
+
+
+SCENARIOS = {
+    "parse": lambda s: None,
+    "tracking": read_tracking,
+    "all": read_all,
+}
+
+
+def throughput(pwi4, response, access, count):
+    start = time.perf_counter()
+    for i in range(count):
+        access(pwi4.parse_status(response))
+    return count / (time.perf_counter() - start)
+
+
+def blocks_per_status(pwi4, response, access, count):
+    kept = []
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for i in range(count):
+        s = pwi4.parse_status(response)
+        access(s)
+        kept.append(s)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    stats = after.compare_to(before, "filename")
+    blocks = sum(stat.count_diff for stat in stats)
+    size = sum(stat.size_diff for stat in stats)
+    return blocks / count, size / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=20000)
+    args = parser.parse_args()
+
+    pwi4 = PWI4()
+    response = sample_response()
+    print("response: %d keywords, %d bytes" % (response.count(b"\n") + 1, len(response)))
+
+    for name, access in SCENARIOS.items():
+        rate = throughput(pwi4, response, access, args.count)
+        blocks, size = blocks_per_status(pwi4, response, access, min(args.count, 2000))
+        print("%-9s %9.0f status/s  %6.1f blocks/status  %8.0f bytes/status" % (name, rate, blocks, size))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,437 @@
+"""
+End-to-end benchmarks of the tracking pipeline, written to JSON so runs on
+different commits can be compared.
+
+Each stage is timed separately:
+
+  horizons_parse     track.load_ephemerides() of a synthesized Horizons table,
+                     through HorizonsCache.fetch(), cold and warm cache
+  cache_fetch        HorizonsCache.fetch() of a window, cold and from disk
+  interpolate        one per-tick EphemerisTable.interpolate() call, linear and hermite
+  altaz              per-tick Alt/Az: SkyCoord.transform_to() vs AltAzTable.at()
+  http               PWI4HttpCommunicator.request() round trips to the simulator
+  status_parse       PWI4.parse_status() of a full simulated status response
+  instrument         cost of one instrument.span(), disabled and enabled
+  tracking_loop      track.track() against the simulator, goto and path mode:
+                     sustained loop rate and tick interval jitter
+
+No PWI4 installation or network access is needed: Horizons responses are
+synthesized and PWI4 is replaced by pwi4_simulator. Stages whose
+dependencies (numpy, astropy, astroquery) are not installed are skipped.
+
+    python benchmarks/run_benchmarks.py --output results.json
+    python benchmarks/run_benchmarks.py --compare results.json
+
+With --compare, throughput metrics that dropped by more than --tolerance
+are reported and the exit status is 1.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+import instrument
+from pwi4_client import PWI4
+from pwi4_simulator import start_simulator
+
+# Synthetic target moving like a fast near-Earth object, about 100''/min
+RA0_DEGS = 150.0
+DEC0_DEGS = -20.0
+RA_RATE_DEGS_PER_SEC = 0.02 / 60
+DEC_RATE_DEGS_PER_SEC = -0.01 / 60
+
+
+def timings(function, count):
+    """
+    Call function count times and summarize the duration of each call
+    """
+
+    durations = []
+    start = time.perf_counter()
+    for i in range(count):
+        t0 = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - start
+    result = summarize(durations, "us", 1e6)
+    result["ops_per_sec"] = count / elapsed
+    return result
+
+
+def summarize(values, unit, scale):
+    values = sorted(values)
+    n = len(values)
+    mean = sum(values) / n
+    std = (sum((v - mean) ** 2 for v in values) / n) ** 0.5
+    return {
+        "count": n,
+        "mean_" + unit: mean * scale,
+        "std_" + unit: std * scale,
+        "p50_" + unit: values[n // 2] * scale,
+        "p99_" + unit: values[min(n - 1, int(n * 0.99))] * scale,
+        "max_" + unit: values[-1] * scale,
+    }
+
+
+def synthetic_columns(start_jd, interval_seconds, steps):
+    """
+    Ephemeris columns in the units track.query_horizons() returns them
+    """
+
+    import numpy as np
+
+    from ephemeris import horizons_rates_to_degs
+
+    seconds = np.arange(steps) * interval_seconds
+    dec = DEC0_DEGS + DEC_RATE_DEGS_PER_SEC * seconds
+    # Horizons gives rates in arcsec/h, with the RA rate including cos(dec)
+    ra_rate = RA_RATE_DEGS_PER_SEC * 3600 * 3600 * np.cos(np.radians(dec))
+    dec_rate = np.full(steps, DEC_RATE_DEGS_PER_SEC * 3600 * 3600)
+    columns = {
+        "jd": start_jd + seconds / 86400,
+        "ra": RA0_DEGS + RA_RATE_DEGS_PER_SEC * seconds,
+        "dec": dec,
+    }
+    columns["ra_rate"], columns["dec_rate"] = horizons_rates_to_degs(ra_rate, dec_rate, dec)
+    return columns, ra_rate, dec_rate
+
+
+def synthetic_table(start, interval_seconds, steps, mode="hermite"):
+    from ephemeris import EphemerisTable, datetime_to_jd
+
+    columns, _, _ = synthetic_columns(datetime_to_jd(start), interval_seconds, steps)
+    return EphemerisTable(columns["jd"], columns["ra"], columns["dec"], columns["ra_rate"], columns["dec_rate"], mode=mode)
+
+
+### Stages #################################################
+
+def bench_horizons_parse(args):
+    from astropy.table import Table
+    import astropy.units as u
+
+    import track
+    from horizons_cache import HorizonsCache
+
+    class Horizons:
+        """
+        Stands in for astroquery's Horizons: ephemerides() returns a synthesized table for the epochs
+        """
+
+        def __init__(self, id, location, epochs):
+            self.epochs = epochs
+
+        def ephemerides(self):
+            columns, ra_rate, dec_rate = synthetic_columns(self.epochs[0], track.INTERVAL_SECONDS, len(self.epochs))
+            eph = Table()
+            eph["datetime_jd"] = columns["jd"] * u.d
+            eph["RA"] = columns["ra"] * u.deg
+            eph["DEC"] = columns["dec"] * u.deg
+            eph["RA_rate"] = ra_rate * u.arcsec / u.hour
+            eph["DEC_rate"] = dec_rate * u.arcsec / u.hour
+            return eph
+
+    # the whole of track.load_ephemerides(): the Horizons columns, HorizonsCache.fetch(),
+    # the EphemerisTable, its error bound and the AltAzTable, with the cache empty and with the window on disk
+    t_0 = datetime.utcnow()
+    directory = tempfile.mkdtemp(prefix="ephemeritrack-bench-")
+    horizons, cache = track.Horizons, track.cache
+    try:
+        track.Horizons = Horizons
+        track.cache = HorizonsCache(directory)
+
+        def cold():
+            track.cache.clear()
+            track.load_ephemerides(t_0)
+
+        def warm():
+            track.load_ephemerides(t_0)
+
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            result = {"cold": timings(cold, args.count // 100)}
+            track.load_ephemerides(t_0)
+            result["warm"] = timings(warm, args.count // 100)
+        return result
+    finally:
+        track.Horizons, track.cache = horizons, cache
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def bench_cache_fetch(args):
+    from ephemeris import now_jd
+    from horizons_cache import HorizonsCache, snap_jd
+
+    interval, steps = 60, 60
+    start_jd = snap_jd(now_jd(), interval)
+    stop_jd = start_jd + steps * interval / 86400
+
+    def fetch_span(jds):
+        return synthetic_columns(jds[0], interval, len(jds))[0]
+
+    directory = tempfile.mkdtemp(prefix="ephemeritrack-bench-")
+    try:
+        cache = HorizonsCache(directory)
+        key = {"target": "bench", "location": "X07", "quantities": "ra,dec,rates"}
+
+        def cold():
+            cache.clear()
+            cache.fetch(key, start_jd, stop_jd, interval, fetch_span)
+
+        def warm():
+            cache.fetch(key, start_jd, stop_jd, interval, fetch_span)
+
+        result = {"cold": timings(cold, args.count // 100)}
+        cache.fetch(key, start_jd, stop_jd, interval, fetch_span)
+        result["warm"] = timings(warm, args.count // 100)
+        return result
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def bench_interpolate(args):
+    import numpy as np
+
+    from ephemeris import datetime_to_jd
+
+    start = datetime.utcnow()
+    result = {}
+    for mode, interval in (("linear", 5), ("hermite", 60)):
+        table = synthetic_table(start, interval, 60, mode)
+        jds = datetime_to_jd(start) + np.random.uniform(0, 59 * interval, args.count) / 86400
+        it = iter(jds.tolist())
+        result[mode] = timings(lambda: table.interpolate(next(it)), args.count)
+    return result
+
+
+def bench_altaz(args):
+    from astropy.coordinates import SkyCoord, AltAz, EarthLocation
+    from astropy.time import Time
+    import astropy.units as u
+
+    from ephemeris import AltAzTable, datetime_to_jd
+
+    location = EarthLocation(lat=-30.52630901637761*u.deg, lon=-70.85329602458852*u.deg, height=1710*u.m)
+    start = datetime.utcnow()
+    table = synthetic_table(start, 60, 60)
+    startjd = datetime_to_jd(start)
+
+    def skycoord():
+        # what track.py did every tick before AltAzTable
+        t = Time.now()
+        SkyCoord(RA0_DEGS*u.deg, DEC0_DEGS*u.deg).transform_to(AltAz(obstime=t, location=location))
+
+    t0 = time.perf_counter()
+    altaz = AltAzTable.from_ephemeris(table, location)
+    build_seconds = time.perf_counter() - t0
+
+    jd = [startjd + i * 0.01 / 86400 for i in range(args.count)]
+    it = iter(jd)
+    return {
+        "skycoord_transform": timings(skycoord, args.count // 100),
+        "table_build_ms": build_seconds * 1000,
+        "table_error_arcsec": altaz.error_arcsec,
+        "table_at": timings(lambda: altaz.at(next(it)), args.count),
+    }
+
+
+def bench_http(args, address):
+    pwi4 = PWI4(*address)
+    pwi4.mount_connect()
+    result = {
+        "status": timings(pwi4.status, args.count // 5),
+        "goto": timings(lambda: pwi4.mount_goto_ra_dec_j2000(RA0_DEGS / 15, DEC0_DEGS), args.count // 5),
+    }
+    pwi4.comm.close()
+    return result
+
+
+def bench_status_parse(args, address):
+    pwi4 = PWI4(*address)
+    payload = pwi4.request("/status")
+    pwi4.comm.close()
+
+    def parse_tracking():
+        s = pwi4.parse_status(payload)
+        return s.mount.ra_j2000_hours, s.mount.dec_j2000_degs, s.mount.axis0.dist_to_target_arcsec, s.mount.axis1.dist_to_target_arcsec
+
+    return {
+        "parse": timings(lambda: pwi4.parse_status(payload), args.count),
+        "parse_tracking_fields": timings(parse_tracking, args.count),
+    }
+
+
+def bench_instrument(args):
+    def empty_span():
+        with instrument.span("bench"):
+            pass
+
+    enabled = instrument.is_enabled()
+    try:
+        instrument.disable()
+        result = {"disabled": timings(empty_span, args.count)}
+        instrument.enable()
+        result["enabled"] = timings(empty_span, args.count)
+    finally:
+        if not enabled:
+            instrument.disable()
+        instrument.histograms.pop("bench", None)
+    return result
+
+
+def bench_tracking_loop(args, address):
+    import track
+    from ephemeris import AltAzTable, EphemerisPrefetcher
+
+    def load(start):
+        table = synthetic_table(start, track.INTERVAL_SECONDS, track.STEPS, track.INTERPOLATION)
+        table.altaz = AltAzTable.from_ephemeris(table, track.location)
+        return table
+
+    result = {}
+    mode = track.TRACK_MODE
+    try:
+        for track_mode in ("goto", "path"):
+            track.TRACK_MODE = track_mode
+            prefetcher = EphemerisPrefetcher(load, lead_seconds=track.PREFETCH_LEAD_SECONDS, overlap_seconds=track.INTERVAL_SECONDS)
+            prefetcher.start()
+            pwi4 = PWI4(*address)
+            ticks = []
+
+            # start on target, so the final distance measures tracking and not the initial slew
+            pwi4.mount_connect()
+            pwi4.mount_goto_ra_dec_j2000(RA0_DEGS / 15, DEC0_DEGS)
+            deadline = time.time() + 120
+            while pwi4.status().mount.is_slewing and time.time() < deadline:
+                time.sleep(0.1)
+
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                track.track(prefetcher, True, pwi4=pwi4, run_seconds=args.loop_seconds, on_tick=lambda jd: ticks.append(time.perf_counter()))
+
+            prefetcher.stop()
+            status = pwi4.status()
+            pwi4.comm.close()
+
+            intervals = [b - a for a, b in zip(ticks, ticks[1:])]
+            stats = summarize(intervals, "interval_ms", 1000)
+            stats["loop_hz"] = len(intervals) / (ticks[-1] - ticks[0])
+            stats["jitter_ms"] = stats.pop("std_interval_ms")
+            stats["final_dist_to_target_arcsec"] = max(abs(status.mount.axis0.dist_to_target_arcsec), abs(status.mount.axis1.dist_to_target_arcsec))
+            result[track_mode] = stats
+    finally:
+        track.TRACK_MODE = mode
+    return result
+
+
+### Running and comparing ##################################
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def throughputs(results, prefix=""):
+    """
+    Flatten all higher-is-better metrics (ops_per_sec, loop_hz) into {"stage.case.metric": value}
+    """
+
+    flat = {}
+    for name, value in results.items():
+        if isinstance(value, dict):
+            flat.update(throughputs(value, prefix + name + "."))
+        elif name in ("ops_per_sec", "loop_hz"):
+            flat[prefix + name] = value
+    return flat
+
+
+def compare(baseline, current, tolerance):
+    old = throughputs(baseline["results"])
+    new = throughputs(current["results"])
+    regressions = []
+    print("%-50s %12s %12s %8s" % ("metric", "baseline", "current", "ratio"), file=sys.stderr)
+    for name in sorted(set(old) & set(new)):
+        ratio = new[name] / old[name] if old[name] else float("inf")
+        flag = ""
+        if ratio < 1 - tolerance:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print("%-50s %12.1f %12.1f %8.2f%s" % (name, old[name], new[name], ratio, flag), file=sys.stderr)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=10000, help="iterations of the per-call benchmarks")
+    parser.add_argument("--loop-seconds", type=float, default=10.0, help="duration of each tracking loop run")
+    parser.add_argument("--latency", type=float, default=0.0, help="latency the simulated PWI4 adds to every request, in seconds")
+    parser.add_argument("--only", nargs="*", help="run only these stages")
+    parser.add_argument("--output", help="write the results to this JSON file (default: stdout)")
+    parser.add_argument("--compare", help="compare with the results in this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="relative throughput drop reported as a regression")
+    args = parser.parse_args()
+
+    server = start_simulator(port=0, latency_seconds=args.latency)
+    address = server.server_address
+
+    stages = [
+        ("horizons_parse", lambda: bench_horizons_parse(args)),
+        ("cache_fetch", lambda: bench_cache_fetch(args)),
+        ("interpolate", lambda: bench_interpolate(args)),
+        ("altaz", lambda: bench_altaz(args)),
+        ("http", lambda: bench_http(args, address)),
+        ("status_parse", lambda: bench_status_parse(args, address)),
+        ("instrument", lambda: bench_instrument(args)),
+        ("tracking_loop", lambda: bench_tracking_loop(args, address)),
+    ]
+
+    results = {}
+    for name, run in stages:
+        if args.only and name not in args.only:
+            continue
+        print("Running %s..." % name, file=sys.stderr)
+        try:
+            results[name] = run()
+        except ImportError as e:
+            print("  skipped: %s" % e, file=sys.stderr)
+            results[name] = {"skipped": str(e)}
+
+    server.shutdown()
+
+    report = {
+        "commit": git_commit(),
+        "timestamp_utc": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {"count": args.count, "loop_seconds": args.loop_seconds, "latency": args.latency},
+        "results": results,
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, report, args.tolerance)
+        if regressions:
+            print("%d metric(s) regressed by more than %d%%" % (len(regressions), args.tolerance * 100), file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
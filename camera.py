@@ -0,0 +1,160 @@
+"""
+Cameras for the acquisition scripts, with the operations mosaic.py uses:
+binning, exposing with a filter, polling until the image is ready, and saving.
+
+Two backends:
+
+- MaxImCamera controls a real camera through MaxIm DL's COM interface (Windows only)
+- PWI4VirtualCamera takes the simulated starfield of PWI4's virtual camera,
+  so the whole slew/expose/save pipeline also runs on Linux, e.g. against
+  pwi4_simulator.py
+
+    camera = open_camera("pwi4", pwi4=pwi4, time_scale=0.01)
+    camera.set_binning(2)
+    camera.expose(180, filter=1)
+    camera.wait_until_ready()
+    camera.save("image.fit")
+"""
+
+import time
+
+
+class Camera:
+    def connect(self):
+        pass
+
+    def cooler_on(self):
+        """
+        Turn the cooler on and return whether it is on
+        """
+
+        return False
+
+    def set_binning(self, x, y=None):
+        raise NotImplementedError()
+
+    def expose(self, seconds, light=True, filter=0):
+        """
+        Start an exposure and return immediately
+        """
+
+        raise NotImplementedError()
+
+    @property
+    def image_ready(self):
+        raise NotImplementedError()
+
+    def wait_until_ready(self, poll_seconds=0.01):
+        while not self.image_ready:
+            time.sleep(poll_seconds)
+
+    def save(self, path):
+        raise NotImplementedError()
+
+
+class MaxImCamera(Camera):
+    """
+    Camera connected in MaxIm DL. If you don't know what your driver is called, use the ASCOM Chooser.
+    """
+
+    def __init__(self, name="MaxIm.CCDCamera"):
+        self.name = name
+        self.camera = None
+
+    def connect(self):
+        import win32com.client
+
+        self.camera = win32com.client.Dispatch(self.name)
+        self.camera.LinkEnabled = True
+        if not self.camera.LinkEnabled:
+            raise RuntimeError("Failed to start camera")
+
+    def cooler_on(self):
+        self.camera.CoolerOn = True
+        return bool(self.camera.CoolerOn)
+
+    def set_binning(self, x, y=None):
+        self.camera.BinX = x
+        self.camera.BinY = x if y is None else y
+
+    def expose(self, seconds, light=True, filter=0):
+        self.camera.Expose(seconds, 1 if light else 0, filter)
+
+    @property
+    def image_ready(self):
+        return self.camera.ImageReady
+
+    def save(self, path):
+        self.camera.SaveImage(path)
+
+
+class PWI4VirtualCamera(Camera):
+    """
+    Simulated camera on top of PWI4's virtual camera. An exposure takes
+    seconds * time_scale of real time, then the image is read from PWI4 into
+    a buffer that is reused for every frame. Binning and filters are only
+    recorded, the virtual camera has neither.
+    """
+
+    def __init__(self, pwi4, time_scale=1.0):
+        self.pwi4 = pwi4
+        self.time_scale = time_scale
+        self.binning = (1, 1)
+        self.filter = None
+
+        self._buffer = None
+        self._size = 0
+        self._ready_at = None
+        self._downloaded = False
+
+    def set_binning(self, x, y=None):
+        self.binning = (x, x if y is None else y)
+
+    def expose(self, seconds, light=True, filter=0):
+        self.filter = filter
+        self._ready_at = time.monotonic() + seconds * self.time_scale
+        self._downloaded = False
+
+    @property
+    def image_ready(self):
+        if self._ready_at is None or time.monotonic() < self._ready_at:
+            return False
+        if not self._downloaded:
+            # like a real camera, the image shows the sky at the end of the exposure, wherever the mount goes afterwards
+            self._download()
+        return True
+
+    def _download(self):
+        if self._buffer is None:
+            image = self.pwi4.virtualcamera_take_image()
+            self._buffer = bytearray(image)
+            self._size = len(image)
+        else:
+            try:
+                self._size = self.pwi4.virtualcamera_take_image_into(self._buffer)
+            except ValueError:
+                # the image got larger, e.g. a different sensor size was configured
+                self._buffer = None
+                return self._download()
+        self._downloaded = True
+
+    def save(self, path):
+        if not self._downloaded:
+            raise RuntimeError("No image to save")
+        with open(path, "wb") as f:
+            f.write(memoryview(self._buffer)[:self._size])
+
+
+def open_camera(kind, pwi4=None, time_scale=1.0):
+    """
+    Connect to a "maxim" or "pwi4" (virtual) camera
+    """
+
+    if kind == "maxim":
+        camera = MaxImCamera()
+    elif kind == "pwi4":
+        camera = PWI4VirtualCamera(pwi4, time_scale)
+    else:
+        raise ValueError("Unknown camera: " + kind)
+    camera.connect()
+    return camera
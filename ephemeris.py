@@ -0,0 +1,513 @@
+"""
+Array-backed ephemeris tables for the tracking scripts.
+
+An EphemerisTable stores the epochs of an ephemeris as float64 Julian Dates
+together with the J2000 RA/Dec (in degrees) of the target at each epoch.
+Bracketing epochs are found with numpy.searchsorted, so a lookup costs
+O(log n) instead of a walk over every row, and many query times can be
+evaluated in one vectorized call.
+"""
+
+import threading
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+# Julian Date of the Unix epoch (1970-01-01 00:00 UTC)
+JD_UNIX_EPOCH = 2440587.5
+SECONDS_PER_DAY = 86400.0
+
+
+def datetime_to_jd(dt):
+    """
+    Convert a datetime to a Julian Date. Naive datetimes are taken to be UTC,
+    matching datetime.utcnow() as used by the tracking loops.
+    """
+
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp() / SECONDS_PER_DAY + JD_UNIX_EPOCH
+
+
+def jd_to_datetime(jd):
+    """
+    Convert a Julian Date to a naive UTC datetime
+    """
+
+    seconds = (jd - JD_UNIX_EPOCH) * SECONDS_PER_DAY
+    return datetime.fromtimestamp(seconds, timezone.utc).replace(tzinfo=None)
+
+
+def now_jd():
+    return datetime_to_jd(datetime.utcnow())
+
+
+def horizons_rates_to_degs(ra_rate, dec_rate, dec):
+    """
+    Convert the Horizons RA_rate (d(RA)/dt * cos(Dec)) and DEC_rate columns,
+    both in arcsec per hour, to dRA/dt and dDec/dt in degrees per second.
+
+    Note that Horizons reports the rates of the apparent position, which
+    differ slightly in direction from the rates of the J2000 coordinates.
+    error_bound_arcsec() includes the effect of this on the interpolation.
+    """
+
+    ra_rate = np.asarray(ra_rate, dtype=np.float64) / np.cos(np.radians(np.asarray(dec, dtype=np.float64)))
+    dec_rate = np.asarray(dec_rate, dtype=np.float64)
+    return ra_rate / 3600 / 3600, dec_rate / 3600 / 3600
+
+
+class EphemerisTable:
+    """
+    Ephemeris of a single target, backed by numpy arrays.
+
+    jd:  epochs as Julian Dates (UTC), strictly increasing
+    ra:  J2000 right ascension in degrees
+    dec: J2000 declination in degrees
+
+    ra_rate, dec_rate: optional dRA/dt and dDec/dt in degrees per second.
+    When they are given and mode is "hermite", positions are interpolated
+    with cubic Hermite splines, which are accurate on a much sparser grid
+    than linear interpolation. error_bound_arcsec() estimates the error of
+    the active mode from the table itself.
+
+    Iterating over the table, len(), items() and indexing by datetime behave
+    like the {datetime: SkyCoord} dict that track.py used to build, so older
+    code keeps working while the tracking loop uses interpolate() directly.
+    """
+
+    def __init__(self, jd, ra, dec, ra_rate=None, dec_rate=None, mode="linear"):
+        jd = np.asarray(jd, dtype=np.float64)
+        ra = np.asarray(ra, dtype=np.float64)
+        dec = np.asarray(dec, dtype=np.float64)
+
+        if not (jd.shape == ra.shape == dec.shape) or jd.ndim != 1:
+            raise ValueError("jd, ra and dec must be 1-dimensional arrays of equal length")
+        if mode not in ("linear", "hermite"):
+            raise ValueError("mode must be 'linear' or 'hermite'")
+        if mode == "hermite" and (ra_rate is None or dec_rate is None):
+            raise ValueError("hermite interpolation needs ra_rate and dec_rate")
+
+        order = np.argsort(jd, kind="stable")
+        self.jd = jd[order]
+        self.dec = dec[order]
+        # Unwrap RA so that interpolating across 0h does not sweep through 12h
+        self.ra = np.unwrap(ra[order], period=360.0)
+
+        self.mode = mode
+        self.ra_rate = np.asarray(ra_rate, dtype=np.float64)[order] if ra_rate is not None else None
+        self.dec_rate = np.asarray(dec_rate, dtype=np.float64)[order] if dec_rate is not None else None
+
+        # Interpolation is done in seconds relative to the first epoch, which
+        # keeps full float64 resolution for the fractional part of the epochs
+        self.jd0 = self.jd[0] if len(self.jd) else 0.0
+        self.t = (self.jd - self.jd0) * SECONDS_PER_DAY
+
+        # optional AltAzTable for the same window, see AltAzTable.from_ephemeris
+        self.altaz = None
+
+    @classmethod
+    def from_horizons(cls, eph, mode="linear"):
+        """
+        Build a table from an astroquery.jplhorizons ephemerides() result.
+        The RA_rate/DEC_rate columns are used when present.
+        """
+
+        if "datetime_jd" in eph.columns:
+            jd = np.asarray(eph["datetime_jd"], dtype=np.float64)
+        else:
+            jd = [datetime_to_jd(datetime.strptime(s[:-4], "%Y-%b-%d %H:%M:%S")) for s in eph["datetime_str"]]
+
+        ra_rate = dec_rate = None
+        if "RA_rate" in eph.columns and "DEC_rate" in eph.columns:
+            ra_rate, dec_rate = horizons_rates_to_degs(eph["RA_rate"], eph["DEC_rate"], eph["DEC"])
+        elif mode == "hermite":
+            raise ValueError("hermite interpolation needs the RA_rate and DEC_rate columns")
+
+        return cls(jd, np.asarray(eph["RA"]), np.asarray(eph["DEC"]), ra_rate, dec_rate, mode)
+
+    ### Coverage ###########################################
+
+    @property
+    def start_jd(self):
+        return self.jd[0]
+
+    @property
+    def end_jd(self):
+        return self.jd[-1]
+
+    def covers(self, jd):
+        return self.jd[0] <= jd <= self.jd[-1]
+
+    def remaining_seconds(self, jd):
+        """
+        Seconds of ephemeris left after the given time
+        """
+
+        return (self.jd[-1] - jd) * SECONDS_PER_DAY
+
+    ### Lookup and interpolation ###########################
+
+    def _seconds(self, jd):
+        return (np.asarray(jd, dtype=np.float64) - self.jd0) * SECONDS_PER_DAY
+
+    def bracket(self, jd):
+        """
+        Return the indices (start, end) of the epochs bracketing each query time,
+        with t[start] < t <= t[end]. Raises if any time lies outside the table.
+        """
+
+        t = self._seconds(jd)
+        end = np.searchsorted(self.t, t, side="left")
+
+        if np.any(end >= len(self.t)):
+            raise Exception("ran out of ephemerides need new ones")
+        if np.any(end == 0):
+            raise Exception("need earlier ephemerides")
+
+        return end - 1, end
+
+    def interpolate(self, jd):
+        """
+        Interpolate the position at one or more Julian Dates.
+
+        Returns (ra_degs, dec_degs, ra_rate, dec_rate) where the rates are in
+        degrees per second. Scalars in give scalars out, arrays give arrays.
+        """
+
+        start, end = self.bracket(jd)
+        t = self._seconds(jd)
+
+        if self.mode == "hermite":
+            ra, ra_rate = self._hermite(self.ra, self.ra_rate, start, end, t)
+            dec, dec_rate = self._hermite(self.dec, self.dec_rate, start, end, t)
+            return np.mod(ra, 360.0), dec, ra_rate, dec_rate
+
+        timediff = self.t[end] - self.t[start]
+        p = (t - self.t[start]) / timediff
+
+        ra_rate = (self.ra[end] - self.ra[start]) / timediff
+        dec_rate = (self.dec[end] - self.dec[start]) / timediff
+
+        ra = self.ra[start] * (1 - p) + self.ra[end] * p
+        dec = self.dec[start] * (1 - p) + self.dec[end] * p
+
+        return np.mod(ra, 360.0), dec, ra_rate, dec_rate
+
+    def _hermite(self, values, rates, start, end, t):
+        """
+        Cubic Hermite interpolation of values (with derivatives rates)
+        between the epochs start and end. Returns the value and its derivative.
+        """
+
+        h = self.t[end] - self.t[start]
+        s = (t - self.t[start]) / h
+        s2 = s*s
+        s3 = s2*s
+
+        p0, p1 = values[start], values[end]
+        m0, m1 = rates[start]*h, rates[end]*h
+
+        value = (2*s3 - 3*s2 + 1)*p0 + (s3 - 2*s2 + s)*m0 + (-2*s3 + 3*s2)*p1 + (s3 - s2)*m1
+        rate = ((6*s2 - 6*s)*p0 + (3*s2 - 4*s + 1)*m0 + (-6*s2 + 6*s)*p1 + (3*s2 - 2*s)*m1) / h
+        return value, rate
+
+    def error_bound_arcsec(self):
+        """
+        Estimate the largest interpolation error of the active mode, in arcsec.
+
+        Every interior epoch is predicted from its two neighbours, i.e. on a
+        grid twice as coarse as the table, and compared with the tabulated
+        position. The error of cubic Hermite interpolation scales with the
+        fourth power of the spacing and that of linear interpolation with the
+        second, so the result is scaled down by 16 or 4 respectively.
+
+        In hermite mode the rates are apparent while the positions are J2000,
+        so the rates differ from the derivative of the positions. The error
+        this causes only scales with the spacing, so it is taken out of the
+        coarse grid estimate and bounded separately on the table's grid.
+        """
+
+        if len(self.t) < 3:
+            return float("nan")
+
+        start = np.arange(0, len(self.t) - 2)
+        end = start + 2
+        middle = start + 1
+        t = self.t[middle]
+
+        if self.mode == "hermite":
+            ra, _ = self._hermite(self.ra, self.ra_rate, start, end, t)
+            dec, _ = self._hermite(self.dec, self.dec_rate, start, end, t)
+            scale = 16
+
+            # difference of the rates from the derivative of the positions, which is accurate to second order
+            ra_mismatch = self.ra_rate - np.gradient(self.ra, self.t, edge_order=2)
+            dec_mismatch = self.dec_rate - np.gradient(self.dec, self.t, edge_order=2)
+            # at the middle of an interval of length h it adds h*(mismatch at start - mismatch at end)/8
+            h = self.t[end] - self.t[start]
+            ra = ra - h * (ra_mismatch[start] - ra_mismatch[end]) / 8
+            dec = dec - h * (dec_mismatch[start] - dec_mismatch[end]) / 8
+
+            # on the table's grid, the weight of either rate is at most 4/27 of the spacing
+            h = np.diff(self.t)
+            cos_dec = np.cos(np.radians(self.dec[:-1]))
+            rate_error = 4 / 27 * h * np.hypot((np.abs(ra_mismatch[:-1]) + np.abs(ra_mismatch[1:])) * cos_dec,
+                                               np.abs(dec_mismatch[:-1]) + np.abs(dec_mismatch[1:]))
+            rate_error = float(rate_error.max() * 3600)
+        else:
+            p = (t - self.t[start]) / (self.t[end] - self.t[start])
+            ra = self.ra[start] * (1 - p) + self.ra[end] * p
+            dec = self.dec[start] * (1 - p) + self.dec[end] * p
+            scale = 4
+            rate_error = 0.0
+
+        dra = (ra - self.ra[middle]) * np.cos(np.radians(self.dec[middle]))
+        ddec = dec - self.dec[middle]
+        return float(np.hypot(dra, ddec).max() * 3600 / scale) + rate_error
+
+    def at(self, dt):
+        """
+        Interpolate the position at a single datetime
+        """
+
+        return self.interpolate(datetime_to_jd(dt))
+
+    ### dict compatibility #################################
+
+    def datetimes(self):
+        return [jd_to_datetime(jd) for jd in self.jd]
+
+    def __len__(self):
+        return len(self.jd)
+
+    def __iter__(self):
+        return iter(self.datetimes())
+
+    def keys(self):
+        return self.datetimes()
+
+    def values(self):
+        return [self.coord(i) for i in range(len(self))]
+
+    def items(self):
+        return list(zip(self.datetimes(), self.values()))
+
+    def coord(self, index):
+        from astropy.coordinates import SkyCoord
+        import astropy.units as u
+
+        return SkyCoord(self.ra[index] % 360.0, self.dec[index], unit=(u.deg, u.deg))
+
+    def __getitem__(self, dt):
+        jd = datetime_to_jd(dt)
+        index = np.searchsorted(self.jd, jd)
+        # Exact epochs only, within a millisecond, like the dict lookup
+        if index < len(self.jd) and abs(self.jd[index] - jd) * SECONDS_PER_DAY < 1e-3:
+            return self.coord(index)
+        if index > 0 and abs(self.jd[index - 1] - jd) * SECONDS_PER_DAY < 1e-3:
+            return self.coord(index - 1)
+        raise KeyError(dt)
+
+    def __contains__(self, dt):
+        try:
+            self[dt]
+            return True
+        except KeyError:
+            return False
+
+    def __repr__(self):
+        if len(self) == 0:
+            return "EphemerisTable(empty)"
+        return "EphemerisTable(%d epochs, %s .. %s)" % (len(self), jd_to_datetime(self.jd[0]), jd_to_datetime(self.jd[-1]))
+
+
+class EphemerisPrefetcher:
+    """
+    Keeps an EphemerisTable current by fetching the next window in a
+    background thread before the active one runs out.
+
+    load(start) is called with a naive UTC datetime and must return an
+    EphemerisTable starting at or before that time. The next window is
+    requested once the active one covers less than lead_seconds, and it
+    starts overlap_seconds in the past, so the new table already covers
+    "now" when it is swapped in and tracking never waits for Horizons.
+
+    worst_remaining_seconds is the smallest coverage that was left at the
+    moment a new window was swapped in (or at any check, if smaller), which
+    shows how close the tracker came to stalling.
+    """
+
+    def __init__(self, load, lead_seconds=120, overlap_seconds=10, check_interval=1.0, retry_seconds=5.0):
+        self.load = load
+        self.lead_seconds = lead_seconds
+        self.overlap_seconds = overlap_seconds
+        self.check_interval = check_interval
+        self.retry_seconds = retry_seconds
+
+        self.table = None
+        self.generation = 0
+        self.worst_remaining_seconds = None
+        self.last_error = None
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Load the first window synchronously, then start the background thread
+        """
+
+        if self.table is None:
+            self.refresh()
+        self._thread = threading.Thread(target=self._run, name="EphemerisPrefetcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def refresh(self):
+        """
+        Fetch a new window starting overlap_seconds before now and swap it in
+        """
+
+        start = datetime.utcnow() - timedelta(seconds=self.overlap_seconds)
+        table = self.load(start)
+
+        with self._lock:
+            if self.table is not None:
+                self._record(self.table.remaining_seconds(now_jd()))
+            self.table = table
+            self.generation += 1
+
+        return table
+
+    def _record(self, remaining):
+        if self.worst_remaining_seconds is None or remaining < self.worst_remaining_seconds:
+            self.worst_remaining_seconds = remaining
+
+    def _run(self):
+        while not self._stop.is_set():
+            remaining = self.remaining_seconds()
+            with self._lock:
+                self._record(remaining)
+            if remaining < self.lead_seconds:
+                try:
+                    self.refresh()
+                    self.last_error = None
+                except Exception as e:
+                    # Keep tracking on the old window and try again shortly
+                    self.last_error = e
+                    self._stop.wait(self.retry_seconds)
+                    continue
+            self._stop.wait(self.check_interval)
+
+    ### Same interface as EphemerisTable for the tracking loop ##
+
+    def remaining_seconds(self, jd=None):
+        if jd is None:
+            jd = now_jd()
+        return self.table.remaining_seconds(jd)
+
+    def interpolate(self, jd):
+        return self.table.interpolate(jd)
+
+    def at(self, dt):
+        return self.table.at(dt)
+
+
+class AltAzTable:
+    """
+    Alt/Az of a moving RA/Dec position over a whole window, computed with a
+    single batched astropy transform and linearly interpolated per tick.
+
+    On construction the interpolation is checked against exact transforms at
+    a few points halfway between samples. If the largest difference exceeds
+    tolerance_arcsec, at() falls back to an exact per-call transform.
+    """
+
+    def __init__(self, jd, ra, dec, location, tolerance_arcsec=1.0, check_points=8):
+        from astropy.coordinates import SkyCoord, AltAz
+        from astropy.time import Time
+        import astropy.units as u
+
+        self.location = location
+        self.tolerance_arcsec = tolerance_arcsec
+
+        self.jd = np.asarray(jd, dtype=np.float64)
+        self.ra = np.unwrap(np.asarray(ra, dtype=np.float64), period=360.0)
+        self.dec = np.asarray(dec, dtype=np.float64)
+        self.jd0 = self.jd[0]
+        self.t = (self.jd - self.jd0) * SECONDS_PER_DAY
+
+        coords = SkyCoord(self.ra % 360.0, self.dec, unit=(u.deg, u.deg))
+        altaz = coords.transform_to(AltAz(obstime=Time(self.jd, format="jd", scale="utc"), location=location))
+        self.alt = altaz.alt.deg
+        self.az = np.unwrap(altaz.az.deg, period=360.0)
+
+        self.error_arcsec = self._check(check_points)
+        self.exact = self.error_arcsec > tolerance_arcsec
+
+    @classmethod
+    def from_ephemeris(cls, table, location, step_seconds=10, **kwargs):
+        """
+        Build from an EphemerisTable, sampled every step_seconds
+        """
+
+        t = np.arange(table.t[1], table.t[-1], step_seconds)
+        jd = np.append(table.jd0 + t / SECONDS_PER_DAY, table.jd[-1])
+        ra, dec, _, _ = table.interpolate(jd)
+        return cls(jd, ra, dec, location, **kwargs)
+
+    def _radec(self, jd):
+        t = (np.asarray(jd, dtype=np.float64) - self.jd0) * SECONDS_PER_DAY
+        return np.interp(t, self.t, self.ra) % 360.0, np.interp(t, self.t, self.dec)
+
+    def _interpolate(self, jd):
+        t = (np.asarray(jd, dtype=np.float64) - self.jd0) * SECONDS_PER_DAY
+        return np.interp(t, self.t, self.alt), np.interp(t, self.t, self.az) % 360.0
+
+    def exact_at(self, jd):
+        """
+        Alt/Az in degrees from a full astropy transform
+        """
+
+        from astropy.coordinates import SkyCoord, AltAz
+        from astropy.time import Time
+        import astropy.units as u
+
+        ra, dec = self._radec(jd)
+        coord = SkyCoord(ra, dec, unit=(u.deg, u.deg))
+        altaz = coord.transform_to(AltAz(obstime=Time(jd, format="jd", scale="utc"), location=self.location))
+        return altaz.alt.deg, altaz.az.deg
+
+    def _check(self, check_points):
+        """
+        Largest difference in arcsec between interpolated and exact Alt/Az,
+        sampled halfway between table epochs
+        """
+
+        if len(self.jd) < 2 or check_points <= 0:
+            return 0.0
+
+        mid = (self.jd[:-1] + self.jd[1:]) / 2
+        mid = mid[np.linspace(0, len(mid) - 1, min(check_points, len(mid))).astype(int)]
+
+        alt, az = self._interpolate(mid)
+        exact_alt, exact_az = self.exact_at(mid)
+
+        daz = (az - exact_az + 180.0) % 360.0 - 180.0
+        error = np.hypot(daz * np.cos(np.radians(exact_alt)), alt - exact_alt)
+        return float(error.max() * 3600)
+
+    def at(self, jd):
+        """
+        Alt/Az in degrees at one or more Julian Dates
+        """
+
+        if self.exact:
+            return self.exact_at(jd)
+        return self._interpolate(jd)
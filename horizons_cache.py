@@ -0,0 +1,211 @@
+"""
+Persistent on-disk cache for JPL Horizons query results.
+
+Results are stored as parsed column arrays in one compressed .npz file per
+query, named by the SHA-256 of everything that identifies the query (target,
+center/location, frame, step size, ...). Rows are indexed by their position
+on the epoch grid, so when a later query overlaps rows that were already
+fetched only the missing spans are requested from Horizons and the result is
+merged into the stored file.
+
+Rows older than max_age_seconds are treated as missing and fetched again,
+and the least recently used files are removed once the cache grows beyond
+max_bytes.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+SECONDS_PER_DAY = 86400.0
+
+DEFAULT_DIRECTORY = os.environ.get(
+    "EPHEMERITRACK_CACHE",
+    os.path.join(os.path.expanduser("~"), ".cache", "ephemeritrack", "horizons"))
+
+
+def snap_jd(jd, step_seconds):
+    """
+    Round a Julian Date down onto a grid of step_seconds,
+    so that windows started at different times share epochs
+    """
+
+    return np.floor(jd * SECONDS_PER_DAY / step_seconds) * step_seconds / SECONDS_PER_DAY
+
+
+def contiguous_runs(indices):
+    """
+    Split a sorted array of integers into runs of consecutive values.
+    Example: [1, 2, 3, 7, 8] -> [array([1, 2, 3]), array([7, 8])]
+    """
+
+    if len(indices) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(indices) != 1) + 1
+    return np.split(indices, breaks)
+
+
+class HorizonsCache:
+    """
+    Content-addressed store of Horizons results on an epoch grid
+    """
+
+    def __init__(self, directory=DEFAULT_DIRECTORY, max_bytes=256*1024*1024, max_age_seconds=30*24*60*60):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self._lock = threading.Lock()
+
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, key):
+        """
+        Filename for a query, given a dict of the fields that identify it
+        """
+
+        text = json.dumps(key, sort_keys=True, default=str)
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, digest + ".npz")
+
+    def fetch(self, key, start_jd, stop_jd, step_seconds, fetch_span):
+        """
+        Return the rows for the epochs start_jd, start_jd + step, ..., stop_jd
+        as a dict of column arrays, ordered by time.
+
+        fetch_span(jds) is called for every contiguous run of epochs that is
+        not in the cache. It must return a dict of equal-length column arrays
+        which includes a "jd" column with the epoch of each row.
+        """
+
+        # Epochs are indexed by their (integer) position on the grid, which
+        # is offset by the phase of start_jd so any start time is cacheable
+        start_seconds = start_jd * SECONDS_PER_DAY
+        phase = round(start_seconds % step_seconds, 3) % step_seconds
+        first = int(round((start_seconds - phase) / step_seconds))
+        last = int(round((stop_jd * SECONDS_PER_DAY - phase) / step_seconds))
+        wanted = np.arange(first, last + 1, dtype=np.int64)
+
+        key = dict(key, step_seconds=step_seconds, phase_seconds=phase)
+        path = self.path(key)
+
+        def to_index(jd):
+            return np.round((np.asarray(jd, dtype=np.float64) * SECONDS_PER_DAY - phase) / step_seconds).astype(np.int64)
+
+        def to_jd(index):
+            return (index * step_seconds + phase) / SECONDS_PER_DAY
+
+        with self._lock:
+            stored = self._load(path)
+
+        have = stored["_index"] if stored is not None else np.empty(0, dtype=np.int64)
+        missing = wanted[~np.isin(wanted, have)]
+
+        fetched = []
+        for run in contiguous_runs(missing):
+            columns = fetch_span(to_jd(run))
+            columns = {name: np.asarray(values) for name, values in columns.items()}
+            columns["_index"] = to_index(columns["jd"])
+            columns["_fetched"] = np.full(len(columns["jd"]), time.time())
+            fetched.append(columns)
+
+        with self._lock:
+            if fetched:
+                # Merged into the file as it is now, not as it was before
+                # fetching, so rows another thread stored meanwhile are kept
+                stored = self._merge(self._load(path), fetched)
+                self._save(path, stored)
+                self.evict()
+            elif stored is not None:
+                # Mark as recently used for the size-based eviction
+                os.utime(path)
+
+        if stored is None:
+            return {}
+
+        rows = np.isin(stored["_index"], wanted)
+        return {name: values[rows] for name, values in stored.items() if not name.startswith("_")}
+
+    ### Storage ############################################
+
+    def _load(self, path):
+        try:
+            with np.load(path, allow_pickle=False) as f:
+                stored = {name: f[name] for name in f.files}
+        except (OSError, ValueError):
+            return None
+
+        # Drop rows that are too old to trust, so they are fetched again
+        fresh = stored["_fetched"] >= time.time() - self.max_age_seconds
+        if not fresh.all():
+            stored = {name: values[fresh] for name, values in stored.items()}
+        return stored
+
+    def _merge(self, stored, fetched):
+        parts = ([stored] if stored is not None else []) + fetched
+        names = set(parts[0])
+        for part in parts[1:]:
+            names &= set(part)
+
+        merged = {name: np.concatenate([part[name] for part in parts]) for name in names}
+
+        # Later parts win for rows that appear more than once
+        index = merged["_index"]
+        reverse_unique = np.unique(index[::-1], return_index=True)[1]
+        keep = len(index) - 1 - reverse_unique
+        return {name: values[keep] for name, values in merged.items()}
+
+    def _save(self, path, stored):
+        # Unique per process and thread, other processes may save the same query
+        tmp_path = "%s.%d.%d.tmp" % (path, os.getpid(), threading.get_ident())
+        with open(tmp_path, "wb") as f:
+            np.savez_compressed(f, **stored)
+        os.replace(tmp_path, path)
+
+    def evict(self):
+        """
+        Delete expired files, then the least recently used ones until
+        the cache is below max_bytes
+        """
+
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".npz"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+
+        oldest_allowed = time.time() - self.max_age_seconds
+        total = 0
+        kept = []
+        for mtime, size, path in entries:
+            if mtime < oldest_allowed:
+                self._remove(path)
+            else:
+                kept.append((mtime, size, path))
+                total += size
+
+        for mtime, size, path in sorted(kept):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def clear(self):
+        with self._lock:
+            for name in os.listdir(self.directory):
+                if name.endswith(".npz"):
+                    self._remove(os.path.join(self.directory, name))
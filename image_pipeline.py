@@ -0,0 +1,111 @@
+"""
+Background post-processing of saved images, so acquisition can go on with
+the next slew or exposure while files are still being processed.
+
+    worker = SaveWorker(max_pending=4).start()
+    camera.SaveImage(path)
+    worker.submit(add_fits_header, path, {"MOSAICX": x})
+    ...
+    worker.close()
+
+The queue is bounded: submit() blocks while max_pending jobs are waiting,
+so a slow disk throttles the acquisition instead of queueing up an entire
+night of images in memory.
+"""
+
+import queue
+import threading
+import time
+import traceback
+
+
+class SaveWorker:
+    """
+    Runs submitted jobs in order on one background thread.
+    Exceptions of jobs are printed and kept in errors, they don't stop the worker.
+    """
+
+    def __init__(self, max_pending=4):
+        self.max_pending = max_pending
+        self.completed = 0
+        self.errors = []
+        self.blocked_seconds = 0.0  # total time submit() waited for a free slot
+
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="SaveWorker", daemon=True)
+        self._thread.start()
+        return self
+
+    def submit(self, function, *args, **kwargs):
+        """
+        Queue function(*args, **kwargs), blocking while the queue is full
+        """
+
+        if self._thread is None:
+            raise RuntimeError("SaveWorker is not running")
+        job = (function, args, kwargs)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            start = time.monotonic()
+            self._queue.put(job)
+            self.blocked_seconds += time.monotonic() - start
+
+    @property
+    def pending(self):
+        return self._queue.qsize()
+
+    def join(self):
+        """
+        Wait until all submitted jobs are done
+        """
+
+        self._queue.join()
+
+    def close(self):
+        """
+        Finish all submitted jobs and stop the worker
+        """
+
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                function, args, kwargs = job
+                try:
+                    function(*args, **kwargs)
+                    self.completed += 1
+                except Exception as e:
+                    self.errors.append(e)
+                    traceback.print_exc()
+            finally:
+                self._queue.task_done()
+
+
+def add_fits_header(path, header):
+    """
+    Add or update header keywords of the primary HDU of a FITS file in place.
+    A value can be a (value, comment) tuple
+    """
+
+    from astropy.io import fits
+
+    with fits.open(path, mode="update") as hdul:
+        for key, value in header.items():
+            hdul[0].header[key] = value
@@ -0,0 +1,329 @@
+"""
+Opt-in timing instrumentation for the tracking loops.
+
+Spans time a block of code into a named histogram:
+
+    import instrument
+
+    instrument.enable()
+    instrument.Reporter("metrics.txt", interval=10).start()
+
+    with instrument.span("interpolate"):
+        ra, dec, ra_rate, dec_rate = table.interpolate(nowjd)
+
+The histograms are log-linear like HdrHistogram: a value is counted in a
+bucket whose width is at most 1/64 of the value, so percentiles are accurate
+to about 1.5% over the whole range from nanoseconds to minutes, and recording
+is a few integer operations.
+
+While instrumentation is disabled (the default), span() returns a shared
+no-op context manager, so spans can stay in the hot path.
+
+instrument_pwi4(pwi4) additionally times every request made by a PWI4
+client, per command, and counts the failed ones.
+"""
+
+import inspect
+import os
+import threading
+import time
+
+_enabled = False
+_lock = threading.Lock()
+
+histograms = {}
+counters = {}
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    with _lock:
+        histograms.clear()
+        counters.clear()
+
+
+class Histogram:
+    """
+    Log-linear histogram of durations in seconds, recorded as integer nanoseconds
+    """
+
+    SUB_BUCKET_BITS = 7
+    SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+    HALF = SUB_BUCKETS // 2
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total_ns = 0
+        self.min_ns = None
+        self.max_ns = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def index(cls, ns):
+        if ns < cls.SUB_BUCKETS:
+            return ns
+        shift = ns.bit_length() - cls.SUB_BUCKET_BITS
+        return cls.SUB_BUCKETS + (shift - 1) * cls.HALF + (ns >> shift) - cls.HALF
+
+    @classmethod
+    def value(cls, index):
+        """
+        Midpoint in nanoseconds of the bucket with this index
+        """
+
+        if index < cls.SUB_BUCKETS:
+            return index
+        shift = (index - cls.SUB_BUCKETS) // cls.HALF + 1
+        mantissa = (index - cls.SUB_BUCKETS) % cls.HALF + cls.HALF
+        return (mantissa << shift) + (1 << (shift - 1))
+
+    def record(self, seconds):
+        ns = int(seconds * 1e9)
+        if ns < 0:
+            ns = 0
+        index = self.index(ns)
+        with self._lock:
+            self.counts[index] = self.counts.get(index, 0) + 1
+            self.count += 1
+            self.total_ns += ns
+            if self.min_ns is None or ns < self.min_ns:
+                self.min_ns = ns
+            if ns > self.max_ns:
+                self.max_ns = ns
+
+    def percentile(self, percent):
+        """
+        Duration in seconds below which percent of the recorded values lie
+        """
+
+        with self._lock:
+            if self.count == 0:
+                return 0.0
+            rank = max(1, int(round(self.count * percent / 100.0)))
+            seen = 0
+            for index in sorted(self.counts):
+                seen += self.counts[index]
+                if seen >= rank:
+                    return min(self.value(index), self.max_ns) / 1e9
+            return self.max_ns / 1e9
+
+    def mean(self):
+        return self.total_ns / self.count / 1e9 if self.count else 0.0
+
+    def merge(self, other):
+        with other._lock:
+            counts = dict(other.counts)
+            count, total_ns, min_ns, max_ns = other.count, other.total_ns, other.min_ns, other.max_ns
+        with self._lock:
+            for index, n in counts.items():
+                self.counts[index] = self.counts.get(index, 0) + n
+            self.count += count
+            self.total_ns += total_ns
+            if min_ns is not None and (self.min_ns is None or min_ns < self.min_ns):
+                self.min_ns = min_ns
+            self.max_ns = max(self.max_ns, max_ns)
+
+    def summary(self, percentiles=(50, 90, 99, 99.9)):
+        result = {"count": self.count, "mean": self.mean(), "min": (self.min_ns or 0) / 1e9, "max": self.max_ns / 1e9}
+        for p in percentiles:
+            result["p%g" % p] = self.percentile(p)
+        return result
+
+
+def histogram(name):
+    h = histograms.get(name)
+    if h is None:
+        with _lock:
+            h = histograms.setdefault(name, Histogram())
+    return h
+
+
+def record(name, seconds):
+    if _enabled:
+        histogram(name).record(seconds)
+
+
+def count(name, n=1):
+    if _enabled:
+        with _lock:
+            counters[name] = counters.get(name, 0) + n
+
+
+class Span:
+    __slots__ = ("histogram", "name", "start")
+
+    def __init__(self, name):
+        self.name = name
+        self.histogram = histogram(name)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.histogram.record(time.perf_counter() - self.start)
+        if exc_type is not None:
+            count(self.name + ".errors")
+        return False
+
+
+class NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+def span(name):
+    """
+    Context manager that records the duration of its block in the histogram name
+    """
+
+    if not _enabled:
+        return NULL_SPAN
+    return Span(name)
+
+
+### PWI4 requests ##########################################
+
+class InstrumentedCommunicator:
+    """
+    Wraps a PWI4 communicator and records the latency of every request in
+    "pwi4 <command>" and the number of failed requests in "pwi4 <command>.errors"
+    """
+
+    def __init__(self, comm):
+        self.comm = comm
+
+    def request(self, path, *args, **kwargs):
+        with span("pwi4 " + path):
+            return self.comm.request(path, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.comm, name)
+
+
+class InstrumentedAsyncCommunicator(InstrumentedCommunicator):
+    async def request(self, path, *args, **kwargs):
+        with span("pwi4 " + path):
+            return await self.comm.request(path, *args, **kwargs)
+
+
+def instrument_pwi4(pwi4):
+    """
+    Record request latencies and errors of a PWI4 (or AsyncPWI4) client.
+    Does nothing while instrumentation is disabled.
+    """
+
+    if _enabled and not isinstance(pwi4.comm, InstrumentedCommunicator):
+        if inspect.iscoroutinefunction(pwi4.comm.request):
+            pwi4.comm = InstrumentedAsyncCommunicator(pwi4.comm)
+        else:
+            pwi4.comm = InstrumentedCommunicator(pwi4.comm)
+    return pwi4
+
+
+### Publishing #############################################
+
+def format_text(percentiles=(50, 90, 99, 99.9)):
+    """
+    One line per histogram with its percentiles in milliseconds, then the counters
+    """
+
+    lines = ["# %s" % time.strftime("%Y-%m-%d %H:%M:%S")]
+    for name in sorted(histograms):
+        s = histograms[name].summary(percentiles)
+        fields = ["count=%d" % s["count"], "mean=%.3f" % (s["mean"] * 1000)]
+        fields += ["p%g=%.3f" % (p, s["p%g" % p] * 1000) for p in percentiles]
+        fields.append("max=%.3f" % (s["max"] * 1000))
+        lines.append("%-40s %s ms" % (name, " ".join(fields)))
+    for name in sorted(counters):
+        lines.append("%-40s %d" % (name, counters[name]))
+    return "\n".join(lines) + "\n"
+
+
+def _metric_name(name):
+    return "".join(c if c.isalnum() else "_" for c in name).strip("_")
+
+
+def format_prometheus(percentiles=(50, 90, 99, 99.9)):
+    """
+    Prometheus text format, e.g. for node_exporter's textfile collector
+    """
+
+    lines = [
+        "# TYPE ephemeritrack_span_seconds summary",
+    ]
+    for name in sorted(histograms):
+        s = histograms[name].summary(percentiles)
+        for p in percentiles:
+            lines.append('ephemeritrack_span_seconds{span="%s",quantile="%g"} %.9f' % (name, p / 100.0, s["p%g" % p]))
+        lines.append('ephemeritrack_span_seconds_sum{span="%s"} %.9f' % (name, s["mean"] * s["count"]))
+        lines.append('ephemeritrack_span_seconds_count{span="%s"} %d' % (name, s["count"]))
+    lines.append("# TYPE ephemeritrack_events_total counter")
+    for name in sorted(counters):
+        lines.append('ephemeritrack_events_total{event="%s"} %d' % (_metric_name(name), counters[name]))
+    return "\n".join(lines) + "\n"
+
+
+class Reporter:
+    """
+    Writes the histograms to path every interval seconds on a background
+    thread. format is "text" or "prometheus". The file is replaced
+    atomically, so readers never see a partial report.
+    """
+
+    def __init__(self, path, interval=10.0, format="text"):
+        self.path = path
+        self.interval = interval
+        self.format = format_prometheus if format == "prometheus" else format_text
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="InstrumentReporter", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.write()
+
+    def write(self):
+        with _lock:
+            text = self.format()
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(text)
+        os.replace(tmp, self.path)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.write()
+            except OSError:
+                pass
@@ -1,9 +1,18 @@
-from time import sleep, time
+import os
+import threading
+from time import sleep, time, perf_counter
 from datetime import datetime, timedelta, UTC
 
 from astropy.time import Time, TimeDelta
-from astropy.coordinates import SkyCoord, AltAz, EarthLocation
+from astropy.coordinates import SkyCoord, EarthLocation
 import astropy.units as u
+import numpy as np
+
+from ephemeris import AltAzTable, datetime_to_jd
+from pwi4_monitor import StatusMonitor, wait_until_settled
+from telemetry import TelemetryRecorder
+import instrument
+import scan_patterns
 
 location = EarthLocation(lat=-30.52630901637761*u.deg, lon=-70.85329602458852*u.deg, height=1710*u.m)
 
@@ -25,13 +34,64 @@ class Every:
 every = Every(1)
 
 SPEED_ARCSEC_SEC = 1
+DRIFT_SECONDS = 60*60
+
+# the scan around STARCOORD, any pattern of scan_patterns.py, e.g.
+# scan_patterns.Raster(width_arcsec=600, height_arcsec=300, row_spacing_arcsec=60, speed_arcsec_per_sec=SPEED_ARCSEC_SEC)
+# scan_patterns.Spiral(spacing_arcsec=60, radius_arcsec=600, speed_arcsec_per_sec=SPEED_ARCSEC_SEC)
+PATTERN = scan_patterns.Line(position_angle_degs=0, speed_arcsec_per_sec=SPEED_ARCSEC_SEC, duration_seconds=DRIFT_SECONDS)
+
+# the pattern is computed in advance at this resolution, the loop stops at its end
+DRIFT_STEP_SECONDS = 0.01
+
+# "goto" sends the next point of the pattern every tick, "path" uploads the whole pattern to the mount
+# as a custom path, "rates" runs it with offset rates, one request per segment of constant rate.
+# in "path" and "rates" mode the loop only supervises
+TRACK_MODE = "goto"
+# spacing of the uploaded path points and number of points per add_point_list request
+PATH_STEP_SECONDS = 1
+PATH_CHUNK_SIZE = 1000
+# the pattern is run as segments of constant rate of this length, on the sky even straight lines are curved in RA/Dec
+RATE_STEP_SECONDS = 1
+# longest expected slew to STARCOORD plus settling, before the rates are started
+SETTLE_TIMEOUT_SECONDS = 300
+
+# how often the mount status is polled for the console output
+STATUS_INTERVAL_SECONDS = 0.5
+
+# Alt/Az is computed in one batched transform at this spacing along the drift and interpolated in between
+ALTAZ_STEP_SECONDS = 10
+# largest acceptable error of the interpolated Alt/Az, above it every tick does an exact transform
+ALTAZ_TOLERANCE_ARCSEC = 1.0
+
+# timing percentiles of each stage of the loop are written to this file every METRICS_INTERVAL_SECONDS,
+# e.g. EPHEMERITRACK_METRICS=metrics.txt. instrumentation is off if it is not set
+METRICS_FILE = os.environ.get("EPHEMERITRACK_METRICS")
+METRICS_INTERVAL_SECONDS = 10
+
+# mount status is recorded to this directory at TELEMETRY_INTERVAL_SECONDS, e.g. EPHEMERITRACK_TELEMETRY=telemetry,
+# read it with telemetry.TelemetryReader. nothing is recorded if it is not set
+TELEMETRY_DIRECTORY = os.environ.get("EPHEMERITRACK_TELEMETRY")
+TELEMETRY_INTERVAL_SECONDS = 0.01
+
+# https://en.wikipedia.org/wiki/CR_Bo%C3%B6tis
+STARCOORD = "13h48m55.2s 7d57m35.7s"
+
+def drift_altaz(path):
+	"""
+	Alt/Az table of the scan path, sampled about every ALTAZ_STEP_SECONDS
+	"""
+	step = max(1, int(round(ALTAZ_STEP_SECONDS/DRIFT_STEP_SECONDS)))
+	# the last point is included, so the table covers the whole scan
+	rows = np.append(np.arange(0, len(path.jd) - 1, step), len(path.jd) - 1)
+	return AltAzTable(path.jd[rows], path.ra[rows], path.dec[rows], location, tolerance_arcsec=ALTAZ_TOLERANCE_ARCSEC)
 
 def track(prod=True):
 
 	if prod:
 		from pwi4_client import PWI4
 		print("Connecting to PWI4...")
-		pwi4 = PWI4()
+		pwi4 = instrument.instrument_pwi4(PWI4())
 
 		s = pwi4.status()
 		print("Mount connected:", s.mount.is_connected)
@@ -46,54 +106,110 @@ def track(prod=True):
 		print("Slewing...")
 		pwi4.mount_tracking_on()
 
-	# so the previous line is not erased, print an empty one
-	nlines = 2
-	print("\n"*nlines, end="")
-
-	time_start = datetime.now(UTC)
-
-	while True:
-		time_now = datetime.now(UTC)#datetime.strptime(t_0, "%Y-%m-%d %H:%M") + (datetime.utcnow() - fakestart)# + timedelta(hours=4.4)#XXX#SUBTRACT
-
-		time_delta = time_now - time_start
-		time_delta_seconds = time_delta.total_seconds()
-
-		# https://en.wikipedia.org/wiki/CR_Bo%C3%B6tis
-		starcoord = SkyCoord("13h48m55.2s 7d57m35.7s", unit=(u.hourangle, u.deg))
-
-		position_angle = 0 * u.deg
-		separation = time_delta_seconds * (SPEED_ARCSEC_SEC/60/60) * u.deg
-		coord = starcoord.directional_offset_by(position_angle, separation)
-		ra = coord.ra.to_value()
-		dec = coord.dec.to_value()
-		#print(ra,dec)
-		altaz = coord.transform_to(AltAz(obstime=time_now, location=location))
-
-		mountstr = ""
-		if prod:
-
-			pwi4.mount_goto_ra_dec_j2000(ra/15, dec)
-
-			s = pwi4.status()
-
-			mountstr = f"Actual RA: {s.mount.ra_j2000_hours:.5f} hours;  Actual Dec: {s.mount.dec_j2000_degs:.4f} degs, Axis0 dist: {s.mount.axis0.dist_to_target_arcsec:.1f} arcsec, Axis1 dist: {s.mount.axis1.dist_to_target_arcsec:.1f} arcsec"
-
-		if every:
+		# the status is polled once in the background instead of after every command
+		monitor = StatusMonitor(pwi4, interval=TELEMETRY_INTERVAL_SECONDS if TELEMETRY_DIRECTORY else STATUS_INTERVAL_SECONDS)
+		if TELEMETRY_DIRECTORY:
+			recorder = TelemetryRecorder(TELEMETRY_DIRECTORY).start()
+			monitor.subscribe(recorder.record)
+		monitor.start()
+
+	# stopped however the scan ends, so the last telemetry is flushed and its segment closed
+	rates_thread = None
+	rates_stop = threading.Event()
+	try:
+		starcoord = SkyCoord(STARCOORD, unit=(u.hourangle, u.deg))
+		ra0 = starcoord.ra.deg
+		dec0 = starcoord.dec.deg
+
+		if prod and TRACK_MODE == "rates":
+			# the offsets are added to the target, so the mount has to be on it first
+			pwi4.mount_goto_ra_dec_j2000(ra0/15, dec0)
+			wait_until_settled(pwi4, timeout=SETTLE_TIMEOUT_SECONDS)
+			rates = PATTERN.rates(ra0, dec0, RATE_STEP_SECONDS)
+
+		time_start = datetime.now(UTC)
+		if prod and TRACK_MODE == "rates":
+			# started before the path below is computed, so both start at time_start
+			rates_thread = threading.Thread(target=scan_patterns.run_rates, args=(pwi4, rates, rates_stop), name="ScanRates", daemon=True)
+			rates_thread.start()
+			print(f"Running {len(rates.start_seconds)} offset rate segments")
+
+		# every tick only looks up its point of the pattern
+		path = PATTERN.track(ra0, dec0, datetime_to_jd(time_start), DRIFT_STEP_SECONDS)
+		altaz_table = drift_altaz(path)
+
+		if prod and TRACK_MODE == "path":
+			with instrument.span("upload_path"):
+				# the mount interpolates between the points itself
+				npoints = scan_patterns.upload_track(pwi4, PATTERN.track(ra0, dec0, path.jd[0], PATH_STEP_SECONDS), PATH_CHUNK_SIZE)
+			print(f"Uploaded path with {npoints} points")
+
+		# so the previous line is not erased, print an empty one
+		nlines = 2
+		print("\n"*nlines, end="")
+
+		while True:
+			tickstart = perf_counter()
+			time_now = datetime.now(UTC)#datetime.strptime(t_0, "%Y-%m-%d %H:%M") + (datetime.utcnow() - fakestart)# + timedelta(hours=4.4)#XXX#SUBTRACT
+
+			nowjd = datetime_to_jd(time_now)
+			if nowjd > path.jd[-1]:
+				print("Scan finished")
+				break
+			i = np.searchsorted(path.jd, nowjd, side="right") - 1
+			ra = path.ra[i]
+			dec = path.dec[i]
+			#print(ra,dec)
+
+			mountstr = ""
+			if prod and TRACK_MODE == "goto":
+
+				with instrument.span("goto"):
+					pwi4.mount_goto_ra_dec_j2000(ra/15, dec)
+
+			if every:
 			
-			print("\033[A                             \033[A\n"*nlines, end="")
-			print(f"{time_now} RA: {coord.ra:.4f} DEC: {coord.dec:.4f} ALT: {altaz.alt:.4f} AZ: {altaz.az:.4f}")
-			print(mountstr)
-
-
-		#if not s.mount.is_slewing:
-		#    break
-		sleep(0.01)
+				s = monitor.latest if prod else None
+				if s is not None:
+					mountstr = f"Actual RA: {s.mount.ra_j2000_hours:.5f} hours;  Actual Dec: {s.mount.dec_j2000_degs:.4f} degs, Axis0 dist: {s.mount.axis0.dist_to_target_arcsec:.1f} arcsec, Axis1 dist: {s.mount.axis1.dist_to_target_arcsec:.1f} arcsec"
+
+				print("\033[A                             \033[A\n"*nlines, end="")
+				with instrument.span("altaz"):
+					alt, az = altaz_table.at(nowjd)
+				with instrument.span("print"):
+					print(f"{time_now} RA: {ra:.4f} deg DEC: {dec:.4f} deg ALT: {alt:.4f} deg AZ: {az:.4f} deg")
+					print(mountstr)
+
+			instrument.record("tick", perf_counter()-tickstart)
+
+
+			#if not s.mount.is_slewing:
+			#    break
+			# in path and rates mode the mount follows the pattern on its own, the loop only supervises
+			sleep(0.01 if TRACK_MODE == "goto" else 0.1)
+	finally:
+		try:
+			if rates_thread is not None:
+				# the mount keeps moving at the last rates until they are stopped. The thread stops them
+				# when it ends, but on an exception or ctrl-c here it may be stuck in a request, so stop them here too
+				rates_stop.set()
+				rates_thread.join()
+				pwi4.mount_offset(ra_stop_rate=0, dec_stop_rate=0)
+		finally:
+			if prod:
+				monitor.stop()
+				if TELEMETRY_DIRECTORY:
+					recorder.stop()
 
 	#print("Slew complete. Tracking...")
 
 
 
 
+if METRICS_FILE:
+	instrument.enable()
+	instrument.Reporter(METRICS_FILE, METRICS_INTERVAL_SECONDS).start()
+
 try:
 	track(ACTUALLYTRACK)
 except Exception as e:
@@ -1,11 +1,20 @@
-from time import sleep
 import os
 from datetime import datetime
 
-import win32com.client
 from astropy.io import fits
 
 from pwi4_client import PWI4
+from camera import open_camera
+from pwi4_monitor import StatusMonitor, wait_until_settled
+from mosaic_planner import SlewModel, grid_panels, plan_mosaic, plan_row_major
+from image_pipeline import SaveWorker, add_fits_header
+from mosaic_sequencer import MosaicSequencer
+
+# "maxim" for the real camera in MaxIm DL (Windows), "pwi4" for PWI4's virtual camera, which also works
+# on Linux against pwi4_simulator.py, e.g. EPHEMERITRACK_CAMERA=pwi4 EPHEMERITRACK_TIME_SCALE=0.01 python mosaic.py
+CAMERA = os.environ.get("EPHEMERITRACK_CAMERA", "maxim")
+# the virtual camera takes exposure time multiplied by this, to run through a mosaic quickly
+EXPOSURE_TIME_SCALE = float(os.environ.get("EPHEMERITRACK_TIME_SCALE", "1"))
 
 print("Connecting to PWI4...")
 pwi4 = PWI4()
@@ -20,18 +29,27 @@ if not s.mount.is_connected:
 
 print("  RA/Dec: %.4f, %.4f" % (s.mount.ra_j2000_hours, s.mount.dec_j2000_degs))
 
-print("Connecting to camera...")
-# if you don't know what your driver is called, use the ASCOM Chooser
-camera = win32com.client.Dispatch("MaxIm.CCDCamera")
-camera.LinkEnabled = True
+# polls the status in the background, the loops below only wait on it
+monitor = StatusMonitor(pwi4, interval=0.2)
+monitor.start()
+
+def print_status(s):
+    print("RA: %.5f hours;  Dec: %.4f degs, Axis0 dist: %.1f arcsec, Axis1 dist: %.1f arcsec" % (
+        s.mount.ra_j2000_hours, 
+        s.mount.dec_j2000_degs,
+        s.mount.axis0.dist_to_target_arcsec,
+        s.mount.axis1.dist_to_target_arcsec
+    ))
 
-if not camera.LinkEnabled:
-    print("Failed to start camera")
+print("Connecting to camera...")
+try:
+    camera = open_camera(CAMERA, pwi4=pwi4, time_scale=EXPOSURE_TIME_SCALE)
+except RuntimeError as e:
+    print(e)
     exit(1)
 
 print("Turning cooler on...")
-camera.CoolerOn = True
-if camera.CoolerOn:
+if camera.cooler_on():
     print("Cooler turned on")
 else:
     print("Cooler did NOT turn on, continuing regardless")
@@ -52,42 +70,92 @@ dec_step = 20/60
 panels_x = 5
 panels_y = 7
 
-for y in range(panels_y):
-    for x in range(panels_x):
-        pwi4.mount_goto_ra_dec_j2000(ra_start+ra_step*x, dec_start+dec_step*y)
-        sleep(0.2)
-
-        while True:
-            s = pwi4.status()
-
-            print("RA: %.5f hours;  Dec: %.4f degs, Axis0 dist: %.1f arcsec, Axis1 dist: %.1f arcsec" % (
-                s.mount.ra_j2000_hours, 
-                s.mount.dec_j2000_degs,
-                s.mount.axis0.dist_to_target_arcsec,
-                s.mount.axis1.dist_to_target_arcsec
-            ))
-
-            if not s.mount.is_slewing:
-                break
-            sleep(0.2)
-
-        print("Slew complete. Tracking...")
-        camera.BinX = camera.BinY = 2
-        print("Exposing...")
-        # exposure, shutter open, #filter
-        for f in range(4):
-            print("filter", f)
-            camera.expose(180,1,f)
-            time_start = datetime.now()
-            while not camera.ImageReady:
-                sleep(0.01)
-
-            print("finished exposure")
-
-            os.makedirs(os.path.join(os.getcwd(), os.path.join("images", "mosaic2")), exist_ok=True)
-            datetimestr = str(time_start).split('.')[0].replace(':', '-')
-            camera.SaveImage(os.path.join(os.getcwd(), "images", "mosaic2", f"{datetimestr}_{x}_{y}_{f}.fit"))
-            print("image saved")
-
+filters = range(4)
+exposure_seconds = 180
+
+# visit the panels in the order with the least slewing and filter changes, predicted from the mount's axis limits
+panels = grid_panels(ra_start, dec_start, ra_step, dec_step, panels_x, panels_y)
+slew_model = SlewModel.from_status(s)
+start = (s.mount.ra_j2000_hours, s.mount.dec_j2000_degs)
+plan = plan_mosaic(panels, slew_model, filters, exposure_seconds, start=start)
+print(plan.report(plan_row_major(panels, slew_model, filters, exposure_seconds, start=start)))
+
+# True: the slew to the next panel starts as soon as its last exposure is read out, while the image is still
+# being saved, and FITS headers are written in the background. False: strictly one step after the other
+PIPELINED = True
+# the mount is on target once both axes are this close to it and stay there
+SETTLE_TOLERANCE_ARCSEC = 1.0
+SETTLE_JITTER_ARCSEC = 0.5
+# longest expected slew plus settling, a mount that is not on target by then is an error
+SETTLE_TIMEOUT_SECONDS = 300
+
+# how many saved images may wait for post-processing before acquisition waits for them
+MAX_PENDING_SAVES = 4
+
+directory = os.path.join(os.getcwd(), "images", "mosaic2")
+os.makedirs(directory, exist_ok=True)
+saver = SaveWorker(max_pending=MAX_PENDING_SAVES).start()
+
+# frames that are already in the journal or the image directory are skipped, so a rerun continues where the last one stopped
+sequencer = MosaicSequencer(plan, directory)
+visits = sequencer.remaining_visits()
+print(sequencer.progress())
+
+slewing = False
+settle_saved = 0.0
+for i, (panel, panel_filters) in enumerate(visits):
+    x, y = panel.x, panel.y
+    if not slewing:
+        pwi4.mount_goto_ra_dec_j2000(panel.ra_hours, panel.dec_degs)
+
+    # polls rarely while the target is far away and densely once it is close, instead of every 0.2s
+    settled = wait_until_settled(pwi4, SETTLE_TOLERANCE_ARCSEC, SETTLE_JITTER_ARCSEC, timeout=SETTLE_TIMEOUT_SECONDS)
+    settle_saved += settled.saved_seconds
+    print_status(settled.status)
+    slewing = False
+
+    print("Slew complete. Tracking...")
+    camera.set_binning(2)
+    print("Exposing...")
+    # exposure, shutter open, #filter
+    # every other panel uses the filters in reverse, so the wheel starts where it stopped
+    for n, f in enumerate(panel_filters):
+        print("filter", f)
+        camera.expose(exposure_seconds,True,f)
+        time_start = datetime.now()
+        camera.wait_until_ready()
+
+        print("finished exposure")
+        status = monitor.latest
+
+        # the image is read out, so the mount can already move on while it is saved
+        if PIPELINED and n == len(panel_filters)-1 and i+1 < len(visits):
+            next_panel = visits[i+1].panel
+            pwi4.mount_goto_ra_dec_j2000(next_panel.ra_hours, next_panel.dec_degs)
+            slewing = True
+
+        datetimestr = str(time_start).split('.')[0].replace(':', '-')
+        path = os.path.join(directory, f"{datetimestr}_{x}_{y}_{f}.fit")
+        # the camera has to save the image itself, before the next exposure replaces it
+        camera.save(path)
+        sequencer.mark_done(panel, f, path)
+        header = {
+            "MOSAICX": x, "MOSAICY": y, "FILTIDX": f,
+            # the camera software writes OBJCTRA/OBJCTDEC itself, in its own format, so the panel center has its own keys
+            "PANELRA": (panel.ra_hours, "mosaic panel center RA J2000 [hours]"),
+            "PANELDEC": (panel.dec_degs, "mosaic panel center Dec J2000 [degrees]"),
+            "MOUNTRA": status.mount.ra_j2000_hours, "MOUNTDEC": status.mount.dec_j2000_degs,
+        }
+        if PIPELINED:
+            saver.submit(add_fits_header, path, header)
+        else:
+            add_fits_header(path, header)
+        print("image saved")
+
+saver.close()
+print(sequencer.progress())
+print(f"Settle detection saved about {settle_saved:.1f}s over {len(visits)} panels")
+print(f"{saver.completed} images post-processed, {len(saver.errors)} errors, waited {saver.blocked_seconds:.1f}s for the save queue")
+monitor.stop()
 pwi4.mount_tracking_off()
 pwi4.mount_stop()
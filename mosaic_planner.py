@@ -0,0 +1,305 @@
+"""
+Visit order planning for mosaics, minimizing the time spent slewing and
+changing filters.
+
+The slew model is built from the axis limits PWI4 reports in its status, so
+the predicted times match the mount actually in use:
+
+    model = SlewModel.from_status(pwi4.status())
+    panels = grid_panels(7.33, -26.33, 20/60/15, 20/60, 5, 7)
+    plan = plan_mosaic(panels, model, filters=range(4), exposure_seconds=180)
+    print(plan.report(plan_row_major(panels, model, filters=range(4), exposure_seconds=180)))
+
+    for visit in plan.visits:
+        goto(visit.panel.ra_hours, visit.panel.dec_degs)
+        for f in visit.filters:
+            expose(f)
+
+Regular grids are visited in a serpentine order (along rows or along
+columns, whichever is faster), any other set of panels in a nearest neighbour
+tour improved by 2-opt. The filter order is reversed on every other panel, so
+the filter wheel continues from the filter it ended on instead of returning
+to the first one.
+
+On an equatorial mount axis0 moves by the RA difference and axis1 by the Dec
+difference, on an alt-az mount (mount.geometry) by the azimuth and altitude
+differences at the time the model was made, both axes at the same time.
+"""
+
+import math
+from collections import namedtuple
+
+Panel = namedtuple("Panel", ["x", "y", "ra_hours", "dec_degs"])
+Visit = namedtuple("Visit", ["panel", "filters"])
+
+# mount.geometry of alt-az mounts (0 is an equatorial fork, 2 a German equatorial mount)
+GEOMETRY_ALT_AZ = 1
+
+# axis limits assumed if PWI4 doesn't report them (before 4.0.13)
+DEFAULT_MAX_VELOCITY_DEGS_PER_SEC = 10.0
+DEFAULT_ACCELERATION_DEGS_PER_SEC_SQR = 5.0
+
+
+def axis_move_seconds(distance_degs, max_velocity_degs_per_sec, acceleration_degs_per_sec_sqr):
+    """
+    Duration of a trapezoidal (or, for short moves, triangular) velocity profile over distance_degs
+    """
+
+    d = abs(distance_degs)
+    v = max_velocity_degs_per_sec
+    a = acceleration_degs_per_sec_sqr
+    if d == 0:
+        return 0.0
+    if d < v * v / a:
+        # never reaches the max velocity
+        return 2 * math.sqrt(d / a)
+    return d / v + v / a
+
+
+def altaz(ra_hours, dec_degs, latitude_degs, lmst_hours):
+    """
+    (alt, az) in degrees of a position at the local sidereal time lmst_hours, az from north through east
+    """
+
+    ha, dec, lat = math.radians((lmst_hours - ra_hours) * 15), math.radians(dec_degs), math.radians(latitude_degs)
+    alt = math.asin(math.sin(lat) * math.sin(dec) + math.cos(lat) * math.cos(dec) * math.cos(ha))
+    az = math.atan2(-math.sin(ha) * math.cos(dec), math.sin(dec) * math.cos(lat) - math.cos(dec) * math.sin(lat) * math.cos(ha))
+    return math.degrees(alt), math.degrees(az) % 360
+
+
+class SlewModel:
+    """
+    Predicts slew durations from the velocity and acceleration limits of both
+    axes, plus settle_seconds after every slew until the mount is on target.
+
+    If latitude_degs and lmst_hours are given, the mount is alt-az, and the
+    axes move by the azimuth and altitude differences at lmst_hours
+    """
+
+    def __init__(self, axis0_max_velocity, axis0_acceleration, axis1_max_velocity=None, axis1_acceleration=None, settle_seconds=2.0,
+                 latitude_degs=None, lmst_hours=None):
+        self.axis0 = (axis0_max_velocity, axis0_acceleration)
+        self.axis1 = (axis1_max_velocity or axis0_max_velocity, axis1_acceleration or axis0_acceleration)
+        self.settle_seconds = settle_seconds
+        self.latitude_degs = latitude_degs
+        self.lmst_hours = lmst_hours
+
+    @property
+    def is_altaz(self):
+        return self.latitude_degs is not None and self.lmst_hours is not None
+
+    @classmethod
+    def from_status(cls, status, settle_seconds=2.0):
+        """
+        Build a model from the max_velocity_degs_per_sec/acceleration_degs_per_sec_sqr fields of a PWI4Status,
+        or the default limits if PWI4 doesn't report them, and from mount.geometry and the site
+        """
+
+        axis0, axis1 = status.mount.axis0, status.mount.axis1
+        latitude = lmst = None
+        if status.mount.geometry == GEOMETRY_ALT_AZ:
+            latitude, lmst = status.site.latitude_degs, status.site.lmst_hours
+        return cls(axis0.max_velocity_degs_per_sec or DEFAULT_MAX_VELOCITY_DEGS_PER_SEC,
+                   axis0.acceleration_degs_per_sec_sqr or DEFAULT_ACCELERATION_DEGS_PER_SEC_SQR,
+                   axis1.max_velocity_degs_per_sec or DEFAULT_MAX_VELOCITY_DEGS_PER_SEC,
+                   axis1.acceleration_degs_per_sec_sqr or DEFAULT_ACCELERATION_DEGS_PER_SEC_SQR,
+                   settle_seconds, latitude, lmst)
+
+    def slew_seconds(self, ra0_hours, dec0_degs, ra1_hours, dec1_degs):
+        if self.is_altaz:
+            alt0, az0 = altaz(ra0_hours, dec0_degs, self.latitude_degs, self.lmst_hours)
+            alt1, az1 = altaz(ra1_hours, dec1_degs, self.latitude_degs, self.lmst_hours)
+            d0 = (az1 - az0 + 180) % 360 - 180
+            d1 = alt1 - alt0
+        else:
+            d0 = ((ra1_hours - ra0_hours) * 15 + 180) % 360 - 180
+            d1 = dec1_degs - dec0_degs
+        if d0 == 0 and d1 == 0:
+            return 0.0
+        return max(axis_move_seconds(d0, *self.axis0), axis_move_seconds(d1, *self.axis1)) + self.settle_seconds
+
+    def panel_seconds(self, a, b):
+        return self.slew_seconds(a.ra_hours, a.dec_degs, b.ra_hours, b.dec_degs)
+
+
+class FilterModel:
+    """
+    Filter wheel that takes seconds_per_position to move by one position,
+    and, if circular, can turn in either direction
+    """
+
+    def __init__(self, seconds_per_position=1.0, positions=None, circular=False):
+        self.seconds_per_position = seconds_per_position
+        self.positions = positions
+        self.circular = circular
+
+    def change_seconds(self, a, b):
+        steps = abs(b - a)
+        if self.circular and self.positions:
+            steps = min(steps, self.positions - steps)
+        return steps * self.seconds_per_position
+
+
+class Plan:
+    """
+    Ordered visits with their predicted durations
+    """
+
+    def __init__(self, name, visits, slew_seconds, filter_seconds, exposure_seconds):
+        self.name = name
+        self.visits = visits
+        self.slew_seconds = slew_seconds
+        self.filter_seconds = filter_seconds
+        self.exposure_seconds = exposure_seconds
+
+    @property
+    def total_seconds(self):
+        return self.slew_seconds + self.filter_seconds + self.exposure_seconds
+
+    def report(self, baseline=None):
+        lines = ["%s: %d panels, %.1f min total (slewing %.1f min, filter changes %.1f min, exposing %.1f min)" % (
+            self.name, len(self.visits), self.total_seconds / 60, self.slew_seconds / 60, self.filter_seconds / 60, self.exposure_seconds / 60)]
+        if baseline is not None:
+            lines.append(baseline.report())
+            saved = baseline.total_seconds - self.total_seconds
+            lines.append("Predicted savings: %.1f min (%.1f%% of the night time of %s)" % (
+                saved / 60, 100 * saved / baseline.total_seconds if baseline.total_seconds else 0, baseline.name))
+        return "\n".join(lines)
+
+
+def grid_panels(ra_start_hours, dec_start_degs, ra_step_hours, dec_step_degs, panels_x, panels_y):
+    return [Panel(x, y, ra_start_hours + ra_step_hours * x, dec_start_degs + dec_step_degs * y)
+            for y in range(panels_y) for x in range(panels_x)]
+
+
+def evaluate(name, order, slew_model, filters, exposure_seconds, filter_model=None, start=None, alternate_filters=True):
+    """
+    Predict the duration of visiting the panels in order, starting at the
+    (ra_hours, dec_degs) start position if given
+    """
+
+    filters = list(filters)
+    filter_model = filter_model or FilterModel()
+    visits = []
+    slew = filter_change = 0.0
+    previous_panel = None
+    previous_filter = filters[0] if filters else None
+    if start is not None:
+        previous_panel = Panel(None, None, start[0], start[1])
+
+    for i, panel in enumerate(order):
+        if previous_panel is not None:
+            slew += slew_model.panel_seconds(previous_panel, panel)
+        panel_filters = filters[::-1] if alternate_filters and i % 2 else filters
+        for f in panel_filters:
+            filter_change += filter_model.change_seconds(previous_filter, f)
+            previous_filter = f
+        visits.append(Visit(panel, panel_filters))
+        previous_panel = panel
+
+    return Plan(name, visits, slew, filter_change, exposure_seconds * len(filters) * len(order))
+
+
+def path_seconds(order, slew_model, start=None):
+    seconds = sum(slew_model.panel_seconds(a, b) for a, b in zip(order, order[1:]))
+    if start is not None and order:
+        seconds += slew_model.slew_seconds(start[0], start[1], order[0].ra_hours, order[0].dec_degs)
+    return seconds
+
+
+def serpentine_orders(panels):
+    """
+    Serpentine orders along rows and along columns, from each corner
+    """
+
+    xs = sorted(set(p.x for p in panels))
+    ys = sorted(set(p.y for p in panels))
+    by_position = dict(((p.x, p.y), p) for p in panels)
+
+    orders = []
+    for outer, inner, key in ((ys, xs, lambda o, i: (i, o)), (xs, ys, lambda o, i: (o, i))):
+        for reverse_outer in (False, True):
+            for reverse_inner in (False, True):
+                order = []
+                for n, o in enumerate(outer[::-1] if reverse_outer else outer):
+                    line = inner[::-1] if (n % 2 == 1) != reverse_inner else inner
+                    order.extend(by_position[key(o, i)] for i in line if key(o, i) in by_position)
+                orders.append(order)
+    return orders
+
+
+def nearest_neighbor_order(panels, slew_model, start=None):
+    remaining = list(panels)
+    if start is not None:
+        current = Panel(None, None, start[0], start[1])
+    else:
+        current = remaining.pop(0)
+    order = [] if start is not None else [current]
+    while remaining:
+        nearest = min(remaining, key=lambda p: slew_model.panel_seconds(current, p))
+        remaining.remove(nearest)
+        order.append(nearest)
+        current = nearest
+    return order
+
+
+def two_opt(order, slew_model, start=None, max_passes=50):
+    """
+    Improve an open tour by reversing segments while that makes it shorter
+    """
+
+    order = list(order)
+    n = len(order)
+    anchor = Panel(None, None, start[0], start[1]) if start is not None else None
+
+    def cost(a, b):
+        # the open ends of the tour cost nothing
+        if a is None or b is None:
+            return 0.0
+        return slew_model.panel_seconds(a, b)
+
+    for _ in range(max_passes):
+        improved = False
+        for i in range(n - 1):
+            before = order[i - 1] if i > 0 else anchor
+            for j in range(i + 1, n):
+                # reversing order[i..j] replaces the edges before-i and j-after with before-j and i-after
+                after = order[j + 1] if j + 1 < n else None
+                old = cost(before, order[i]) + cost(order[j], after)
+                new = cost(before, order[j]) + cost(order[i], after)
+                if new < old - 1e-9:
+                    order[i:j + 1] = order[i:j + 1][::-1]
+                    improved = True
+        if not improved:
+            break
+    return order
+
+
+def is_full_grid(panels):
+    xs = set(p.x for p in panels)
+    ys = set(p.y for p in panels)
+    return len(panels) == len(xs) * len(ys) and len(set((p.x, p.y) for p in panels)) == len(panels)
+
+
+def plan_row_major(panels, slew_model, filters, exposure_seconds, filter_model=None, start=None):
+    """
+    The plain row-major order with the same filter order on every panel, as mosaic.py used to do
+    """
+
+    order = sorted(panels, key=lambda p: (p.y, p.x))
+    return evaluate("row-major", order, slew_model, filters, exposure_seconds, filter_model, start, alternate_filters=False)
+
+
+def plan_mosaic(panels, slew_model, filters, exposure_seconds, filter_model=None, start=None):
+    """
+    The fastest visit order found for the panels
+    """
+
+    candidates = []
+    if is_full_grid(panels):
+        candidates.extend(("serpentine", order) for order in serpentine_orders(panels))
+    tour = two_opt(nearest_neighbor_order(panels, slew_model, start), slew_model, start)
+    candidates.append(("nearest neighbour + 2-opt", tour))
+
+    name, order = min(candidates, key=lambda c: path_seconds(c[1], slew_model, start))
+    return evaluate(name, order, slew_model, filters, exposure_seconds, filter_model, start)
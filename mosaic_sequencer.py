@@ -0,0 +1,244 @@
+"""
+Resumable mosaic acquisition: the mosaic is a list of panel x filter
+exposures, and every finished frame is recorded, so a rerun after a crash or
+a dropped camera link continues with the first missing frame.
+
+    sequencer = MosaicSequencer(plan, "images/mosaic2")
+    for panel, filters in sequencer.remaining_visits():
+        goto(panel)
+        for f in filters:
+            path = expose_and_save(panel, f)
+            sequencer.mark_done(panel, f, path)
+
+Completed frames are known from two sources:
+
+- a journal (journal.jsonl in the image directory), with one line appended
+  and synced to disk per frame
+- the images already in the directory, named ..._{x}_{y}_{f}.fit as
+  mosaic.py saves them, so frames taken before the journal existed, or
+  whose journal line was lost, are not taken again
+
+Frames whose recorded or FITS header coordinates (PANELRA/PANELDEC, or the
+camera's OBJCTRA/OBJCTDEC) don't match the panel are ignored, so a directory
+reused for a different mosaic doesn't cause panels to be skipped.
+"""
+
+import glob
+import json
+import math
+import os
+import re
+import time
+from collections import namedtuple
+
+Frame = namedtuple("Frame", ["x", "y", "filter"])
+
+FILENAME_PATTERN = re.compile(r"_(\d+)_(\d+)_(\d+)\.fits?$")
+
+FITS_BLOCK = 2880
+
+# panel coordinates in journals and headers are compared with this tolerance
+COORDINATE_TOLERANCE = 1e-6
+# OBJCTRA/OBJCTDEC are written by the camera software from the mount position, rounded,
+# so they only agree with the panel center to this many arcsec
+POINTING_TOLERANCE_ARCSEC = 60
+
+
+def read_fits_header(f):
+    """
+    {keyword: value} of the primary header and its size in bytes, None if the header is cut off
+    """
+
+    cards = {}
+    size = 0
+    while True:
+        block = f.read(FITS_BLOCK)
+        if len(block) < FITS_BLOCK:
+            return None
+        size += FITS_BLOCK
+        for i in range(0, FITS_BLOCK, 80):
+            card = block[i:i+80].decode("ascii", "replace")
+            keyword = card[:8].strip()
+            if keyword == "END":
+                return cards, size
+            if card[8:10] == "= ":
+                cards[keyword] = card[10:].split("/", 1)[0].strip()
+
+
+def is_complete_fits(path):
+    """
+    Cheap check that a FITS file was written completely: the file is at least
+    as long as its primary header plus the data array the header describes,
+    padded to 2880 byte blocks
+    """
+
+    try:
+        with open(path, "rb") as f:
+            header = read_fits_header(f)
+        size = os.path.getsize(path)
+    except OSError:
+        return False
+    if header is None:
+        return False
+    cards, header_size = header
+
+    try:
+        naxis = int(cards.get("NAXIS", "0"))
+        data_size = abs(int(cards["BITPIX"])) // 8 if naxis else 0
+        for n in range(1, naxis + 1):
+            data_size *= int(cards["NAXIS%d" % n])
+    except (KeyError, ValueError):
+        return False
+    return size >= header_size + int(math.ceil(data_size / FITS_BLOCK)) * FITS_BLOCK
+
+
+def sexagesimal(value):
+    """
+    A header value like "12 34 56.7", "-05:06:07" or 12.5 as a number
+    """
+
+    if isinstance(value, (int, float)):
+        return float(value)
+    parts = re.split(r"[\s:hmsd]+", value.strip())
+    parts = [p for p in parts if p]
+    if not 1 <= len(parts) <= 3:
+        raise ValueError("Not a sexagesimal value: %r" % value)
+    sign = -1 if parts[0].startswith("-") else 1
+    return sign * sum(abs(float(p)) / 60**i for i, p in enumerate(parts))
+
+
+def fits_coordinates(path):
+    """
+    (ra_hours, dec_degs, tolerance_arcsec) of the panel from the header: PANELRA/PANELDEC as
+    mosaic.py writes them, else the camera's OBJCTRA/OBJCTDEC. None if neither is there.
+    Raises ValueError if the header can't be read or its coordinates can't be parsed
+    """
+
+    from astropy.io import fits
+    try:
+        header = fits.getheader(path)
+    except Exception as e:
+        raise ValueError("Can't read the header of %s: %s" % (path, e))
+    if "PANELRA" in header and "PANELDEC" in header:
+        return float(header["PANELRA"]), float(header["PANELDEC"]), None
+    if "OBJCTRA" in header and "OBJCTDEC" in header:
+        return sexagesimal(header["OBJCTRA"]), sexagesimal(header["OBJCTDEC"]), POINTING_TOLERANCE_ARCSEC
+    return None
+
+
+def matches(panel, ra_hours, dec_degs, tolerance_arcsec=None):
+    """
+    Whether the coordinates are the panel's, exactly or, if tolerance_arcsec is given, within that distance on the sky
+    """
+
+    if tolerance_arcsec is None:
+        return abs(panel.ra_hours - ra_hours) < COORDINATE_TOLERANCE and abs(panel.dec_degs - dec_degs) < COORDINATE_TOLERANCE
+    east = ((ra_hours - panel.ra_hours + 12) % 24 - 12) * 15 * math.cos(math.radians(panel.dec_degs))
+    return math.hypot(east, dec_degs - panel.dec_degs) * 3600 < tolerance_arcsec
+
+
+def index_images(pattern):
+    """
+    {Frame: path} of the complete images matching the glob pattern, named ..._{x}_{y}_{f}.fit
+    """
+
+    frames = {}
+    for path in sorted(glob.glob(pattern)):
+        m = FILENAME_PATTERN.search(os.path.basename(path))
+        if m is not None and is_complete_fits(path):
+            frames[Frame(*map(int, m.groups()))] = path
+    return frames
+
+
+class Journal:
+    """
+    Append-only log of completed frames, one JSON object per line
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = []
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        self.entries.append(json.loads(line))
+                    except ValueError:
+                        # a line cut off by a crash while it was written
+                        pass
+
+    def append(self, entry):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.entries.append(entry)
+
+
+class MosaicSequencer:
+    """
+    Tracks which frames of a mosaic_planner.Plan are done. image_pattern is
+    the glob of existing images to index, by default all .fit files in directory.
+    """
+
+    def __init__(self, plan, directory, journal_name="journal.jsonl", image_pattern=None):
+        self.plan = plan
+        self.directory = directory
+        self.journal = Journal(os.path.join(directory, journal_name))
+        self.panels = dict(((visit.panel.x, visit.panel.y), visit.panel) for visit in plan.visits)
+
+        self.done = {}
+        # images the journal records for another mosaic
+        foreign = set()
+        for entry in self.journal.entries:
+            frame = Frame(entry["x"], entry["y"], entry["filter"])
+            panel = self.panels.get((frame.x, frame.y))
+            if panel is None or not matches(panel, entry["ra_hours"], entry["dec_degs"]):
+                foreign.add(os.path.normpath(entry["path"]))
+            elif is_complete_fits(entry["path"]):
+                self.done[frame] = entry["path"]
+
+        for frame, path in index_images(image_pattern or os.path.join(directory, "*.fit")).items():
+            panel = self.panels.get((frame.x, frame.y))
+            if frame in self.done or panel is None or os.path.normpath(path) in foreign:
+                continue
+            try:
+                coordinates = fits_coordinates(path)
+            except ValueError:
+                # unreadable coordinates don't prove that the image is of this panel
+                continue
+            # images whose header wasn't written yet when the run stopped have no coordinates
+            if coordinates is None or matches(panel, *coordinates):
+                self.done[frame] = path
+
+    @property
+    def frames(self):
+        return [Frame(visit.panel.x, visit.panel.y, f) for visit in self.plan.visits for f in visit.filters]
+
+    def remaining_visits(self):
+        """
+        The visits of the plan in order, each with only the filters still to be taken; finished panels are left out
+        """
+
+        visits = []
+        for visit in self.plan.visits:
+            filters = [f for f in visit.filters if Frame(visit.panel.x, visit.panel.y, f) not in self.done]
+            if filters:
+                visits.append(visit._replace(filters=filters))
+        return visits
+
+    def mark_done(self, panel, filter, path):
+        self.journal.append({
+            "x": panel.x, "y": panel.y, "filter": filter,
+            "ra_hours": panel.ra_hours, "dec_degs": panel.dec_degs,
+            "path": path, "time": time.time(),
+        })
+        self.done[Frame(panel.x, panel.y, filter)] = path
+
+    def progress(self):
+        total = len(self.frames)
+        done = sum(1 for frame in self.frames if frame in self.done)
+        return "%d of %d frames done, %d remaining" % (done, total, total - done)
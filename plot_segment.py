@@ -7,10 +7,13 @@
     adapted by void4 2023 Jul 16
 """ 
 
-import re, requests
+import re, requests, threading
+import numpy as np
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from functools import lru_cache
 from itertools import product
-from datetime import datetime, timezone
+from datetime import datetime
 
 url = "https://ssd.jpl.nasa.gov/api/horizons_file.api"
 api_version = "1.0" 
@@ -28,8 +31,94 @@ VEC_LABELS=NO
 CSV_FORMAT=YES
 """ 
 
+try:
+    # Persistent cache shared with track.py; not available when pasted into a Sage cell
+    from horizons_cache import HorizonsCache
+    disk_cache = HorizonsCache()
+except ImportError:
+    disk_cache = None
+
+step_units = {'m': 60, 'min': 60, 'h': 3600, 'hour': 3600, 'd': 86400, 'day': 86400}
+
+def step_seconds(step):
+    """ Step size in seconds, or None if it is not a fixed time step (e.g. a number of intervals) """
+    m = re.fullmatch(r"(\d+)\s*([a-z]+?)s?", step.strip().lower())
+    if m is None or m.group(2) not in step_units:
+        return None
+    return int(m.group(1)) * step_units[m.group(2)]
+
+def to_jd(s):
+    """ JD of a Horizons time string like "2023-Jul-17 08:00" """
+    dt = datetime.strptime(s, "%Y-%b-%d %H:%M")
+    return (dt - datetime(2000, 1, 1, 12)).total_seconds() / 86400 + 2451545.0
+
+# Long ranges are requested in windows of at most this many rows, several at a time
+window_rows = 5000
+max_requests = 4
+window_pool = ThreadPoolExecutor(max_requests, thread_name_prefix="horizons")
+
+# One session per thread, so the connections to Horizons are kept open between requests
+local = threading.local()
+
+def session():
+    if not hasattr(local, 'session'):
+        local.session = requests.Session()
+    return local.session
+
+class QueryFailed(Exception):
+    pass
+
+def fetch_windows(target, center, plane, jds, step):
+    """ Lines of the vector table at the epochs jds, fetched in windows of window_rows concurrently, None if a window failed """
+    seconds = step_seconds(step)
+    windows = [jds[i:i + window_rows] for i in range(0, len(jds), window_rows)]
+    # The stop time is half a step after the last epoch, so rounding of the JDs can't drop it
+    futures = {window_pool.submit(query_horizons, target, center, plane, f"JD{w[0]:.9f}", f"JD{w[-1] + seconds / 172800:.9f}", step, i == 0): i
+               for i, w in enumerate(windows)}
+    parts = [None] * len(windows)
+    for future in as_completed(futures):
+        data = future.result()
+        if data is None:
+            # A table with a gap in it would be plotted as if it were complete
+            for f in futures:
+                f.cancel()
+            return None
+        parts[futures[future]] = data.splitlines()
+    return [line for part in parts for line in part]
+
 @lru_cache(maxsize=int(20))
 def fetch_data(target, center, plane, start, stop, step):
+    seconds = step_seconds(step)
+    try:
+        start_jd, stop_jd = to_jd(start), to_jd(stop)
+    except ValueError:
+        seconds = None
+    if seconds is None:
+        return query_horizons(target, center, plane, start, stop, step)
+
+    if disk_cache is None:
+        jds = start_jd + np.arange(int(round((stop_jd - start_jd) * 86400 / seconds)) + 1) * seconds / 86400
+        lines = fetch_windows(target, center, plane, jds, step)
+        return "\n".join(lines) + "\n" if lines else None
+
+    # Only the spans that are not on disk yet are requested from Horizons
+    def fetch_span(jds):
+        lines = fetch_windows(target, center, plane, jds, step)
+        if lines is None:
+            # Raised so that nothing of the incomplete span is stored in the cache
+            raise QueryFailed()
+        return {'jd': [float(line.split(',', 1)[0]) for line in lines], 'line': np.array(lines, dtype=str)}
+
+    key = {'target': target, 'center': center, 'plane': plane, 'table': 'vectors'}
+    try:
+        rows = disk_cache.fetch(key, start_jd, stop_jd, seconds, fetch_span)
+    except QueryFailed:
+        return None
+    if len(rows.get('line', [])) == 0:
+        return None
+    return "\n".join(rows['line']) + "\n"
+
+def query_horizons(target, center, plane, start, stop, step, verbose=True):
     cmd = f"""
 COMMAND='{target}'
 CENTER='{center}'
@@ -40,7 +129,7 @@ STEP_SIZE='{step}'
 """
     cmd = f"!$$SOF{cmd}{base_cmd}!$$EOF"
     #print(cmd)
-    req = requests.post(url, data={'format': 'text'}, files={'input': ('cmd', cmd)})
+    req = session().post(url, data={'format': 'text'}, files={'input': ('cmd', cmd)})
     version = re.search(r"API VERSION:\s*(\S*)", req.text).group(1)
     if version != api_version:
         print(f"Warning: API version is {version}, but this script is for {api_version}") 
@@ -58,47 +147,108 @@ STEP_SIZE='{step}'
     #print("\n".join(lines[5:15])) 
 
     ref = re.search(r"(?si)REFERENCE FRAME AND COORDINATES(.*)\s*Symbol meaning", req.text).group(1)
-    print("Reference Frame :", ref)
+    if verbose:
+        print("Reference Frame :", ref)
     return data 
 
-def extract_data(data, get_dates=False, obs_start=None, obs_end=None):
-    data = data.splitlines()
-    data = [s.split(',')[:-1] for s in data]
-    #for row in data: print(row) 
+# Rows of the vector table, as arrays
+Vectors = namedtuple("Vectors", ["jd", "dates", "pos", "vel", "observed"])
 
-    start_obs = datetime.strptime(obs_start, "%Y-%b-%d %H:%M").replace(tzinfo=timezone.utc)
-    end_obs = datetime.strptime(obs_end, "%Y-%b-%d %H:%M").replace(tzinfo=timezone.utc)
-    
-    pos, tgt, dates, colors = [], [], [], []
-    for row in data:
-        if get_dates:
-            dates.append(f"{row[1]} {float(row[0])}")
-            extracted = row[1].split(" ", 2)[2].split(".")[0]
-            #print("Extracted:", row[1], extracted)
-            if start_obs and end_obs and start_obs <= datetime.strptime(extracted, "%Y-%b-%d %H:%M:%S").replace(tzinfo=timezone.utc) <= end_obs:
-                colors.append("red")
-            else:
-                colors.append("yellow")
-        # Extract position & velocity
-        row = [float(u) for u in row[2:]]
-        pos.append(vector(row[:3]))
-        tgt.append(vector(row[3:]).normalized())
-    return pos, tgt, dates, colors
+def parse_vectors(data, obs_start=None, obs_end=None):
+    """ Parse the $$SOE..$$EOE block of a CSV vector table in one pass
+        into arrays: JD, calendar date strings, positions and velocities (N x 3),
+        and a mask of the rows in the observation window obs_start..obs_end
+    """
+    # Every row ends with a comma, so splitting the whole block on commas
+    # gives 8 fields per row: JD, date, X, Y, Z, VX, VY, VZ
+    fields = data.split(',')
+    del fields[-1]
+    if len(fields) % 8:
+        raise ValueError("Not a CSV vector table with 8 columns")
+    dates = np.array([s.strip() for s in fields[1::8]])
+    del fields[1::8]
+    values = np.array(fields, dtype=float).reshape(-1, 7)
+    jd = values[:, 0]
+
+    observed = np.zeros(len(jd), dtype=bool)
+    if obs_start and obs_end:
+        # Rows are on whole seconds, the printed JDs are accurate to better than 0.5 s
+        tolerance = 0.5 / 86400
+        observed = (jd >= to_jd(obs_start) - tolerance) & (jd <= to_jd(obs_end) + tolerance)
+    return Vectors(jd, dates, values[:, 1:4], values[:, 4:7], observed)
+
+def extract_data(data, get_dates=False, obs_start=None, obs_end=None):
+    """ Positions, unit tangents, dates and the colour of every row:
+        red in the observation window, yellow outside of it
+    """
+    v = parse_vectors(data, obs_start, obs_end)
+    tgt = v.vel / np.linalg.norm(v.vel, axis=1)[:, None]
+    colors = np.where(v.observed, "red", "yellow")
+    return v.pos, tgt, (v.dates if get_dates else []), colors
 
 # Build Bezier curves
 def bez(pos, tgt):
-    pos_tgt = zip(pos, tgt)
-    p0, t0 = next(pos_tgt)
-    row = [p0]
-    curves = []
-    for p, t in pos_tgt:
-        s = abs(p - p0) / 3
-        row.extend([p0 + t0*s, p - t*s, p])
-        curves.append(row)
-        row = []
-        p0, t0 = p, t
+    """ Cubic Bézier segments through the positions, with the control
+        points a third of the chord along the tangents
+    """
+    pos, tgt = np.asarray(pos, dtype=float), np.asarray(tgt, dtype=float)
+    if len(pos) < 2:
+        return []
+    s = np.linalg.norm(pos[1:] - pos[:-1], axis=1)[:, None] / 3
+    c0 = pos[:-1] + tgt[:-1] * s
+    c1 = pos[1:] - tgt[1:] * s
+    curves = [[tuple(a), tuple(b), tuple(p)] for a, b, p in zip(c0.tolist(), c1.tolist(), pos[1:].tolist())]
+    curves[0].insert(0, tuple(pos[0].tolist()))
     return curves 
 
+def bezier_error(pos, tgt, first, last, k):
+    """ Distance of the samples k from the Bézier segments first[k]..last[k] built
+        as in bez, each sample compared with the curve at the same fraction of time
+    """
+    p0, p3 = pos[first], pos[last]
+    s = np.linalg.norm(p3 - p0, axis=1)[:, None] / 3
+    p1 = p0 + tgt[first] * s
+    p2 = p3 - tgt[last] * s
+    u = ((k - first) / (last - first))[:, None]
+    v = 1 - u
+    curve = v*v*v * p0 + 3*v*v*u * p1 + 3*v*u*u * p2 + u*u*u * p3
+    return np.linalg.norm(pos[k] - curve, axis=1)
+
+def decimate(pos, tgt, tolerance):
+    """ Indices of the samples to keep, so that the Bézier curve through them
+        passes within tolerance of every sample. Starting from the end points,
+        every segment that is too far from one of its samples is split in the
+        middle, all of them at once, so it takes about log2(len(pos)) passes
+    """
+    n = len(pos)
+    if n < 3:
+        return np.arange(n)
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, -1]] = True
+    while True:
+        kept, k = np.flatnonzero(keep), np.flatnonzero(~keep)
+        if len(k) == 0:
+            break
+        segment = np.searchsorted(kept, k) - 1
+        error = bezier_error(pos, tgt, kept[segment], kept[segment + 1], k)
+        # The samples of each segment are contiguous in k
+        starts = np.flatnonzero(np.diff(segment, prepend=-1))
+        split = segment[starts[np.maximum.reduceat(error, starts) > tolerance]]
+        if len(split) == 0:
+            break
+        keep[(kept[split] + kept[split + 1]) // 2] = True
+    return np.flatnonzero(keep)
+
+def colour_runs(colors):
+    """ (start, stop) of the runs of samples with the same colour, each run
+        extended to the first sample of the next so the curve stays connected.
+        Runs of a single sample, where the colour changes at the last one, are
+        left out: there is no curve to draw and the previous run ends there
+    """
+    breaks = np.flatnonzero(colors[1:] != colors[:-1]) + 1
+    runs = zip(np.append(0, breaks).tolist(), np.append(breaks + 1, len(colors)).tolist())
+    return [(first, last) for first, last in runs if last - first >= 2]
+
 # Draw a 3D box, with opposite corners a & b
 def wire_box(a, b, **kw):
     v = [*product(*zip(a, b))]
@@ -107,13 +257,23 @@ def wire_box(a, b, **kw):
     P += sum(line3d(t, **kw) for t in zip(v[:4], v[4:]))
     return P 
 
+try:
+    interact
+except NameError:
+    # Not running in Sage: nothing can be plotted, but the functions above can
+    # still be imported, e.g. by benchmarks/bench_plot_segment.py
+    def interact(f):
+        return f
+    def Selector(values, **kw):
+        return values[0]
+
 @interact
 def main(
   start="2023-Jul-17 08:00", stop="2023-Jul-17 14:00", step="1m", obs_start="2023-Jul-17 10:05", obs_end="2023-Jul-17 11:03",
   center="399", targets="-158",
   palette="blue, yellow, red",
   plane = Selector(['Ecliptic', 'Frame', 'Body Equator'], selector_type='radio'),
-  curve=True, dots=False, size=5, label_step=30,
+  curve=True, dots=False, size=5, label_step=30, tolerance=1e-4,
   frame=True, dark=True, perspective=False, auto_update=False): 
 
     if not (dots or curve):
@@ -136,24 +296,31 @@ def main(
     org = (0, 0, 0)
     P = point3d(org, size=ps, color=palette[0]) 
 
-    for j, (target, color) in enumerate(zip(targets, palette[1:])):
-        data = fetch_data(target, center, plane, start, stop, step)
+    # All targets are requested at once, and each is plotted as soon as it has arrived
+    targets = list(zip(targets, palette[1:]))
+    target_pool = ThreadPoolExecutor(max(1, len(targets)), thread_name_prefix="target")
+    fetches = [target_pool.submit(fetch_data, target, center, plane, start, stop, step) for target, color in targets]
+    target_pool.shutdown(wait=False)
+
+    for (target, color), fetch in zip(targets, fetches):
+        data = fetch.result()
         if data is None:
             return
-        if j == 0 and label_step != 0:
-            pos, tgt, dates, colors = extract_data(data, get_dates=True, obs_start=obs_start, obs_end=obs_end)
-        else:
-            pos, tgt, _, _ = extract_data(data, get_dates=False, obs_start=obs_start, obs_end=obs_end) 
+        pos, tgt, dates, colors = extract_data(data, get_dates=bool(label_step), obs_start=obs_start, obs_end=obs_end) 
 
         if dots:
-            P += point3d(pos, size=ps, color=color)
+            P += point3d(pos.tolist(), size=ps, color=color)
         if curve:
-            for colorgroup in set(colors):
-                P += bezier3d(bez([p for k,p in enumerate(pos) if colors[k]==colorgroup], [p for k,p in enumerate(tgt) if colors[k]==colorgroup]), color=colorgroup) 
+            # Only the samples needed to keep the curve within tolerance of the scene size are drawn
+            scale = tolerance * np.abs(pos).max()
+            for first, last in colour_runs(colors):
+                keep = first + decimate(pos[first:last], tgt[first:last], scale)
+                P += bezier3d(bez(pos[keep], tgt[keep]), color=colors[first]) 
 
-        if label_step:
-            P += sum(text3d(dates[i*label_step].split(" ", 2)[2].rsplit(" ", 1)[0].split(".")[0], p, fontsize="x-small")
-              for i, p in enumerate(pos[::label_step])) 
+        if label_step and len(dates):
+            # "A.D. 2023-Jul-17 08:00:00.0000" -> "2023-Jul-17 08:00:00"
+            P += sum(text3d(date.split(" ", 1)[1].split(".")[0], p, fontsize="x-small")
+              for date, p in zip(dates[::label_step], pos[::label_step].tolist())) 
 
     #if label_step:
     #    print("\nLabels")
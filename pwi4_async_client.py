@@ -0,0 +1,277 @@
+"""
+asyncio counterpart of the PWI4 client in pwi4_client.py.
+
+AsyncPWI4 offers every high-level method of PWI4 (mount, focuser, rotator,
+m3, model, virtualcamera, ...) as a coroutine, so that goto commands, status
+polls and other work can run concurrently in one event loop without threads.
+Status responses are parsed by the same PWI4Status class.
+
+Example:
+
+    async def main():
+        pwi4 = AsyncPWI4()
+        s, _ = await asyncio.gather(pwi4.status(), pwi4.mount_goto_ra_dec_j2000(10.5, 20))
+        print(s.mount.ra_j2000_hours)
+        await pwi4.close()
+
+    asyncio.run(main())
+
+Requires Python 3.7 or newer.
+"""
+
+import asyncio
+import os
+
+from pwi4_client import PWI4, PWI4HttpCommunicator
+
+
+class AsyncPWI4(PWI4):
+    """
+    Client to the PWI4 telescope control application, for use with asyncio.
+
+    All high-level methods of PWI4 are inherited. They issue their requests
+    through request_with_status() and request(), which are coroutines here,
+    so each of them returns an awaitable.
+    """
+
+    def __init__(self, host="localhost", port=8220, pool_size=4):
+        self.host = host
+        self.port = port
+        self.comm = PWI4AsyncHttpCommunicator(host, port, pool_size)
+
+    ### High-level methods that do more than a single request ###
+
+    async def mount_custom_path_upload(self, points, coord_type="radec", chunk_size=1000):
+        await self.mount_custom_path_new(coord_type)
+        for i in range(0, len(points), chunk_size):
+            await self.mount_custom_path_add_point_list(points[i:i+chunk_size])
+        return await self.mount_custom_path_apply()
+
+    async def virtualcamera_take_image_and_save(self, filename, chunk_size=1024*1024):
+        """
+        Request a fake FITS image from PWI4.
+        Save the contents to the specified filename, streaming them in chunks
+        to filename + ".tmp", which is renamed once the image is complete
+        """
+
+        tmp = filename + ".tmp"
+        try:
+            with open(tmp, "wb") as f:
+                size = await self.comm.request_stream("/virtualcamera/take_image", f.write, chunk_size)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        os.replace(tmp, filename)
+        return size
+
+    async def virtualcamera_take_image_into(self, buffer):
+        """
+        Read a fake FITS image into a writable buffer (bytearray, memoryview
+        or NumPy array), see PWI4.virtualcamera_take_image_into()
+        """
+
+        return await self.comm.request_stream("/virtualcamera/take_image", BufferWriter(buffer).write)
+
+    ### Low-level methods for issuing requests ##################
+
+    async def request(self, command, **kwargs):
+        return await self.comm.request(command, **kwargs)
+
+    async def request_with_status(self, command, **kwargs):
+        response_text = await self.request(command, **kwargs)
+        return self.parse_status(response_text)
+
+    async def close(self):
+        await self.comm.close()
+
+
+class ClosedBeforeResponse(ConnectionError):
+    """
+    A kept-alive connection was closed by the server before any part of the response arrived
+    """
+
+
+class PWI4AsyncHttpCommunicator(PWI4HttpCommunicator):
+    """
+    Manages communication with PWI4 via HTTP/1.1 on asyncio streams.
+
+    Like PWI4HttpCommunicator, idle keep-alive connections are kept in a
+    pool of up to pool_size and reused by later requests. Concurrent
+    requests each use their own connection.
+    """
+
+    def __init__(self, host="localhost", port=8220, pool_size=4):
+        PWI4HttpCommunicator.__init__(self, host, port, pool_size)
+
+    async def request(self, path, postdata=None, **kwargs):
+        """
+        Issue a request to PWI and return the response payload,
+        see PWI4HttpCommunicator.request()
+        """
+
+        return await self._request(self.make_path(path, **kwargs), postdata, None, None)
+
+    async def request_stream(self, path, sink, chunk_size=1024*1024, postdata=None, **kwargs):
+        """
+        Issue a request to PWI and pass the response payload to sink(chunk)
+        in chunks of up to chunk_size bytes as it arrives, instead of
+        collecting it in memory. Returns the size of the payload.
+        """
+
+        return await self._request(self.make_path(path, **kwargs), postdata, sink, chunk_size)
+
+    async def _request(self, url, postdata, sink, chunk_size):
+        lines = [
+            "%s %s HTTP/1.1" % ("GET" if postdata is None else "POST", url),
+            "Host: %s:%d" % (self.host, self.port),
+        ]
+        if postdata is not None:
+            lines.append("Content-Type: application/x-www-form-urlencoded")
+            lines.append("Content-Length: %d" % len(postdata))
+        message = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+        if postdata is not None:
+            message += postdata
+
+        # If a reused connection turns out to have been closed by the server
+        # before it responded, retry once on a fresh connection. Nothing else
+        # is retried, commands like goto or take_image must not run twice.
+        for attempt in range(2):
+            connection, reused = await self._acquire_async()
+            try:
+                status, reason, payload, keep_alive = await asyncio.wait_for(
+                    self._exchange(connection, message, sink, chunk_size), self.timeout_seconds)
+            except ClosedBeforeResponse:
+                self._close_connection(connection)
+                if reused and attempt == 0:
+                    continue
+                raise
+            except BaseException:
+                self._close_connection(connection)
+                raise
+
+            if keep_alive:
+                self._release(connection)
+            else:
+                self._close_connection(connection)
+            break
+
+        if status >= 400:
+            raise Exception(self.error_message(status, reason, payload)) # TODO: Consider a custom exception here
+
+        return payload
+
+    async def _exchange(self, connection, message, sink=None, chunk_size=None):
+        reader, writer = connection
+        try:
+            writer.write(message)
+            await writer.drain()
+            status_line = await reader.readline()
+        except (ConnectionResetError, BrokenPipeError) as e:
+            raise ClosedBeforeResponse(str(e)) from e
+        if not status_line:
+            raise ClosedBeforeResponse("Connection closed by PWI")
+        version, status, reason = (status_line.decode("latin-1").rstrip("\r\n").split(" ", 2) + [""])[:3]
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        connection_header = headers.get("connection", "").lower()
+        keep_alive = connection_header != "close" and (version != "HTTP/1.0" or connection_header == "keep-alive")
+
+        # Error responses are always collected, for the error message
+        streaming = sink is not None and int(status) < 400
+        chunks = []
+        total = 0
+
+        async def read(size):
+            nonlocal total
+            while size > 0:
+                chunk = await reader.readexactly(min(size, chunk_size)) if streaming else await reader.readexactly(size)
+                size -= len(chunk)
+                total += len(chunk)
+                if streaming:
+                    sink(chunk)
+                else:
+                    chunks.append(chunk)
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                size = int((await reader.readline()).split(b";", 1)[0], 16)
+                if size == 0:
+                    # Skip any trailers
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    break
+                await read(size)
+                await reader.readexactly(2)
+        elif "content-length" in headers:
+            await read(int(headers["content-length"]))
+        else:
+            while True:
+                chunk = await reader.read(chunk_size or 65536)
+                if not chunk:
+                    break
+                total += len(chunk)
+                if streaming:
+                    sink(chunk)
+                else:
+                    chunks.append(chunk)
+            keep_alive = False
+
+        payload = total if streaming else b"".join(chunks)
+        return int(status), reason, payload, keep_alive
+
+    async def _acquire_async(self):
+        while self._pool:
+            connection = self._pool.pop()
+            if not connection[0].at_eof():
+                return connection, True
+            self._close_connection(connection)
+        connection = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout_seconds)
+        return connection, False
+
+    def _release(self, connection):
+        if len(self._pool) < self.pool_size:
+            self._pool.append(connection)
+        else:
+            self._close_connection(connection)
+
+    def _close_connection(self, connection):
+        connection[1].close()
+
+    async def close(self):
+        """
+        Close all idle connections
+        """
+
+        pool, self._pool = self._pool, []
+        for reader, writer in pool:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+
+class BufferWriter:
+    """
+    sink for request_stream() that copies the chunks into a writable buffer
+    """
+
+    def __init__(self, buffer):
+        self.view = memoryview(buffer)
+        if self.view.ndim != 1 or self.view.itemsize != 1:
+            self.view = self.view.cast("B")
+        self.size = 0
+
+    def write(self, chunk):
+        end = self.size + len(chunk)
+        if end > len(self.view):
+            raise ValueError("Response does not fit into a buffer of %d bytes" % len(self.view))
+        self.view[self.size:end] = chunk
+        self.size = end
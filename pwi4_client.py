@@ -5,15 +5,28 @@ from other Python scripts, or can be adapted to other languages
 as needed.
 """
 
+import os
+import socket
+import threading
+
 try:
     # Python 3.x version
     from urllib.parse import urlencode
-    from urllib.request import urlopen
-    from urllib.error import HTTPError
+    import http.client as httplib
 except ImportError:
     # Python 2.7 version
     from urllib import urlencode
-    from urllib2 import urlopen, HTTPError
+    import httplib
+
+try:
+    # A kept-alive connection that the server had already closed: the request
+    # was never processed, so it is safe to send it again. RemoteDisconnected
+    # is a ConnectionResetError. Timeouts are not included, PWI may have
+    # received the request and be processing it.
+    CLOSED_BEFORE_RESPONSE = (ConnectionResetError, BrokenPipeError)
+except NameError:
+    # Python 2.7
+    CLOSED_BEFORE_RESPONSE = (httplib.BadStatusLine,)
 
 class PWI4:
     """
@@ -165,6 +178,21 @@ class PWI4:
     def mount_custom_path_apply(self):
         return self.request_with_status("/mount/custom_path/apply")
 
+    def mount_custom_path_upload(self, points, coord_type="radec", chunk_size=1000):
+        """
+        Replace the active custom path with the given points and start following it.
+
+        points: sequence of (jd, coord0, coord1) tuples; for the "radec" type these are
+                the Julian Date, J2000 RA in hours and J2000 Dec in degrees.
+        chunk_size: number of points sent per POST, so that long paths are uploaded
+                    in a few bulk requests instead of one request per point.
+        """
+
+        self.mount_custom_path_new(coord_type)
+        for i in range(0, len(points), chunk_size):
+            self.mount_custom_path_add_point_list(points[i:i+chunk_size])
+        return self.mount_custom_path_apply()
+
     def mount_model_add_point(self, ra_j2000_hours, dec_j2000_degs):
         """
         Add a calibration point to the pointing model, mapping the current pointing direction
@@ -336,16 +364,42 @@ class PWI4:
         """
         return self.request("/virtualcamera/take_image")
     
-    def virtualcamera_take_image_and_save(self, filename):
+    def virtualcamera_take_image_and_save(self, filename, chunk_size=1024*1024):
         """
         Request a fake FITS image from PWI4.
-        Save the contents to the specified filename
+        Save the contents to the specified filename.
+
+        The image is streamed to the file in chunks of chunk_size bytes
+        instead of being held in memory as a whole. It is written to
+        filename + ".tmp" first and only renamed when it is complete, so a
+        failed request doesn't leave a truncated image behind.
+        Returns the number of bytes written.
         """
 
-        contents = self.virtualcamera_take_image()
-        f = open(filename, "wb")
-        f.write(contents)
+        tmp = filename + ".tmp"
+        f = open(tmp, "wb")
+        try:
+            size = self.comm.request_stream("/virtualcamera/take_image", lambda response: copy_response(response, f.write, chunk_size))
+        except:
+            f.close()
+            os.remove(tmp)
+            raise
         f.close()
+        replace_file(tmp, filename)
+        return size
+
+    def virtualcamera_take_image_into(self, buffer):
+        """
+        Request a fake FITS image from PWI4 and read it directly into
+        buffer, which can be any writable buffer large enough for the
+        image: a bytearray, a memoryview or a NumPy array (e.g.
+        numpy.empty(size, numpy.uint8)), which can be reused for every frame.
+
+        Returns the size of the image in bytes. Raises ValueError if the
+        image does not fit into the buffer.
+        """
+
+        return self.comm.request_stream("/virtualcamera/take_image", lambda response: read_response_into(response, buffer))
 
     ### Methods for testing error handling ######################
 
@@ -395,13 +449,9 @@ class PWI4:
 
         response_dict = {}
 
-        lines = response.split("\n")
-        
-        for line in lines:
-            fields = line.split("=", 1)
-            if len(fields) == 2:
-                name = fields[0]
-                value = fields[1]
+        for line in response.split("\n"):
+            name, separator, value = line.partition("=")
+            if separator:
                 response_dict[name] = value
         
         return response_dict
@@ -419,173 +469,282 @@ class Section(object):
 
     pass
 
-class PWI4Status:
+### Lazily parsed status ########################################
+
+def _get_bool(raw, name, value_if_missing):
+    if name not in raw:
+        return value_if_missing
+    return raw[name].lower() == "true"
+
+def _get_float(raw, name, value_if_missing):
+    if name not in raw:
+        return value_if_missing
+    return float(raw[name])
+
+def _get_int(raw, name, value_if_missing):
+    if name not in raw:
+        return value_if_missing
+    return int(raw[name])
+
+def _get_string(raw, name, value_if_missing):
+    if name not in raw:
+        return value_if_missing
+    return raw[name]
+
+def _get_required_string(raw, name, value_if_missing):
+    return raw[name]
+
+class StatusField(object):
     """
-    Wraps the status response for many PWI4 commands in a class with named members
+    A single keyword of the status response, converted with one of the _get_* functions
     """
 
-    def __init__(self, status_dict):
-        self.raw = status_dict  # Allow direct access to raw entries as needed
-
-        self.pwi4 = Section()
-        self.pwi4.version = "<unknown>"
-        self.pwi4.version_field = [0, 0, 0, 0]
-
-        self.pwi4.version = self.raw["pwi4.version"] # Added in 4.0.5 beta 1
-
-        # pwi4.version_field[] was added in 4.0.9 beta 2
-        self.pwi4.version_field[0] = self.get_int("pwi4.version_field[0]", 0)
-        self.pwi4.version_field[1] = self.get_int("pwi4.version_field[1]", 0)
-        self.pwi4.version_field[2] = self.get_int("pwi4.version_field[2]", 0)
-        self.pwi4.version_field[3] = self.get_int("pwi4.version_field[3]", 0)
-
-        # response.timestamp_utc was added in 4.0.9 beta 2
-        self.response = Section()
-        self.response.timestamp_utc = self.get_string("response.timestamp_utc")
-
-
-        self.site = Section()
-        self.site.latitude_degs = self.get_float("site.latitude_degs")
-        self.site.longitude_degs = self.get_float("site.longitude_degs")
-        self.site.height_meters = self.get_float("site.height_meters")
-        self.site.lmst_hours = self.get_float("site.lmst_hours")
-
-        self.mount = Section()
-        self.mount.is_connected = self.get_bool("mount.is_connected")
-        self.mount.geometry = self.get_int("mount.geometry")
-        self.mount.timestamp_utc = self.get_string("mount.timestamp_utc") # Added in 4.0.9 beta 7
-        self.mount.julian_date = self.get_float("mount.julian_date")  # Added in 4.0.9 beta 2
-        self.mount.slew_time_constant = self.get_float("mount.slew_time_constant")  # Added in 4.0.9 beta 6
-        self.mount.ra_apparent_hours = self.get_float("mount.ra_apparent_hours")
-        self.mount.dec_apparent_degs = self.get_float("mount.dec_apparent_degs")
-        self.mount.ra_j2000_hours = self.get_float("mount.ra_j2000_hours")
-        self.mount.dec_j2000_degs = self.get_float("mount.dec_j2000_degs")
-        self.mount.target_ra_apparent_hours = self.get_float("mount.target_ra_apparent_hours") # Added in 4.0.5 beta 1
-        self.mount.target_dec_apparent_degs = self.get_float("mount.target_dec_apparent_degs") # Added in 4.0.5 beta 1
-        self.mount.azimuth_degs = self.get_float("mount.azimuth_degs")
-        self.mount.altitude_degs = self.get_float("mount.altitude_degs")
-        self.mount.is_slewing = self.get_bool("mount.is_slewing")
-        self.mount.is_tracking = self.get_bool("mount.is_tracking")
-        self.mount.field_angle_here_degs = self.get_float("mount.field_angle_here_degs")
-        self.mount.field_angle_at_target_degs = self.get_float("mount.field_angle_at_target_degs")
-        self.mount.field_angle_rate_at_target_degs_per_sec = self.get_float("mount.field_angle_rate_at_target_degs_per_sec")
-        self.mount.path_angle_at_target_degs = self.get_float("mount.path_angle_at_target_degs")
-        self.mount.path_angle_rate_at_target_degs_per_sec = self.get_float("mount.path_angle_rate_at_target_degs_per_sec")
-        self.mount.distance_to_sun_degs = self.get_float("mount.distance_to_sun_degs")      # Added in 4.0.13
-        self.mount.axis0_wrap_range_min_degs = self.get_float("mount.axis0_wrap_range_min_degs") # Added in 4.0.13
-
-
-        self.mount.axis0 = Section()
-        self.mount.axis1 = Section()
-        self.mount.axis = [self.mount.axis0, self.mount.axis1]
-
-        for axis_index in range(2):
-            axis = self.mount.axis[axis_index]
-            prefix = "mount.axis%d." % axis_index
-
-            axis.is_enabled = self.get_bool(prefix + "is_enabled")
-            axis.rms_error_arcsec = self.get_float(prefix + "rms_error_arcsec")
-            axis.dist_to_target_arcsec = self.get_float(prefix + "dist_to_target_arcsec")
-            axis.servo_error_arcsec = self.get_float(prefix + "servo_error_arcsec")
-            axis.min_mech_position_degs = self.get_float(prefix + "min_mech_position_degs") # Added in 4.0.13
-            axis.max_mech_position_degs = self.get_float(prefix + "max_mech_position_degs") # Added in 4.0.13
-            axis.target_mech_position_degs = self.get_float(prefix + "target_mech_position_degs") # Added in 4.0.13
-            axis.position_degs = self.get_float(prefix + "position_degs")
-            axis.position_timestamp_str = self.get_string(prefix + "position_timestamp") # Added in 4.0.9 beta 2
-            axis.max_velocity_degs_per_sec = self.get_float(prefix + "max_velocity_degs_per_sec") # Added in 4.0.13
-            axis.setpoint_velocity_degs_per_sec = self.get_float(prefix + "setpoint_velocity_degs_per_sec") # Added in 4.0.13
-            axis.measured_velocity_degs_per_sec = self.get_float(prefix + "measured_velocity_degs_per_sec") # Added in 4.0.13
-            axis.acceleration_degs_per_sec_sqr = self.get_float(prefix + "acceleration_degs_per_sec_sqr") # Added in 4.0.13
-            axis.measured_current_amps = self.get_float(prefix + "measured_current_amps") # Added in 4.0.13
-        
-        self.mount.model = Section()
-        self.mount.model.filename = self.get_string("mount.model.filename")
-        self.mount.model.num_points_total = self.get_int("mount.model.num_points_total")
-        self.mount.model.num_points_enabled = self.get_int("mount.model.num_points_enabled")
-        self.mount.model.rms_error_arcsec = self.get_float("mount.model.rms_error_arcsec")
-
-        # mount.offests.* was added in PWI 4.0.11 Beta 5
-        if "mount.offsets.ra_arcsec.total" not in self.raw:
-            self.mount.offsets = None  # Offset reporting not supported by running version of PWI4
-        else:
-            self.mount.offsets = Section()
-
-            self.mount.offsets.ra_arcsec = Section()
-            self.mount.offsets.ra_arcsec.total=self.get_float("mount.offsets.ra_arcsec.total")
-            self.mount.offsets.ra_arcsec.rate=self.get_float("mount.offsets.ra_arcsec.rate")
-            self.mount.offsets.ra_arcsec.gradual_offset_progress=self.get_float("mount.offsets.ra_arcsec.gradual_offset_progress")
-
-            self.mount.offsets.dec_arcsec = Section()
-            self.mount.offsets.dec_arcsec.total=self.get_float("mount.offsets.dec_arcsec.total")
-            self.mount.offsets.dec_arcsec.rate=self.get_float("mount.offsets.dec_arcsec.rate")
-            self.mount.offsets.dec_arcsec.gradual_offset_progress=self.get_float("mount.offsets.dec_arcsec.gradual_offset_progress")
-
-            self.mount.offsets.axis0_arcsec = Section()
-            self.mount.offsets.axis0_arcsec.total=self.get_float("mount.offsets.axis0_arcsec.total")
-            self.mount.offsets.axis0_arcsec.rate=self.get_float("mount.offsets.axis0_arcsec.rate")
-            self.mount.offsets.axis0_arcsec.gradual_offset_progress=self.get_float("mount.offsets.axis0_arcsec.gradual_offset_progress")
-
-            self.mount.offsets.axis1_arcsec = Section()
-            self.mount.offsets.axis1_arcsec.total=self.get_float("mount.offsets.axis1_arcsec.total")
-            self.mount.offsets.axis1_arcsec.rate=self.get_float("mount.offsets.axis1_arcsec.rate")
-            self.mount.offsets.axis1_arcsec.gradual_offset_progress=self.get_float("mount.offsets.axis1_arcsec.gradual_offset_progress")
-
-            self.mount.offsets.path_arcsec = Section()
-            self.mount.offsets.path_arcsec.total=self.get_float("mount.offsets.path_arcsec.total")
-            self.mount.offsets.path_arcsec.rate=self.get_float("mount.offsets.path_arcsec.rate")
-            self.mount.offsets.path_arcsec.gradual_offset_progress=self.get_float("mount.offsets.path_arcsec.gradual_offset_progress")
-            
-            self.mount.offsets.transverse_arcsec = Section()
-            self.mount.offsets.transverse_arcsec.total=self.get_float("mount.offsets.transverse_arcsec.total")
-            self.mount.offsets.transverse_arcsec.rate=self.get_float("mount.offsets.transverse_arcsec.rate")
-            self.mount.offsets.transverse_arcsec.gradual_offset_progress=self.get_float("mount.offsets.transverse_arcsec.gradual_offset_progress")
-
-        self.focuser = Section()
-        self.focuser.exists = self.get_bool("focuser.exists", False) # Added in 4.0.99 Beta 2
-        self.focuser.is_connected = self.get_bool("focuser.is_connected")
-        self.focuser.is_enabled = self.get_bool("focuser.is_enabled")
-        self.focuser.position = self.get_float("focuser.position")
-        self.focuser.is_moving = self.get_bool("focuser.is_moving")
-        
-        self.rotator = Section()
-        self.rotator.exists = self.get_bool("rotator.exists", False) # Added in 4.0.99 Beta 2
-        self.rotator.is_connected = self.get_bool("rotator.is_connected")
-        self.rotator.is_enabled = self.get_bool("rotator.is_enabled")
-        self.rotator.mech_position_degs = self.get_float("rotator.mech_position_degs")
-        self.rotator.field_angle_degs = self.get_float("rotator.field_angle_degs")
-        self.rotator.is_moving = self.get_bool("rotator.is_moving")
-        self.rotator.is_slewing = self.get_bool("rotator.is_slewing")
-
-        self.m3 = Section()
-        self.m3.exists = self.get_bool("m3.exists", False) # Added in 4.0.99 Beta 2
-        self.m3.port = self.get_int("m3.port")
-
-        self.autofocus = Section()
-        self.autofocus.is_running = self.get_bool("autofocus.is_running")
-        self.autofocus.success = self.get_bool("autofocus.success")
-        self.autofocus.best_position = self.get_float("autofocus.best_position")
-        self.autofocus.tolerance = self.get_float("autofocus.tolerance")
+    __slots__ = ("key", "convert", "default")
+
+    def __init__(self, key, convert, default=None):
+        self.key = key
+        self.convert = convert
+        self.default = default
 
+    def __call__(self, section):
+        return self.convert(section.raw, self.key, self.default)
+
+    def keys(self):
+        return [self.key]
+
+class StatusSubsection(object):
+    """
+    A nested LazySection. If condition_key is given and missing from the
+    response, the attribute is None instead.
+    """
+
+    __slots__ = ("section_class", "condition_key")
+
+    def __init__(self, section_class, condition_key=None):
+        self.section_class = section_class
+        self.condition_key = condition_key
+
+    def __call__(self, section):
+        if self.condition_key is not None and self.condition_key not in section.raw:
+            return None
+        return self.section_class(section.raw)
+
+    def keys(self):
+        return self.section_class.status_keys()
+
+class StatusComputed(object):
+    """
+    A value derived from the section by an arbitrary function, e.g. a list of other fields
+    """
+
+    __slots__ = ("function", "_keys")
+
+    def __init__(self, function, keys=()):
+        self.function = function
+        self._keys = list(keys)
+
+    def __call__(self, section):
+        return self.function(section)
+
+    def keys(self):
+        return self._keys
+
+class LazySection(object):
+    """
+    Group of status properties that are only converted from the raw response
+    the first time they are accessed. Each property is stored in a slot, so
+    later accesses are plain attribute reads and no per-instance dict is needed.
+
+    Subclasses are created with make_section() from a schema that maps
+    attribute names to StatusField, StatusSubsection or StatusComputed entries.
+    """
+
+    __slots__ = ("raw",)
+    _fields = {}
+
+    def __init__(self, raw):
+        self.raw = raw
+
+    def __getattr__(self, name):
+        # Only called while the slot for this property is still empty
+        try:
+            field = self._fields[name]
+        except KeyError:
+            raise AttributeError("'%s' object has no attribute '%s'" % (type(self).__name__, name))
+        value = field(self)
+        setattr(self, name, value)
+        return value
+
+    @classmethod
+    def status_keys(cls):
+        """
+        All status keywords read by this section and its subsections
+        """
+
+        keys = []
+        for field in cls._fields.values():
+            keys.extend(field.keys())
+        return keys
 
     def get_bool(self, name, value_if_missing=None):
-        if name not in self.raw:
-            return value_if_missing
-        return self.raw[name].lower() == "true"
+        return _get_bool(self.raw, name, value_if_missing)
 
     def get_float(self, name, value_if_missing=None):
-        if name not in self.raw:
-            return value_if_missing
-        return float(self.raw[name])
+        return _get_float(self.raw, name, value_if_missing)
 
     def get_int(self, name, value_if_missing=None):
-        if name not in self.raw:
-            return value_if_missing
-        return int(self.raw[name])
+        return _get_int(self.raw, name, value_if_missing)
     
     def get_string(self, name, value_if_missing=None):
-        if name not in self.raw:
-            return value_if_missing
-        return self.raw[name]
+        return _get_string(self.raw, name, value_if_missing)
+
+def make_section(name, fields, base=LazySection):
+    return type(name, (base,), {"__slots__": tuple(fields), "_fields": fields})
+
+def _floats(prefix, names):
+    return dict((name, StatusField(prefix + name, _get_float)) for name in names)
+
+def _axis_section(axis_index):
+    prefix = "mount.axis%d." % axis_index
+    fields = {
+        "is_enabled": StatusField(prefix + "is_enabled", _get_bool),
+        "position_timestamp_str": StatusField(prefix + "position_timestamp", _get_string), # Added in 4.0.9 beta 2
+    }
+    fields.update(_floats(prefix, [
+        "rms_error_arcsec",
+        "dist_to_target_arcsec",
+        "servo_error_arcsec",
+        "min_mech_position_degs", # Added in 4.0.13
+        "max_mech_position_degs", # Added in 4.0.13
+        "target_mech_position_degs", # Added in 4.0.13
+        "position_degs",
+        "max_velocity_degs_per_sec", # Added in 4.0.13
+        "setpoint_velocity_degs_per_sec", # Added in 4.0.13
+        "measured_velocity_degs_per_sec", # Added in 4.0.13
+        "acceleration_degs_per_sec_sqr", # Added in 4.0.13
+        "measured_current_amps", # Added in 4.0.13
+    ]))
+    return make_section("AxisStatus%d" % axis_index, fields)
+
+def _offset_section(name):
+    return make_section("OffsetStatus", _floats("mount.offsets.%s." % name, ["total", "rate", "gradual_offset_progress"]))
+
+_version_field_keys = ["pwi4.version_field[%d]" % i for i in range(4)]
+
+PWI4VersionStatus = make_section("PWI4VersionStatus", {
+    "version": StatusField("pwi4.version", _get_required_string), # Added in 4.0.5 beta 1
+    # pwi4.version_field[] was added in 4.0.9 beta 2
+    "version_field": StatusComputed(lambda s: [s.get_int(key, 0) for key in _version_field_keys], _version_field_keys),
+})
+
+# response.timestamp_utc was added in 4.0.9 beta 2
+ResponseStatus = make_section("ResponseStatus", {
+    "timestamp_utc": StatusField("response.timestamp_utc", _get_string),
+})
+
+SiteStatus = make_section("SiteStatus", _floats("site.", ["latitude_degs", "longitude_degs", "height_meters", "lmst_hours"]))
+
+_mount_fields = {
+    "is_connected": StatusField("mount.is_connected", _get_bool),
+    "geometry": StatusField("mount.geometry", _get_int),
+    "timestamp_utc": StatusField("mount.timestamp_utc", _get_string), # Added in 4.0.9 beta 7
+    "is_slewing": StatusField("mount.is_slewing", _get_bool),
+    "is_tracking": StatusField("mount.is_tracking", _get_bool),
+    "axis0": StatusSubsection(_axis_section(0)),
+    "axis1": StatusSubsection(_axis_section(1)),
+    "axis": StatusComputed(lambda s: [s.axis0, s.axis1]),
+    "model": StatusSubsection(make_section("ModelStatus", {
+        "filename": StatusField("mount.model.filename", _get_string),
+        "num_points_total": StatusField("mount.model.num_points_total", _get_int),
+        "num_points_enabled": StatusField("mount.model.num_points_enabled", _get_int),
+        "rms_error_arcsec": StatusField("mount.model.rms_error_arcsec", _get_float),
+    })),
+    # mount.offests.* was added in PWI 4.0.11 Beta 5; None if not supported by running version of PWI4
+    "offsets": StatusSubsection(make_section("OffsetsStatus", dict(
+        (name, StatusSubsection(_offset_section(name)))
+        for name in ["ra_arcsec", "dec_arcsec", "axis0_arcsec", "axis1_arcsec", "path_arcsec", "transverse_arcsec"])),
+        condition_key="mount.offsets.ra_arcsec.total"),
+}
+_mount_fields.update(_floats("mount.", [
+    "julian_date", # Added in 4.0.9 beta 2
+    "slew_time_constant", # Added in 4.0.9 beta 6
+    "ra_apparent_hours",
+    "dec_apparent_degs",
+    "ra_j2000_hours",
+    "dec_j2000_degs",
+    "target_ra_apparent_hours", # Added in 4.0.5 beta 1
+    "target_dec_apparent_degs", # Added in 4.0.5 beta 1
+    "azimuth_degs",
+    "altitude_degs",
+    "field_angle_here_degs",
+    "field_angle_at_target_degs",
+    "field_angle_rate_at_target_degs_per_sec",
+    "path_angle_at_target_degs",
+    "path_angle_rate_at_target_degs_per_sec",
+    "distance_to_sun_degs", # Added in 4.0.13
+    "axis0_wrap_range_min_degs", # Added in 4.0.13
+]))
+MountStatus = make_section("MountStatus", _mount_fields)
+
+FocuserStatus = make_section("FocuserStatus", {
+    "exists": StatusField("focuser.exists", _get_bool, False), # Added in 4.0.99 Beta 2
+    "is_connected": StatusField("focuser.is_connected", _get_bool),
+    "is_enabled": StatusField("focuser.is_enabled", _get_bool),
+    "position": StatusField("focuser.position", _get_float),
+    "is_moving": StatusField("focuser.is_moving", _get_bool),
+})
+
+RotatorStatus = make_section("RotatorStatus", {
+    "exists": StatusField("rotator.exists", _get_bool, False), # Added in 4.0.99 Beta 2
+    "is_connected": StatusField("rotator.is_connected", _get_bool),
+    "is_enabled": StatusField("rotator.is_enabled", _get_bool),
+    "mech_position_degs": StatusField("rotator.mech_position_degs", _get_float),
+    "field_angle_degs": StatusField("rotator.field_angle_degs", _get_float),
+    "is_moving": StatusField("rotator.is_moving", _get_bool),
+    "is_slewing": StatusField("rotator.is_slewing", _get_bool),
+})
+
+M3Status = make_section("M3Status", {
+    "exists": StatusField("m3.exists", _get_bool, False), # Added in 4.0.99 Beta 2
+    "port": StatusField("m3.port", _get_int),
+})
+
+AutofocusStatus = make_section("AutofocusStatus", {
+    "is_running": StatusField("autofocus.is_running", _get_bool),
+    "success": StatusField("autofocus.success", _get_bool),
+    "best_position": StatusField("autofocus.best_position", _get_float),
+    "tolerance": StatusField("autofocus.tolerance", _get_float),
+})
+
+class PWI4Status(make_section("PWI4StatusBase", {
+        "pwi4": StatusSubsection(PWI4VersionStatus),
+        "response": StatusSubsection(ResponseStatus),
+        "site": StatusSubsection(SiteStatus),
+        "mount": StatusSubsection(MountStatus),
+        "focuser": StatusSubsection(FocuserStatus),
+        "rotator": StatusSubsection(RotatorStatus),
+        "m3": StatusSubsection(M3Status),
+        "autofocus": StatusSubsection(AutofocusStatus),
+    })):
+    """
+    Wraps the status response for many PWI4 commands in a class with named members.
+
+    Sections and fields are converted from the raw response only when they are
+    first accessed, so a loop that reads a handful of fields does not pay for
+    parsing all of them. The raw entries remain available as status.raw.
+    Only the keys that every response must have are checked right away.
+    """
+
+    __slots__ = ()
+
+    # read with _get_required_string, a KeyError here points at the request that returned the response
+    REQUIRED_KEYS = ("pwi4.version",)
+
+    def __init__(self, raw):
+        for key in self.REQUIRED_KEYS:
+            if key not in raw:
+                raise KeyError(key)
+        super(PWI4Status, self).__init__(raw)
 
     def __repr__(self):
         """
@@ -606,14 +765,24 @@ class PWI4Status:
 class PWI4HttpCommunicator:
     """
     Manages communication with PWI4 via HTTP.
+
+    Connections are kept open (HTTP/1.1 keep-alive) and reused for later
+    requests, instead of opening a new TCP connection for every command.
+    Up to pool_size idle connections are kept, so several threads can issue
+    requests at the same time. A pooled connection that was closed by the
+    server in the meantime is replaced transparently.
     """
 
-    def __init__(self, host="localhost", port=8220):
+    def __init__(self, host="localhost", port=8220, pool_size=4):
         self.host = host
         self.port = port
 
         self.timeout_seconds = 3
 
+        self.pool_size = pool_size
+        self._pool = []
+        self._pool_lock = threading.Lock()
+
     def make_url(self, path, **kwargs):
         """
         Utility function that takes a set of keyword=value arguments
@@ -624,8 +793,18 @@ class PWI4HttpCommunicator:
           make_url("/mount/gotoradec2000", ra=10.123, dec="15 30 45") -> "http://localhost:8220/mount/gotoradec2000?ra=10.123&dec=15%2030%2045"
         """
 
-        # Construct the basic URL, excluding the keyword parameters; for example: "http://localhost:8220/specified/path?"
-        url = "http://" + self.host + ":" + str(self.port) + path + "?"
+        return "http://" + self.host + ":" + str(self.port) + self.make_path(path, **kwargs)
+
+    def make_path(self, path, **kwargs):
+        """
+        Like make_url(), but without the scheme, host and port.
+
+        Example:
+          make_path("/mount/gotoradec2000", ra=10.123, dec="15 30 45") -> "/mount/gotoradec2000?ra=10.123&dec=15%2030%2045"
+        """
+
+        if not kwargs:
+            return path + "?"
 
         # For every keyword=value argument given to this function,
         # construct a string of the form "key1=val1&key2=val2".
@@ -636,9 +815,7 @@ class PWI4HttpCommunicator:
         # This will convert plus symbols to percent encoding for improved compatibility.
         urlparams = urlparams.replace("+", "%20")
 
-        # Build the final URL and return it.
-        url = url + urlparams
-        return url
+        return path + "?" + urlparams
 
     def request(self, path, postdata=None, **kwargs):
         """
@@ -659,42 +836,179 @@ class PWI4HttpCommunicator:
         if there was an error with the request.
         """
 
-        # Construct the URL that we will request
-        url = self.make_url(path, **kwargs)
+        return self.request_stream(path, lambda response: response.read(), postdata, **kwargs)
 
-        # Open a connection to the server, issue the request, and try to receive the response.
-        # The server will return an HTTP Status Code as part of the response.
-        # If the status code indicates an error, an HTTPError will be thrown.
-        try:
-            response = urlopen(url, data=postdata, timeout=self.timeout_seconds)
-        except HTTPError as e:
-            if e.code == 404:
-                error_message = "Command not found"
-            elif e.code == 400:
-                error_message = "Bad request"
-            elif e.code == 500:
-                error_message = "Internal server error (possibly a bug in PWI)"
-            else:
-                error_message = str(e)
+    def request_stream(self, path, consume, postdata=None, **kwargs):
+        """
+        Like request(), but instead of reading the response payload into
+        memory, call consume(response) with the HTTPResponse and return
+        its result. consume should read the whole body (e.g. in chunks
+        with response.read(n) or response.readinto(buffer)); if it does
+        not, the connection is closed instead of being reused.
+        """
 
+        # Construct the URL that we will request
+        url = self.make_path(path, **kwargs)
+
+        if postdata is None:
+            method = "GET"
+            headers = {}
+        else:
+            method = "POST"
+            headers = {"Content-Type": "application/x-www-form-urlencoded"}
+
+        # Issue the request on an idle connection from the pool, or a new one.
+        # If a reused connection turns out to have been closed by the server
+        # before it responded, retry once on a fresh connection. Nothing else
+        # is retried, commands like goto or take_image must not run twice.
+        for attempt in range(2):
+            connection, reused = self._acquire()
             try:
-                error_details = e.read()  # Try to read the payload of the response for error information
-                error_message = error_message + ": " + error_details
-            except:
-                pass # If that failed, we won't include any further details
-            
-            raise Exception(error_message) # TODO: Consider a custom exception here
-
-            
-        except Exception as e:
-            # This will often be a urllib2.URLError to indicate that a connection
-            # could not be made to the server, but we'll handle any exception here
+                connection.request(method, url, body=postdata, headers=headers)
+                response = connection.getresponse()
+            except CLOSED_BEFORE_RESPONSE:
+                connection.close()
+                if reused and attempt == 0:
+                    continue
+                raise
+            except BaseException:
+                connection.close()
+                raise
+            break
+
+        try:
+            # The server returns an HTTP Status Code as part of the response.
+            if response.status >= 400:
+                payload = response.read()
+                raise Exception(self.error_message(response.status, response.reason, payload)) # TODO: Consider a custom exception here
+
+            result = consume(response)
+        except BaseException:
+            connection.close()
             raise
 
-        payload = response.read()
-        return payload
+        if response.will_close or not response.isclosed():
+            # Closed by the server, or the body was not read completely
+            connection.close()
+        else:
+            self._release(connection)
+
+        return result
+
+    def error_message(self, status, reason, payload):
+        """
+        Describe an HTTP error status returned by PWI
+        """
+
+        if status == 404:
+            error_message = "Command not found"
+        elif status == 400:
+            error_message = "Bad request"
+        elif status == 500:
+            error_message = "Internal server error (possibly a bug in PWI)"
+        else:
+            error_message = "HTTP Error %d: %s" % (status, reason)
+
+        if payload:
+            # Include the payload of the response for error information
+            error_message = error_message + ": " + payload.decode("utf-8", "replace")
+
+        return error_message
+
+    def _acquire(self):
+        with self._pool_lock:
+            if self._pool:
+                return self._pool.pop(), True
+
+        connection = httplib.HTTPConnection(self.host, self.port, timeout=self.timeout_seconds)
+        connection.connect()
+        # Requests are small and latency-bound, so don't let Nagle's algorithm delay them
+        connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return connection, False
+
+    def _release(self, connection):
+        with self._pool_lock:
+            if len(self._pool) < self.pool_size:
+                self._pool.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        """
+        Close all idle connections
+        """
+
+        with self._pool_lock:
+            pool, self._pool = self._pool, []
+        for connection in pool:
+            connection.close()
 
     
+def copy_response(response, write, chunk_size=1024*1024):
+    """
+    Pass the body of an HTTPResponse to write() in chunks of up to
+    chunk_size bytes and return the total size. The chunks are views of
+    one reused buffer, so write() must not keep them.
+    """
+
+    total = 0
+    if hasattr(response, "readinto"):
+        buffer = bytearray(chunk_size)
+        view = memoryview(buffer)
+        while True:
+            n = response.readinto(view)
+            if not n:
+                break
+            write(view[:n])
+            total += n
+    else:
+        # Python 2
+        while True:
+            chunk = response.read(chunk_size)
+            if not chunk:
+                break
+            write(chunk)
+            total += len(chunk)
+    return total
+
+def replace_file(src, dst):
+    """
+    Rename src to dst, replacing dst if it exists
+    """
+
+    try:
+        os.replace(src, dst)
+    except AttributeError:
+        # Python 2, where rename doesn't replace files on Windows
+        if os.path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
+
+def read_response_into(response, buffer):
+    """
+    Read the body of an HTTPResponse into the writable buffer and return its size
+    """
+
+    view = memoryview(buffer)
+    if view.ndim != 1 or view.itemsize != 1:
+        view = view.cast("B")
+
+    if response.length is not None and response.length > len(view):
+        raise ValueError("Response of %d bytes does not fit into a buffer of %d bytes" % (response.length, len(view)))
+
+    total = 0
+    while True:
+        if total == len(view):
+            # Only allowed if the body ends here
+            if response.read(1):
+                raise ValueError("Response does not fit into a buffer of %d bytes" % len(view))
+            break
+        n = response.readinto(view[total:])
+        if not n:
+            break
+        total += n
+    return total
+
 def list_to_comma_separated_string(value_list):
     """
     Convert list of values (e.g. [3, 1, 5]) into a comma-separated string (e.g. "3,1,5")
@@ -0,0 +1,283 @@
+"""
+Shared background polling of PWI4 status.
+
+A StatusMonitor polls PWI4.status() at one fixed rate on its own thread and
+publishes the latest PWI4Status, so several consumers in one process (the
+tracking loop, console output, a mosaic sequencer, ...) share one stream of
+status requests instead of each polling PWI4 themselves.
+
+    monitor = StatusMonitor(pwi4, interval=0.2)
+    monitor.start()
+
+    pwi4.mount_goto_ra_dec_j2000(ra, dec)
+    s = monitor.wait_until_not_slewing(timeout=120)
+"""
+
+import math
+import threading
+import time
+
+import instrument
+
+
+class StatusMonitor:
+    """
+    Polls PWI4 status every interval seconds on a background thread.
+
+    latest is the most recent PWI4Status. Published snapshots are never
+    modified by the monitor, so they can be read from any thread; each poll
+    produces a new object. Callbacks registered with subscribe() are called
+    on the polling thread with every new snapshot; their exceptions are
+    counted in callback_error_count and don't stop the polling.
+
+    Waits raise once max_consecutive_errors polls in a row have failed,
+    instead of waiting for a PWI4 that doesn't answer.
+    """
+
+    def __init__(self, pwi4, interval=0.1, max_consecutive_errors=5):
+        self.pwi4 = pwi4
+        self.interval = interval
+        self.max_consecutive_errors = max_consecutive_errors
+
+        self.latest = None
+        self.latest_time = None  # time.time() at which the latest status was requested
+        self.poll_count = 0
+        self.error_count = 0
+        self.consecutive_errors = 0
+        self.last_error = None
+        self.callback_error_count = 0
+        self.last_callback_error = None
+
+        self._subscribers = []
+        self._condition = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="StatusMonitor", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def subscribe(self, callback):
+        """
+        Call callback(status) with every new status snapshot
+        """
+
+        with self._condition:
+            self._subscribers = self._subscribers + [callback]
+
+    def unsubscribe(self, callback):
+        with self._condition:
+            self._subscribers = [s for s in self._subscribers if s is not callback]
+
+    def _run(self):
+        try:
+            self._poll()
+        finally:
+            # wake up waiters, so they notice that the thread is gone
+            with self._condition:
+                self._condition.notify_all()
+
+    def _poll(self):
+        next_poll = time.monotonic()
+        while not self._stop.is_set():
+            requested = time.time()
+            try:
+                with instrument.span("status"):
+                    status = self.pwi4.status()
+            except Exception as e:
+                with self._condition:
+                    self.error_count += 1
+                    self.consecutive_errors += 1
+                    self.last_error = e
+                    self._condition.notify_all()
+            else:
+                with self._condition:
+                    self.latest = status
+                    self.latest_time = requested
+                    self.poll_count += 1
+                    self.consecutive_errors = 0
+                    subscribers = self._subscribers
+                    self._condition.notify_all()
+
+                for callback in subscribers:
+                    try:
+                        callback(status)
+                    except Exception as e:
+                        self.callback_error_count += 1
+                        self.last_callback_error = e
+
+            # Keep a fixed rate; if a poll took too long, don't try to catch up
+            next_poll = max(next_poll + self.interval, time.monotonic())
+            self._stop.wait(next_poll - time.monotonic())
+
+    ### Waiting for conditions #################################
+
+    def wait_for(self, predicate, timeout=None, after=None, on_update=None):
+        """
+        Block until a status snapshot satisfies predicate(status) and return it.
+
+        Only snapshots requested after the time "after" (time.time(), default:
+        now) are considered, so a snapshot from before a command was issued
+        cannot end the wait. on_update(status) is called for every snapshot
+        received while waiting. Raises TimeoutError after timeout seconds,
+        and RuntimeError if the monitor stops or the last
+        max_consecutive_errors polls failed.
+        """
+
+        if after is None:
+            after = time.time()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        seen = None
+
+        with self._condition:
+            while True:
+                status = self.latest
+                if status is not None and self.latest_time >= after and status is not seen:
+                    seen = status
+                    if on_update is not None:
+                        on_update(status)
+                    if predicate(status):
+                        return status
+
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError("Timed out waiting for PWI4 status condition")
+                thread = self._thread
+                if thread is None or not thread.is_alive():
+                    raise RuntimeError("StatusMonitor is not running")
+                if self.consecutive_errors >= self.max_consecutive_errors:
+                    raise RuntimeError("PWI4 status failed %d times in a row" % self.consecutive_errors) from self.last_error
+                self._condition.wait(remaining)
+
+    def wait_for_update(self, timeout=None):
+        """
+        Return the next snapshot requested after this call
+        """
+
+        return self.wait_for(lambda s: True, timeout)
+
+    def wait_until_not_slewing(self, timeout=None, after=None, on_update=None):
+        return self.wait_for(lambda s: not s.mount.is_slewing, timeout, after, on_update)
+
+    def wait_until_dist_to_target(self, arcsec, timeout=None, after=None, on_update=None):
+        """
+        Wait until both mount axes are within arcsec of their target
+        """
+
+        def near_target(s):
+            return abs(s.mount.axis0.dist_to_target_arcsec) < arcsec and abs(s.mount.axis1.dist_to_target_arcsec) < arcsec
+
+        return self.wait_for(near_target, timeout, after, on_update)
+
+
+### Adaptive settle detection ##############################
+
+class SettleResult:
+    def __init__(self, status, seconds, polls, saved_seconds):
+        self.status = status
+        self.seconds = seconds  # from the call until the mount was found settled
+        self.polls = polls
+        self.saved_seconds = saved_seconds  # estimated, compared to fixed-interval polling of is_slewing
+
+
+def time_to_arrival(status):
+    """
+    Estimated seconds until both axes reach their target at their current velocity,
+    None if an axis that is off target is not moving or PWI4 doesn't report its velocity (before 4.0.13)
+    """
+
+    eta = 0.0
+    for axis in (status.mount.axis0, status.mount.axis1):
+        dist = abs(axis.dist_to_target_arcsec)
+        if dist == 0:
+            continue
+        if axis.measured_velocity_degs_per_sec is None:
+            return None
+        speed = abs(axis.measured_velocity_degs_per_sec) * 3600
+        if speed < 1e-3:
+            return None
+        eta = max(eta, dist / speed)
+    return eta
+
+
+def wait_until_settled(pwi4, tolerance_arcsec=1.0, jitter_arcsec=0.5, stable_samples=3,
+                       min_interval=0.02, max_interval=0.5, timeout=None, on_update=None,
+                       baseline_interval=0.2, min_seconds=0.2, verbose=True):
+    """
+    Wait after a goto until both axes are on target, and return a SettleResult.
+
+    Instead of polling at a fixed rate, the time to arrival is estimated
+    from dist_to_target_arcsec and measured_velocity_degs_per_sec, and the
+    next poll is scheduled after half of it (within min_interval and
+    max_interval): rarely while far away, densely near the end. The mount
+    counts as settled once the last stable_samples polls all had both axes
+    within tolerance_arcsec of the target, varying by less than jitter_arcsec,
+    and the mount not slewing. Right after a goto PWI4 can still report the
+    previous target, so samples only count once the mount was seen slewing
+    or min_seconds have passed. Raises TimeoutError after timeout seconds.
+
+    The time saved compared to sleeping baseline_interval and then polling
+    is_slewing every baseline_interval (as mosaic.py used to) is estimated
+    and printed if verbose.
+    """
+
+    start = time.monotonic()
+    deadline = None if timeout is None else start + timeout
+    recent = []
+    polls = 0
+    seen_slewing = False
+
+    while True:
+        with instrument.span("settle_poll"):
+            status = pwi4.status()
+        polls += 1
+        if on_update is not None:
+            on_update(status)
+
+        dist = (status.mount.axis0.dist_to_target_arcsec, status.mount.axis1.dist_to_target_arcsec)
+        seen_slewing = seen_slewing or status.mount.is_slewing
+        started = seen_slewing or time.monotonic() - start >= min_seconds
+        # a slewing mount can pass through the tolerance, e.g. when overshooting
+        if started and not status.mount.is_slewing and max(abs(d) for d in dist) < tolerance_arcsec:
+            recent = (recent + [dist])[-stable_samples:]
+        else:
+            recent = []
+
+        if len(recent) == stable_samples and all(
+                max(d[axis] for d in recent) - min(d[axis] for d in recent) < jitter_arcsec for axis in (0, 1)):
+            break
+
+        now = time.monotonic()
+        if deadline is not None and now >= deadline:
+            raise TimeoutError("Timed out waiting for the mount to settle")
+
+        if recent:
+            interval = min_interval
+        else:
+            eta = time_to_arrival(status)
+            interval = max_interval if eta is None else min(max_interval, max(min_interval, eta / 2))
+        if deadline is not None:
+            interval = min(interval, deadline - now)
+        time.sleep(interval)
+
+    seconds = time.monotonic() - start
+    # fixed-interval polling would have noticed at the next multiple of baseline_interval, after the initial sleep
+    baseline = baseline_interval * max(1, math.ceil(seconds / baseline_interval))
+    saved = baseline - seconds
+    if verbose:
+        print("Settled in %.2fs after %d polls, about %.2fs sooner than polling every %.1fs" % (seconds, polls, saved, baseline_interval))
+    return SettleResult(status, seconds, polls, saved)
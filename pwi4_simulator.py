@@ -0,0 +1,838 @@
+"""
+Stand-in for the PWI4 HTTP API, for load testing and development without hardware.
+
+Implements the endpoints wrapped by pwi4_client.PWI4 and answers with the
+full set of status keywords parsed by PWI4Status. The mount is modelled as an
+equatorial mount (axis0 = hour angle, axis1 = declination) whose axes move
+towards their target under velocity and acceleration limits, and it follows
+RA/Dec targets, offsets and uploaded radecpath/custom_path tracks.
+
+Latency and errors can be injected to test how clients cope with a slow or
+misbehaving server:
+
+    python pwi4_simulator.py --port 8220 --latency 0.002 --error-rate 0.01
+
+From Python (e.g. in benchmarks), start_simulator() runs one on a background
+thread:
+
+    server = start_simulator(port=0)
+    pwi4 = PWI4(*server.server_address)
+"""
+
+import argparse
+import math
+import random
+import struct
+import threading
+import time
+from datetime import datetime, timezone
+from functools import lru_cache
+
+try:
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import urlsplit, parse_qsl
+except ImportError:
+    raise SystemExit("The PWI4 simulator needs Python 3.7 or newer")
+
+from pwi4_client import PWI4Status
+
+JD_UNIX_EPOCH = 2440587.5
+
+VERSION = "4.0.99.15"
+
+
+def now_jd(t=None):
+    return (time.time() if t is None else t) / 86400.0 + JD_UNIX_EPOCH
+
+
+def lmst_hours(jd, longitude_degs):
+    gmst = 18.697374558 + 24.06570982441908 * (jd - 2451545.0)
+    return (gmst + longitude_degs / 15.0) % 24.0
+
+
+def wrap180(degs):
+    return (degs + 180.0) % 360.0 - 180.0
+
+
+def radec_to_altaz(ha_degs, dec_degs, latitude_degs):
+    ha, dec, lat = math.radians(ha_degs), math.radians(dec_degs), math.radians(latitude_degs)
+    alt = math.asin(math.sin(lat) * math.sin(dec) + math.cos(lat) * math.cos(dec) * math.cos(ha))
+    az = math.atan2(-math.sin(ha) * math.cos(dec), math.sin(dec) * math.cos(lat) - math.cos(dec) * math.sin(lat) * math.cos(ha))
+    return math.degrees(alt), math.degrees(az) % 360.0
+
+
+def altaz_to_hadec(alt_degs, az_degs, latitude_degs):
+    alt, az, lat = math.radians(alt_degs), math.radians(az_degs), math.radians(latitude_degs)
+    dec = math.asin(math.sin(lat) * math.sin(alt) + math.cos(lat) * math.cos(alt) * math.cos(az))
+    ha = math.atan2(-math.sin(az) * math.cos(alt), math.cos(lat) * math.sin(alt) - math.sin(lat) * math.cos(alt) * math.cos(az))
+    return math.degrees(ha), math.degrees(dec)
+
+
+def spiral_position(index):
+    """
+    (x, y) grid position of step index on a square spiral around (0, 0)
+    """
+
+    x = y = 0
+    dx, dy = 1, 0
+    leg, step, steps_in_leg = 1, 0, 0
+    for i in range(index):
+        x, y = x + dx, y + dy
+        steps_in_leg += 1
+        if steps_in_leg == leg:
+            steps_in_leg = 0
+            dx, dy = -dy, dx
+            step += 1
+            if step % 2 == 0:
+                leg += 1
+    return x, y
+
+
+class CommandError(Exception):
+    def __init__(self, code, message):
+        Exception.__init__(self, message)
+        self.code = code
+
+
+class SimulatedAxis:
+    """
+    One mount axis that follows a moving target with limited velocity and acceleration
+    """
+
+    def __init__(self, position_degs, max_velocity_degs_per_sec, acceleration_degs_per_sec_sqr, wrap=False):
+        self.position_degs = position_degs
+        self.velocity_degs_per_sec = 0.0
+        self.setpoint_velocity_degs_per_sec = 0.0
+        self.max_velocity_degs_per_sec = max_velocity_degs_per_sec
+        self.acceleration_degs_per_sec_sqr = acceleration_degs_per_sec_sqr
+        self.wrap = wrap
+        self.is_enabled = True
+        self.target_degs = position_degs
+        self.target_velocity_degs_per_sec = 0.0
+        self.rms_error_arcsec = 0.0
+
+    def error_degs(self):
+        error = self.target_degs - self.position_degs
+        return wrap180(error) if self.wrap else error
+
+    def step(self, dt):
+        if not self.is_enabled:
+            self.velocity_degs_per_sec = self.setpoint_velocity_degs_per_sec = 0.0
+            return
+
+        error = self.error_degs()
+        a = self.acceleration_degs_per_sec_sqr
+        vmax = self.max_velocity_degs_per_sec
+
+        # Fastest velocity from which we can still stop at the target, on top of the target's own motion
+        approach = math.copysign(min(vmax, math.sqrt(2 * a * abs(error))), error)
+        # Near the target, close the remaining error within one step instead of oscillating around it
+        if abs(error) < a * dt * dt:
+            approach = error / dt
+        desired = max(-vmax, min(vmax, self.target_velocity_degs_per_sec + approach))
+
+        dv = max(-a * dt, min(a * dt, desired - self.velocity_degs_per_sec))
+        self.setpoint_velocity_degs_per_sec = desired
+        self.velocity_degs_per_sec += dv
+        self.position_degs += self.velocity_degs_per_sec * dt
+        if self.wrap:
+            self.position_degs = wrap180(self.position_degs)
+
+        self.rms_error_arcsec = 0.9 * self.rms_error_arcsec + 0.1 * abs(self.error_degs()) * 3600
+
+
+class SimulatedMover:
+    """
+    Focuser/rotator style device moving towards a target position at a constant rate
+    """
+
+    def __init__(self, position, rate):
+        self.position = position
+        self.target = position
+        self.rate = rate
+        self.is_connected = True
+        self.is_enabled = True
+
+    def step(self, dt):
+        if self.is_enabled:
+            delta = self.target - self.position
+            self.position += max(-self.rate * dt, min(self.rate * dt, delta))
+
+    @property
+    def is_moving(self):
+        return abs(self.target - self.position) > 1e-6
+
+
+class SimulatedPWI4:
+    """
+    State and dynamics of the simulated telescope. All methods are called
+    with the lock held by the request handler.
+    """
+
+    STEP_SECONDS = 0.005
+    SLEWING_THRESHOLD_ARCSEC = 1.0
+
+    def __init__(self, latitude_degs=-30.52630901637761, longitude_degs=-70.85329602458852, height_meters=1710,
+                 max_velocity_degs_per_sec=10.0, acceleration_degs_per_sec_sqr=5.0,
+                 image_width=256, image_height=256):
+        self.lock = threading.Lock()
+
+        self.latitude_degs = latitude_degs
+        self.longitude_degs = longitude_degs
+        self.height_meters = height_meters
+
+        self.mount_connected = False
+        self.is_tracking = False
+        self.slew_time_constant = 0.5
+        self.axis0_wrap_range_min_degs = -180.0
+        self.axes = [
+            SimulatedAxis(0.0, max_velocity_degs_per_sec, acceleration_degs_per_sec_sqr, wrap=True),
+            SimulatedAxis(latitude_degs, max_velocity_degs_per_sec, acceleration_degs_per_sec_sqr),
+        ]
+
+        # Target: ("axes", axis0, axis1), ("radec", ra_hours, dec_degs), ("altaz", alt, az) or ("path", points)
+        self.target = ("axes", 0.0, latitude_degs)
+        self.park_axes = (0.0, latitude_degs)
+
+        self.offsets = dict((name, {"total": 0.0, "rate": 0.0, "since": time.time()}) for name in
+                            ["ra_arcsec", "dec_arcsec", "axis0_arcsec", "axis1_arcsec", "path_arcsec", "transverse_arcsec"])
+        self.spiral = (0.0, 0.0, 0)
+
+        self.radecpath = []
+        self.custom_path = []
+        self.custom_path_type = "radec"
+
+        self.model_points = []
+        self.model_filename = ""
+
+        self.focuser = SimulatedMover(10000.0, 1000.0)
+        self.rotator = SimulatedMover(0.0, 5.0)
+        self.m3_port = 1
+
+        self.image_width = image_width
+        self.image_height = image_height
+
+        self.last_update = time.time()
+
+    ### Dynamics ###########################################
+
+    def offset_arcsec(self, name, t):
+        offset = self.offsets[name]
+        return offset["total"] + offset["rate"] * (t - offset["since"])
+
+    def target_axes(self, t):
+        """
+        Target positions of both axes at time t (in seconds since the epoch)
+        """
+
+        jd = now_jd(t)
+        kind = self.target[0]
+
+        if kind == "axes":
+            axis0, axis1 = self.target[1], self.target[2]
+        else:
+            if kind == "radec":
+                ra_hours, dec_degs = self.target[1], self.target[2]
+            elif kind == "path":
+                ra_hours, dec_degs = self.path_position(self.target[1], jd)
+            else:
+                ha, dec_degs = altaz_to_hadec(self.target[1], self.target[2], self.latitude_degs)
+                ra_hours = lmst_hours(jd, self.longitude_degs) - ha / 15.0
+
+            ra_hours += self.offset_arcsec("ra_arcsec", t) / 3600.0 / 15.0 / max(math.cos(math.radians(dec_degs)), 1e-6)
+            dec_degs += self.offset_arcsec("dec_arcsec", t) / 3600.0
+            axis0 = (lmst_hours(jd, self.longitude_degs) - ra_hours) * 15.0
+            axis1 = dec_degs
+
+        axis0 += self.offset_arcsec("axis0_arcsec", t) / 3600.0
+        axis1 += self.offset_arcsec("axis1_arcsec", t) / 3600.0
+        return wrap180(axis0), axis1
+
+    def path_position(self, points, jd):
+        if jd <= points[0][0]:
+            return points[0][1], points[0][2]
+        if jd >= points[-1][0]:
+            return points[-1][1], points[-1][2]
+        lo, hi = 0, len(points) - 1
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if points[mid][0] <= jd:
+                lo = mid
+            else:
+                hi = mid
+        (jd0, ra0, dec0), (jd1, ra1, dec1) = points[lo], points[hi]
+        p = (jd - jd0) / (jd1 - jd0)
+        dra = (ra1 - ra0 + 12.0) % 24.0 - 12.0
+        return (ra0 + dra * p) % 24.0, dec0 + (dec1 - dec0) * p
+
+    def update(self):
+        """
+        Advance the simulation to the current time
+        """
+
+        now = time.time()
+        elapsed = now - self.last_update
+        if elapsed <= 0:
+            return
+        # After a long idle period, don't simulate more than a minute step by step
+        t = max(self.last_update, now - 60.0)
+        if t > self.last_update:
+            for axis, target in zip(self.axes, self.target_axes(t)):
+                axis.position_degs = target
+
+        steps = max(1, int(math.ceil((now - t) / self.STEP_SECONDS)))
+        dt = (now - t) / steps
+        for i in range(steps):
+            t += dt
+            if self.mount_connected:
+                target = self.target_axes(t)
+                ahead = self.target_axes(t + 0.1)
+                for axis, p, p_ahead in zip(self.axes, target, ahead):
+                    axis.target_degs = p
+                    axis.target_velocity_degs_per_sec = (wrap180(p_ahead - p) if axis.wrap else p_ahead - p) / 0.1
+                    axis.step(dt)
+            self.focuser.step(dt)
+            self.rotator.step(dt)
+
+        self.last_update = now
+
+    def is_slewing(self):
+        return self.mount_connected and any(abs(axis.error_degs()) * 3600 > self.SLEWING_THRESHOLD_ARCSEC for axis in self.axes)
+
+    def hold_position(self):
+        self.target = ("axes", self.axes[0].position_degs, self.axes[1].position_degs)
+        self.is_tracking = False
+
+    ### Status #############################################
+
+    def status(self):
+        jd = now_jd()
+        lmst = lmst_hours(jd, self.longitude_degs)
+        axis0, axis1 = self.axes
+        ra_hours = (lmst - axis0.position_degs / 15.0) % 24.0
+        dec_degs = axis1.position_degs
+        alt, az = radec_to_altaz(axis0.position_degs, dec_degs, self.latitude_degs)
+        target0, target1 = self.target_axes(time.time())
+        timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S.%f")[:-2]
+
+        values = {
+            "pwi4.version": VERSION,
+            "response.timestamp_utc": timestamp,
+            "site.latitude_degs": self.latitude_degs,
+            "site.longitude_degs": self.longitude_degs,
+            "site.height_meters": self.height_meters,
+            "site.lmst_hours": lmst,
+            "mount.is_connected": self.mount_connected,
+            "mount.geometry": 0,
+            "mount.timestamp_utc": timestamp,
+            "mount.julian_date": jd,
+            "mount.slew_time_constant": self.slew_time_constant,
+            "mount.ra_apparent_hours": ra_hours,
+            "mount.dec_apparent_degs": dec_degs,
+            "mount.ra_j2000_hours": ra_hours,
+            "mount.dec_j2000_degs": dec_degs,
+            "mount.target_ra_apparent_hours": (lmst - target0 / 15.0) % 24.0,
+            "mount.target_dec_apparent_degs": target1,
+            "mount.azimuth_degs": az,
+            "mount.altitude_degs": alt,
+            "mount.is_slewing": self.is_slewing(),
+            "mount.is_tracking": self.is_tracking,
+            "mount.axis0_wrap_range_min_degs": self.axis0_wrap_range_min_degs,
+            "mount.model.filename": self.model_filename,
+            "mount.model.num_points_total": len(self.model_points),
+            "mount.model.num_points_enabled": sum(1 for p in self.model_points if p["enabled"]),
+            "mount.model.rms_error_arcsec": 0.0,
+            "focuser.exists": True,
+            "focuser.is_connected": self.focuser.is_connected,
+            "focuser.is_enabled": self.focuser.is_enabled,
+            "focuser.position": self.focuser.position,
+            "focuser.is_moving": self.focuser.is_moving,
+            "rotator.exists": True,
+            "rotator.is_connected": self.rotator.is_connected,
+            "rotator.is_enabled": self.rotator.is_enabled,
+            "rotator.mech_position_degs": self.rotator.position,
+            "rotator.field_angle_degs": self.rotator.position,
+            "rotator.is_moving": self.rotator.is_moving,
+            "rotator.is_slewing": self.rotator.is_moving,
+            "m3.exists": True,
+            "m3.port": self.m3_port,
+            "autofocus.is_running": False,
+            "autofocus.success": False,
+        }
+        for i in range(4):
+            values["pwi4.version_field[%d]" % i] = VERSION.split(".")[i]
+
+        for index, axis in enumerate(self.axes):
+            prefix = "mount.axis%d." % index
+            values.update({
+                prefix + "is_enabled": axis.is_enabled,
+                prefix + "rms_error_arcsec": axis.rms_error_arcsec,
+                prefix + "dist_to_target_arcsec": axis.error_degs() * 3600,
+                prefix + "servo_error_arcsec": (axis.setpoint_velocity_degs_per_sec - axis.velocity_degs_per_sec) * self.STEP_SECONDS * 3600,
+                prefix + "min_mech_position_degs": -180.0 if index == 0 else -90.0,
+                prefix + "max_mech_position_degs": 180.0 if index == 0 else 90.0,
+                prefix + "target_mech_position_degs": (target0, target1)[index],
+                prefix + "position_degs": axis.position_degs,
+                prefix + "position_timestamp": timestamp,
+                prefix + "max_velocity_degs_per_sec": axis.max_velocity_degs_per_sec,
+                prefix + "setpoint_velocity_degs_per_sec": axis.setpoint_velocity_degs_per_sec,
+                prefix + "measured_velocity_degs_per_sec": axis.velocity_degs_per_sec,
+                prefix + "acceleration_degs_per_sec_sqr": axis.acceleration_degs_per_sec_sqr,
+                prefix + "measured_current_amps": 0.2 + 0.5 * abs(axis.velocity_degs_per_sec) / axis.max_velocity_degs_per_sec,
+            })
+
+        t = time.time()
+        for name, offset in self.offsets.items():
+            prefix = "mount.offsets.%s." % name
+            values[prefix + "total"] = self.offset_arcsec(name, t)
+            values[prefix + "rate"] = offset["rate"]
+            values[prefix + "gradual_offset_progress"] = 0.0
+
+        lines = []
+        for key in STATUS_KEYS:
+            value = values.get(key, 0)
+            if isinstance(value, bool):
+                value = "true" if value else "false"
+            elif isinstance(value, float):
+                value = repr(value)
+            lines.append("%s=%s" % (key, value))
+        return "\n".join(lines).encode("utf-8")
+
+    ### Commands ###########################################
+
+    def require_mount(self):
+        if not self.mount_connected:
+            raise CommandError(409, "Mount is not connected")
+
+    def set_offset(self, name, **kwargs):
+        t = time.time()
+        offset = self.offsets[name]
+        # Fold the accumulated rate into the total before changing anything
+        offset["total"] = self.offset_arcsec(name, t)
+        offset["since"] = t
+        for option, value in kwargs.items():
+            if option == "reset":
+                offset["total"] = offset["rate"] = 0.0
+            elif option in ("stop_rate", "stop"):
+                offset["rate"] = 0.0
+            elif option == "add_arcsec":
+                offset["total"] += float(value)
+            elif option == "set_rate_arcsec_per_sec":
+                offset["rate"] = float(value)
+            elif option == "set_total_arcsec":
+                offset["total"] = float(value)
+            elif option in ("add_gradual_offset_arcsec",):
+                # Applied immediately; gradual offsets are not modelled
+                offset["total"] += float(value)
+            elif option in ("stop_gradual_offset", "gradual_offset_rate", "gradual_offset_seconds"):
+                pass
+            else:
+                raise CommandError(400, "Unknown offset option: " + option)
+
+
+def _float(params, name):
+    try:
+        return float(params[name])
+    except KeyError:
+        raise CommandError(400, "Missing parameter: " + name)
+    except ValueError:
+        raise CommandError(400, "Invalid value for parameter: " + name)
+
+
+def _indexes(params):
+    if "index" not in params:
+        raise CommandError(400, "Missing parameter: index")
+    return [int(i) for i in params["index"].split(",") if i != ""]
+
+
+def _parse_points(body):
+    data = dict(parse_qsl(body.decode("utf-8"))).get("data", "")
+    points = []
+    for line in data.splitlines():
+        if line.strip():
+            jd, c0, c1 = line.split(",")
+            points.append((float(jd), float(c0), float(c1)))
+    return points
+
+
+### Command handlers: (sim, params, body) -> None for a status response, or bytes
+
+def _connect(sim, params, body):
+    sim.mount_connected = True
+    sim.hold_position()
+
+def _disconnect(sim, params, body):
+    sim.mount_connected = False
+
+def _enable(sim, params, body):
+    for i in ([0, 1] if params.get("axis", "-1") == "-1" else [int(params["axis"])]):
+        sim.axes[i].is_enabled = True
+
+def _disable(sim, params, body):
+    for i in ([0, 1] if params.get("axis", "-1") == "-1" else [int(params["axis"])]):
+        sim.axes[i].is_enabled = False
+
+def _set_slew_time_constant(sim, params, body):
+    sim.slew_time_constant = _float(params, "value")
+
+def _set_axis0_wrap_range_min(sim, params, body):
+    sim.axis0_wrap_range_min_degs = _float(params, "degs")
+
+def _find_home(sim, params, body):
+    sim.require_mount()
+    sim.target = ("axes", 0.0, sim.latitude_degs)
+    sim.is_tracking = False
+
+def _stop(sim, params, body):
+    sim.hold_position()
+
+def _goto_ra_dec(sim, params, body):
+    sim.require_mount()
+    sim.target = ("radec", _float(params, "ra_hours"), _float(params, "dec_degs"))
+    sim.is_tracking = True
+
+def _goto_alt_az(sim, params, body):
+    sim.require_mount()
+    sim.target = ("altaz", _float(params, "alt_degs"), _float(params, "az_degs"))
+    sim.is_tracking = False
+
+def _goto_coord_pair(sim, params, body):
+    sim.require_mount()
+    c0, c1 = _float(params, "c0"), _float(params, "c1")
+    kind = params.get("type", "")
+    if kind == "altaz":
+        sim.target = ("altaz", c1, c0)
+    elif kind == "raw":
+        sim.target = ("axes", c0, c1)
+    else:
+        raise CommandError(400, "Unknown coordinate type: " + kind)
+    sim.is_tracking = False
+
+def _offset(sim, params, body):
+    for key, value in params.items():
+        for name in sim.offsets:
+            axis = name[:-len("_arcsec")]
+            if key.startswith(axis + "_"):
+                sim.set_offset(name, **{key[len(axis) + 1:]: value})
+                break
+        else:
+            raise CommandError(400, "Unknown offset: " + key)
+
+def _spiral_offset(sim, index):
+    x_step, y_step, _ = sim.spiral
+    old_x, old_y = spiral_position(sim.spiral[2])
+    x, y = spiral_position(index)
+    sim.set_offset("ra_arcsec", add_arcsec=(x - old_x) * x_step)
+    sim.set_offset("dec_arcsec", add_arcsec=(y - old_y) * y_step)
+    sim.spiral = (x_step, y_step, index)
+
+def _spiral_offset_new(sim, params, body):
+    sim.spiral = (_float(params, "x_step_arcsec"), _float(params, "y_step_arcsec"), 0)
+
+def _spiral_offset_next(sim, params, body):
+    _spiral_offset(sim, sim.spiral[2] + 1)
+
+def _spiral_offset_previous(sim, params, body):
+    _spiral_offset(sim, max(0, sim.spiral[2] - 1))
+
+def _park(sim, params, body):
+    sim.require_mount()
+    sim.target = ("axes",) + sim.park_axes
+    sim.is_tracking = False
+
+def _set_park_here(sim, params, body):
+    sim.park_axes = (sim.axes[0].position_degs, sim.axes[1].position_degs)
+
+def _tracking_on(sim, params, body):
+    sim.require_mount()
+    if sim.target[0] == "axes":
+        jd = now_jd()
+        ra_hours = lmst_hours(jd, sim.longitude_degs) - sim.axes[0].position_degs / 15.0
+        sim.target = ("radec", ra_hours % 24.0, sim.axes[1].position_degs)
+    sim.is_tracking = True
+
+def _tracking_off(sim, params, body):
+    sim.hold_position()
+
+def _follow_tle(sim, params, body):
+    # Orbit propagation is not modelled; keep tracking the current position
+    _tracking_on(sim, params, body)
+
+def _radecpath_new(sim, params, body):
+    sim.radecpath = []
+
+def _radecpath_add_point(sim, params, body):
+    sim.radecpath.append((_float(params, "jd"), _float(params, "ra_j2000_hours"), _float(params, "dec_j2000_degs")))
+
+def _radecpath_apply(sim, params, body):
+    sim.require_mount()
+    if not sim.radecpath:
+        raise CommandError(400, "Path is empty")
+    sim.target = ("path", sorted(sim.radecpath))
+    sim.is_tracking = True
+
+def _custom_path_new(sim, params, body):
+    sim.custom_path = []
+    sim.custom_path_type = params.get("type", "radec")
+
+def _custom_path_add_point_list(sim, params, body):
+    sim.custom_path.extend(_parse_points(body or b""))
+    return b"OK"
+
+def _custom_path_apply(sim, params, body):
+    sim.require_mount()
+    if not sim.custom_path:
+        raise CommandError(400, "Path is empty")
+    if sim.custom_path_type != "radec":
+        raise CommandError(400, "Only radec custom paths are simulated")
+    sim.target = ("path", sorted(sim.custom_path))
+    sim.is_tracking = True
+
+def _model_add_point(sim, params, body):
+    sim.model_points.append({"ra": _float(params, "ra_j2000_hours"), "dec": _float(params, "dec_j2000_degs"), "enabled": True})
+
+def _model_delete_point(sim, params, body):
+    indexes = set(_indexes(params))
+    sim.model_points = [p for i, p in enumerate(sim.model_points) if i not in indexes]
+
+def _model_set_enabled(enabled):
+    def handler(sim, params, body):
+        for i in _indexes(params):
+            if 0 <= i < len(sim.model_points):
+                sim.model_points[i]["enabled"] = enabled
+    return handler
+
+def _model_clear_points(sim, params, body):
+    sim.model_points = []
+
+def _model_save(sim, params, body):
+    sim.model_filename = params.get("filename", sim.model_filename)
+
+def _noop(sim, params, body):
+    pass
+
+def _set(device, attribute, value):
+    def handler(sim, params, body):
+        setattr(getattr(sim, device), attribute, value)
+    return handler
+
+def _focuser_goto(sim, params, body):
+    sim.focuser.target = _float(params, "target")
+
+def _rotator_goto(sim, params, body):
+    sim.rotator.target = _float(params, "degs")
+
+def _rotator_offset(sim, params, body):
+    sim.rotator.target += _float(params, "degs")
+
+def _device_stop(device):
+    def handler(sim, params, body):
+        mover = getattr(sim, device)
+        mover.target = mover.position
+    return handler
+
+def _m3_goto(sim, params, body):
+    sim.m3_port = int(_float(params, "port"))
+
+def _take_image(sim, params, body):
+    return fits_image(sim.image_width, sim.image_height)
+
+def _crash(sim, params, body):
+    raise RuntimeError("Intentional crash for testing")
+
+
+COMMANDS = {
+    "/status": _noop,
+    "/mount/connect": _connect,
+    "/mount/disconnect": _disconnect,
+    "/mount/enable": _enable,
+    "/mount/disable": _disable,
+    "/mount/set_slew_time_constant": _set_slew_time_constant,
+    "/mount/set_axis0_wrap_range_min": _set_axis0_wrap_range_min,
+    "/mount/find_home": _find_home,
+    "/mount/stop": _stop,
+    "/mount/goto_ra_dec_apparent": _goto_ra_dec,
+    "/mount/goto_ra_dec_j2000": _goto_ra_dec,
+    "/mount/goto_alt_az": _goto_alt_az,
+    "/mount/goto_coord_pair": _goto_coord_pair,
+    "/mount/offset": _offset,
+    "/mount/spiral_offset/new": _spiral_offset_new,
+    "/mount/spiral_offset/next": _spiral_offset_next,
+    "/mount/spiral_offset/previous": _spiral_offset_previous,
+    "/mount/park": _park,
+    "/mount/set_park_here": _set_park_here,
+    "/mount/tracking_on": _tracking_on,
+    "/mount/tracking_off": _tracking_off,
+    "/mount/follow_tle": _follow_tle,
+    "/mount/radecpath/new": _radecpath_new,
+    "/mount/radecpath/add_point": _radecpath_add_point,
+    "/mount/radecpath/apply": _radecpath_apply,
+    "/mount/custom_path/new": _custom_path_new,
+    "/mount/custom_path/add_point_list": _custom_path_add_point_list,
+    "/mount/custom_path/apply": _custom_path_apply,
+    "/mount/model/add_point": _model_add_point,
+    "/mount/model/delete_point": _model_delete_point,
+    "/mount/model/enable_point": _model_set_enabled(True),
+    "/mount/model/disable_point": _model_set_enabled(False),
+    "/mount/model/clear_points": _model_clear_points,
+    "/mount/model/save_as_default": _noop,
+    "/mount/model/save": _model_save,
+    "/mount/model/load": _model_save,
+    "/focuser/connect": _set("focuser", "is_connected", True),
+    "/focuser/disconnect": _set("focuser", "is_connected", False),
+    "/focuser/enable": _set("focuser", "is_enabled", True),
+    "/focuser/disable": _set("focuser", "is_enabled", False),
+    "/focuser/goto": _focuser_goto,
+    "/focuser/stop": _device_stop("focuser"),
+    "/rotator/connect": _set("rotator", "is_connected", True),
+    "/rotator/disconnect": _set("rotator", "is_connected", False),
+    "/rotator/enable": _set("rotator", "is_enabled", True),
+    "/rotator/disable": _set("rotator", "is_enabled", False),
+    "/rotator/goto_mech": _rotator_goto,
+    "/rotator/goto_field": _rotator_goto,
+    "/rotator/offset": _rotator_offset,
+    "/rotator/stop": _device_stop("rotator"),
+    "/m3/goto": _m3_goto,
+    "/m3/stop": _noop,
+    "/virtualcamera/take_image": _take_image,
+    "/internal/crash": _crash,
+}
+
+STATUS_KEYS = PWI4Status.status_keys()
+
+
+@lru_cache(maxsize=4)
+def fits_image(width, height):
+    """
+    A minimal FITS file with a 16-bit image of a few gaussian "stars" on a noisy background
+    """
+
+    cards = [
+        "SIMPLE  =                    T",
+        "BITPIX  =                   16",
+        "NAXIS   =                    2",
+        "NAXIS1  = %20d" % width,
+        "NAXIS2  = %20d" % height,
+        "BZERO   =                32768",
+        "END",
+    ]
+    header = "".join(card.ljust(80) for card in cards)
+    header = header.ljust(2880 * ((len(header) + 2879) // 2880)).encode("ascii")
+
+    rng = random.Random(width * 7919 + height)
+    pixels = [1000] * (width * height)
+    for i in range(max(1, width * height // 2000)):
+        cx, cy = rng.randrange(width), rng.randrange(height)
+        flux = rng.randrange(2000, 20000)
+        for y in range(max(0, cy - 3), min(height, cy + 4)):
+            for x in range(max(0, cx - 3), min(width, cx + 4)):
+                pixels[y * width + x] += int(flux * math.exp(-((x - cx) ** 2 + (y - cy) ** 2) / 2.0))
+    data = struct.pack(">%dh" % len(pixels), *[min(p, 65535) - 32768 for p in pixels])
+    data += b"\0" * (-len(data) % 2880)
+    return header + data
+
+
+class PWI4SimulatorHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        server = self.server
+        url = urlsplit(self.path)
+        params = dict(parse_qsl(url.query, keep_blank_values=True))
+
+        body = None
+        if "Content-Length" in self.headers:
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+
+        if server.latency_seconds or server.latency_jitter_seconds:
+            time.sleep(server.latency_seconds + random.random() * server.latency_jitter_seconds)
+
+        handler = COMMANDS.get(url.path)
+        if handler is None:
+            return self.respond(404, url.path.encode("utf-8"))
+        if server.error_rate and random.random() < server.error_rate:
+            return self.respond(500, b"Injected error")
+
+        sim = server.sim
+        try:
+            with sim.lock:
+                sim.update()
+                payload = handler(sim, params, body)
+                if payload is None:
+                    payload = sim.status()
+        except CommandError as e:
+            return self.respond(e.code, str(e).encode("utf-8"))
+        except Exception as e:
+            return self.respond(500, ("%s: %s" % (type(e).__name__, e)).encode("utf-8"))
+
+        content_type = "application/octet-stream" if url.path == "/virtualcamera/take_image" else "text/plain"
+        self.respond(200, payload, content_type)
+
+    do_POST = do_GET
+
+    def respond(self, code, payload, content_type="text/plain"):
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        try:
+            self.wfile.write(payload)
+        except (BrokenPipeError, ConnectionResetError):
+            # the client stopped reading, e.g. because the image didn't fit into its buffer
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class PWI4SimulatorServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, sim=None, latency_seconds=0.0, latency_jitter_seconds=0.0, error_rate=0.0, verbose=False):
+        ThreadingHTTPServer.__init__(self, address, PWI4SimulatorHandler)
+        self.sim = sim if sim is not None else SimulatedPWI4()
+        self.latency_seconds = latency_seconds
+        self.latency_jitter_seconds = latency_jitter_seconds
+        self.error_rate = error_rate
+        self.verbose = verbose
+
+
+def start_simulator(host="127.0.0.1", port=8220, **kwargs):
+    """
+    Run a simulator on a background thread and return the server.
+    Use port=0 to pick a free port; see server.server_address.
+    Call server.shutdown() to stop it.
+    """
+
+    server = PWI4SimulatorServer((host, port), **kwargs)
+    threading.Thread(target=server.serve_forever, name="PWI4Simulator", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated PWI4 HTTP server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8220)
+    parser.add_argument("--latency", type=float, default=0.0, help="added latency per request, in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random extra latency per request, up to this many seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with HTTP 500")
+    parser.add_argument("--max-velocity", type=float, default=10.0, help="axis max velocity in degs/sec")
+    parser.add_argument("--acceleration", type=float, default=5.0, help="axis acceleration in degs/sec^2")
+    parser.add_argument("--image-size", type=int, nargs=2, default=(256, 256), metavar=("WIDTH", "HEIGHT"))
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    args = parser.parse_args()
+
+    sim = SimulatedPWI4(max_velocity_degs_per_sec=args.max_velocity, acceleration_degs_per_sec_sqr=args.acceleration,
+                        image_width=args.image_size[0], image_height=args.image_size[1])
+    server = PWI4SimulatorServer((args.host, args.port), sim, args.latency, args.jitter, args.error_rate, args.verbose)
+    print("Simulated PWI4 listening on http://%s:%d" % server.server_address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
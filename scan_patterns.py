@@ -0,0 +1,311 @@
+"""
+Scan patterns for calibration drifts: straight lines at any position angle,
+boustrophedon rasters, Archimedean spirals and great-circle arcs.
+
+A pattern is a track of (east, north) offsets in arcsec from a center, as a
+function of the seconds since its start, computed for all times at once.
+It can be executed in two ways, both without any per-tick work on the host:
+
+- as a custom path uploaded to the mount, which follows it on its own
+- with mount_offset rates, one request per segment of constant rate
+
+    pattern = Raster(width_arcsec=600, height_arcsec=300, row_spacing_arcsec=60, speed_arcsec_per_sec=5)
+    pwi4.mount_goto_ra_dec_j2000(ra_degs/15, dec_degs)
+    upload_track(pwi4, pattern.track(ra_degs, dec_degs, now_jd() + 30))
+    # or, once the mount is on target
+    run_rates(pwi4, pattern.rates(ra_degs, dec_degs))
+
+Offsets are taken on the sphere like SkyCoord.directional_offset_by: a point
+at (east, north) lies hypot(east, north) arcsec from the center at the
+position angle atan2(east, north), so a Line is a great circle at any
+declination. rates() converts the track to the offsets mount_offset applies,
+which are scaled by 1/cos(dec) of the center in RA. New patterns subclass
+Pattern and implement offsets(), and breakpoints() if they are made of
+straight lines.
+"""
+
+import math
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+# time-tagged coordinates: JD, RA and Dec in degrees
+Track = namedtuple("Track", ["jd", "ra", "dec"])
+
+# segments of constant offset rate, starting at the given offsets (arcsec, arcsec/s)
+Rates = namedtuple("Rates", ["start_seconds", "end_seconds", "east", "north", "east_rate", "north_rate"])
+
+
+def offset_by(ra_degs, dec_degs, east, north):
+    """
+    RA and Dec in degrees of the points at (east, north) arcsec from ra_degs/dec_degs,
+    like SkyCoord.directional_offset_by with the separation hypot(east, north)
+    at the position angle atan2(east, north)
+    """
+
+    east, north = np.asarray(east, dtype=np.float64), np.asarray(north, dtype=np.float64)
+    d = np.radians(np.hypot(east, north) / 3600)
+    pa = np.arctan2(east, north)
+    dec0 = math.radians(dec_degs)
+    dec = np.arcsin(np.clip(math.sin(dec0) * np.cos(d) + math.cos(dec0) * np.sin(d) * np.cos(pa), -1, 1))
+    dra = np.arctan2(np.sin(pa) * np.sin(d) * math.cos(dec0), np.cos(d) - math.sin(dec0) * np.sin(dec))
+    return (ra_degs + np.degrees(dra)) % 360, np.degrees(dec)
+
+
+def offsets_from(ra_degs, dec_degs, ra, dec):
+    """
+    (east, north) in arcsec of the points ra/dec from ra_degs/dec_degs, the inverse of offset_by()
+    """
+
+    ra0, dec0 = math.radians(ra_degs), math.radians(dec_degs)
+    ra, dec = np.radians(ra), np.radians(dec)
+    dra = ra - ra0
+    # separation by the haversine formula, accurate for small distances
+    h = np.sin((dec - dec0) / 2)**2 + math.cos(dec0) * np.cos(dec) * np.sin(dra / 2)**2
+    d = 2 * np.arcsin(np.sqrt(np.clip(h, 0, 1)))
+    pa = np.arctan2(np.sin(dra) * np.cos(dec), math.cos(dec0) * np.sin(dec) - math.sin(dec0) * np.cos(dec) * np.cos(dra))
+    d = np.degrees(d) * 3600
+    return d * np.sin(pa), d * np.cos(pa)
+
+
+def rotate(along, across, position_angle_degs):
+    """
+    (east, north) of offsets along and across (to the left of) a direction at position_angle_degs, east of north
+    """
+
+    pa = math.radians(position_angle_degs)
+    return along * math.sin(pa) - across * math.cos(pa), along * math.cos(pa) + across * math.sin(pa)
+
+
+class Pattern:
+    """
+    Base class of the scan patterns, which set duration_seconds and implement offsets()
+    """
+
+    duration_seconds = 0.0
+
+    def offsets(self, seconds):
+        """
+        (east, north) offsets in arcsec at each of the seconds since the start
+        """
+
+        raise NotImplementedError()
+
+    def breakpoints(self):
+        """
+        Times at which the direction or speed changes, if the track is made of straight lines, else None
+        """
+
+        return None
+
+    def times(self, step_seconds):
+        """
+        Sample times every step_seconds and at the breakpoints,
+        or, if step_seconds is None, only at the breakpoints
+        """
+
+        breakpoints = self.breakpoints()
+        if step_seconds is None:
+            if breakpoints is None:
+                raise ValueError("%s is not made of straight lines, it needs a step_seconds" % type(self).__name__)
+            return np.asarray(breakpoints, dtype=np.float64)
+        grid = np.append(np.arange(0, self.duration_seconds, step_seconds), self.duration_seconds)
+        return grid if breakpoints is None else np.union1d(grid, breakpoints)
+
+    def track(self, ra_degs, dec_degs, jd_start, step_seconds=1.0):
+        """
+        The pattern around ra_degs/dec_degs as time-tagged coordinates, starting at jd_start
+        """
+
+        seconds = self.times(step_seconds)
+        ra, dec = offset_by(ra_degs, dec_degs, *self.offsets(seconds))
+        return Track(jd_start + seconds / 86400, ra, dec)
+
+    def rates(self, ra_degs, dec_degs, step_seconds=1.0):
+        """
+        The pattern around ra_degs/dec_degs as segments of constant mount_offset
+        rate, every step_seconds and at the breakpoints. On the sky even straight
+        lines are curved in RA and Dec, so step_seconds=None, which runs each
+        straight line as one segment, is only accurate for small patterns
+        """
+
+        seconds = self.times(step_seconds)
+        ra, dec = offset_by(ra_degs, dec_degs, *self.offsets(seconds))
+        # mount_offset scales RA offsets by 1/cos(dec) of the target
+        east = ((ra - ra_degs + 180) % 360 - 180) * math.cos(math.radians(dec_degs)) * 3600
+        north = (dec - dec_degs) * 3600
+        dt = np.diff(seconds)
+        # breakpoints can coincide, e.g. where patterns of a Sequence meet
+        keep = dt > 0
+        return Rates(seconds[:-1][keep], seconds[1:][keep], east[:-1][keep], north[:-1][keep],
+                     (np.diff(east) / np.where(keep, dt, 1))[keep], (np.diff(north) / np.where(keep, dt, 1))[keep])
+
+
+class Polyline(Pattern):
+    """
+    Straight lines through vertices (east, north in arcsec), at a constant speed
+    """
+
+    def __init__(self, east, north, speed_arcsec_per_sec):
+        self.east = np.asarray(east, dtype=np.float64)
+        self.north = np.asarray(north, dtype=np.float64)
+        distance = np.hypot(np.diff(self.east), np.diff(self.north))
+        self.vertex_seconds = np.append(0.0, np.cumsum(distance) / speed_arcsec_per_sec)
+        self.duration_seconds = float(self.vertex_seconds[-1])
+
+    def offsets(self, seconds):
+        return np.interp(seconds, self.vertex_seconds, self.east), np.interp(seconds, self.vertex_seconds, self.north)
+
+    def breakpoints(self):
+        return self.vertex_seconds
+
+
+class Line(Polyline):
+    """
+    Constant rate drift from the center, at position_angle_degs east of north
+    """
+
+    def __init__(self, position_angle_degs, speed_arcsec_per_sec, duration_seconds):
+        east, north = rotate(np.array([0.0, speed_arcsec_per_sec * duration_seconds]), 0.0, position_angle_degs)
+        Polyline.__init__(self, east, north, speed_arcsec_per_sec)
+
+
+class Raster(Polyline):
+    """
+    Boustrophedon raster centered on the center: rows width_arcsec long along
+    position_angle_degs (90 is along RA), row_spacing_arcsec apart across height_arcsec
+    """
+
+    def __init__(self, width_arcsec, height_arcsec, row_spacing_arcsec, speed_arcsec_per_sec, position_angle_degs=90):
+        rows = int(math.floor(height_arcsec / row_spacing_arcsec + 1e-9)) + 1
+        across = (np.arange(rows) - (rows - 1) / 2) * row_spacing_arcsec
+        # every row starts where the previous one ended
+        along = np.where(np.arange(rows) % 2, 1, -1) * width_arcsec / 2
+        along = np.column_stack([along, -along]).ravel()
+        east, north = rotate(along, np.repeat(across, 2), position_angle_degs)
+        Polyline.__init__(self, east, north, speed_arcsec_per_sec)
+
+
+class Spiral(Pattern):
+    """
+    Archimedean spiral out from the center to radius_arcsec, with turns
+    spacing_arcsec apart, at a constant speed along the spiral
+    """
+
+    def __init__(self, spacing_arcsec, radius_arcsec, speed_arcsec_per_sec, position_angle_degs=0, resolution=4096):
+        self.b = spacing_arcsec / (2 * math.pi)
+        self.position_angle = math.radians(position_angle_degs)
+        # arc length as a function of the angle, inverted by interpolation
+        self.theta = np.linspace(0, radius_arcsec / self.b, resolution * max(1, int(math.ceil(radius_arcsec / spacing_arcsec))))
+        self.length = self.b / 2 * (self.theta * np.sqrt(1 + self.theta**2) + np.arcsinh(self.theta))
+        self.speed = speed_arcsec_per_sec
+        self.duration_seconds = float(self.length[-1] / speed_arcsec_per_sec)
+
+    def offsets(self, seconds):
+        theta = np.interp(np.asarray(seconds) * self.speed, self.length, self.theta)
+        r = self.b * theta
+        return r * np.sin(theta + self.position_angle), r * np.cos(theta + self.position_angle)
+
+
+class Arc(Pattern):
+    """
+    Great-circle arc from (start_ra_degs, start_dec_degs) to (end_ra_degs, end_dec_degs),
+    at a constant speed. The offsets are from the start, so use the start as the center.
+    An arc that starts at the center is also a Line at its position angle
+    """
+
+    def __init__(self, start_ra_degs, start_dec_degs, end_ra_degs, end_dec_degs, speed_arcsec_per_sec):
+        self.start = (start_ra_degs, start_dec_degs)
+        self.a = self.unit_vector(start_ra_degs, start_dec_degs)
+        self.b = self.unit_vector(end_ra_degs, end_dec_degs)
+        self.angle = math.acos(max(-1.0, min(1.0, float(np.dot(self.a, self.b)))))
+        self.duration_seconds = math.degrees(self.angle) * 3600 / speed_arcsec_per_sec
+
+    @staticmethod
+    def unit_vector(ra_degs, dec_degs):
+        ra, dec = math.radians(ra_degs), math.radians(dec_degs)
+        return np.array([math.cos(dec) * math.cos(ra), math.cos(dec) * math.sin(ra), math.sin(dec)])
+
+    def offsets(self, seconds):
+        f = np.asarray(seconds, dtype=np.float64)[:, None] / self.duration_seconds if self.duration_seconds else 0.0
+        if self.angle == 0:
+            p = np.broadcast_to(self.a, (len(seconds), 3))
+        else:
+            # spherical linear interpolation, at a constant angular speed
+            p = (np.sin((1 - f) * self.angle) * self.a + np.sin(f * self.angle) * self.b) / math.sin(self.angle)
+        ra = np.degrees(np.arctan2(p[:, 1], p[:, 0]))
+        dec = np.degrees(np.arcsin(np.clip(p[:, 2], -1, 1)))
+        return offsets_from(self.start[0], self.start[1], ra, dec)
+
+
+class Sequence(Pattern):
+    """
+    Patterns one after another, each continuing from where the previous one ended
+    """
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        durations = [p.duration_seconds for p in self.patterns]
+        self.start_seconds = np.append(0.0, np.cumsum(durations))
+        self.duration_seconds = float(self.start_seconds[-1])
+
+        self.start_offsets = [(0.0, 0.0)]
+        for p in self.patterns:
+            east, north = p.offsets(np.array([0.0, p.duration_seconds]))
+            e0, n0 = self.start_offsets[-1]
+            self.start_offsets.append((e0 + east[1] - east[0], n0 + north[1] - north[0]))
+
+    def offsets(self, seconds):
+        seconds = np.asarray(seconds, dtype=np.float64)
+        east, north = np.zeros(len(seconds)), np.zeros(len(seconds))
+        which = np.clip(np.searchsorted(self.start_seconds, seconds, side="right") - 1, 0, len(self.patterns) - 1)
+        for i, p in enumerate(self.patterns):
+            rows = which == i
+            if rows.any():
+                e, n = p.offsets(seconds[rows] - self.start_seconds[i])
+                e0, n0 = p.offsets(np.array([0.0]))
+                east[rows] = e - e0[0] + self.start_offsets[i][0]
+                north[rows] = n - n0[0] + self.start_offsets[i][1]
+        return east, north
+
+    def breakpoints(self):
+        points = [p.breakpoints() for p in self.patterns]
+        if any(b is None for b in points):
+            return None
+        return np.concatenate([b + start for b, start in zip(points, self.start_seconds)])
+
+
+def upload_track(pwi4, track, chunk_size=1000):
+    """
+    Let the mount follow the track as a custom path, returns the number of points
+    """
+
+    pwi4.mount_custom_path_upload(list(zip(track.jd.tolist(), (track.ra / 15).tolist(), track.dec.tolist())),
+                                  coord_type="radec", chunk_size=chunk_size)
+    return len(track.jd)
+
+
+def run_rates(pwi4, rates, stop=None):
+    """
+    Run the pattern with ra/dec offset rates around the current target, blocking until it is done.
+    At the start of every segment the offsets are set to where the pattern is,
+    so the latency of the requests doesn't add up. stop is an optional threading.Event
+    that ends the pattern early when it is set, also while waiting for the next segment
+    """
+
+    if stop is None:
+        stop = threading.Event()
+    start = time.monotonic()
+    try:
+        for i in range(len(rates.start_seconds)):
+            if stop.wait(max(0, start + rates.start_seconds[i] - time.monotonic())):
+                break
+            pwi4.mount_offset(ra_set_total_arcsec=rates.east[i], ra_set_rate_arcsec_per_sec=rates.east_rate[i],
+                              dec_set_total_arcsec=rates.north[i], dec_set_rate_arcsec_per_sec=rates.north_rate[i])
+        else:
+            if len(rates.end_seconds):
+                stop.wait(max(0, start + rates.end_seconds[-1] - time.monotonic()))
+    finally:
+        pwi4.mount_offset(ra_stop_rate=0, dec_stop_rate=0)
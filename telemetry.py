@@ -0,0 +1,290 @@
+"""
+Binary telemetry of the mount status, for judging tracking quality afterwards.
+
+TelemetryRecorder appends selected PWI4Status fields to a preallocated ring
+buffer, and a background thread flushes the buffered rows in bulk to
+memory-mapped column files. Recording a row is one tuple assignment, so a
+StatusMonitor polling at 100 Hz can feed it for a whole night:
+
+    recorder = TelemetryRecorder("telemetry").start()
+    monitor.subscribe(recorder.record)
+    ...
+    recorder.stop()
+
+The data is split into segments, each a directory holding one .npy file per
+column, which are preallocated for segment_rows rows. A new segment is
+started when one is full or older than segment_seconds. The number of valid
+rows of a segment is kept in its "rows" file.
+
+TelemetryReader memory-maps the segments, so loading a night does not copy
+or even read the data until it is used:
+
+    reader = TelemetryReader("telemetry")
+    for segment in reader.between(start_unix, end_unix):
+        plot(segment["time"], segment["mount.axis0.dist_to_target_arcsec"])
+"""
+
+import json
+import os
+import threading
+import time
+from operator import attrgetter
+
+import numpy as np
+
+AXIS_FIELDS = [
+    "position_degs",
+    "dist_to_target_arcsec",
+    "servo_error_arcsec",
+    "rms_error_arcsec",
+    "setpoint_velocity_degs_per_sec",
+    "measured_velocity_degs_per_sec",
+    "measured_current_amps",
+]
+
+# (PWI4Status attribute, dtype) of each recorded column. "time" (time.time() of the recording) is always added.
+DEFAULT_FIELDS = [
+    ("mount.julian_date", "f8"),
+    ("mount.ra_j2000_hours", "f8"),
+    ("mount.dec_j2000_degs", "f8"),
+    ("mount.altitude_degs", "f8"),
+    ("mount.azimuth_degs", "f8"),
+    ("mount.is_slewing", "?"),
+    ("mount.is_tracking", "?"),
+] + [("mount.axis%d.%s" % (axis, name), "f8") for axis in (0, 1) for name in AXIS_FIELDS]
+
+
+class TelemetryRecorder:
+    """
+    Records status fields into a ring buffer of buffer_rows rows, which is
+    flushed to disk every flush_interval seconds. If the buffer fills up
+    before it is flushed, new rows are dropped and counted in dropped_rows.
+    """
+
+    def __init__(self, directory, fields=DEFAULT_FIELDS, buffer_rows=8192, segment_rows=360000,
+                 segment_seconds=3600, flush_interval=1.0):
+        self.directory = directory
+        self.fields = list(fields)
+        self.dtype = np.dtype([("time", "f8")] + self.fields)
+        self.segment_rows = segment_rows
+        self.segment_seconds = segment_seconds
+        self.flush_interval = flush_interval
+
+        self._getters = [attrgetter(name) for name, _ in self.fields]
+        self._ring = np.zeros(buffer_rows, dtype=self.dtype)
+        # Total number of rows written to and flushed from the ring; only the
+        # recording thread advances _head and only the flusher advances _tail
+        self._head = 0
+        self._tail = 0
+
+        self.recorded_rows = 0
+        self.dropped_rows = 0
+        self.segment = None
+
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="TelemetryRecorder", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        if self.segment is not None:
+            self.segment.close()
+            self.segment = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def record(self, status, t=None):
+        """
+        Append one row with the fields of status, e.g. as a StatusMonitor subscriber
+        """
+
+        head = self._head
+        if head - self._tail >= len(self._ring):
+            self.dropped_rows += 1
+            return
+        row = (time.time() if t is None else t,) + tuple(getter(status) for getter in self._getters)
+        self._ring[head % len(self._ring)] = row
+        self._head = head + 1
+        self.recorded_rows += 1
+
+    def flush(self):
+        """
+        Write all buffered rows to the current segment
+        """
+
+        with self._flush_lock:
+            head = self._head
+            size = len(self._ring)
+            while self._tail < head:
+                start = self._tail % size
+                # Contiguous part of the ring up to its end or the head
+                n = min(head - self._tail, size - start)
+                self._write(self._ring[start:start + n])
+                self._tail += n
+
+    def _write(self, rows):
+        while len(rows):
+            if self.segment is None or self.segment.full or time.time() - self.segment.created > self.segment_seconds:
+                if self.segment is not None:
+                    self.segment.close()
+                self.segment = SegmentWriter(self.directory, self.dtype, self.segment_rows)
+            n = self.segment.append(rows)
+            rows = rows[n:]
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+
+class SegmentWriter:
+    """
+    One segment directory with a preallocated memory-mapped .npy file per column
+    """
+
+    def __init__(self, directory, dtype, rows):
+        self.created = time.time()
+        name = time.strftime("%Y%m%dT%H%M%S", time.gmtime(self.created)) + ".%06d" % (self.created % 1 * 1e6)
+        self.path = os.path.join(directory, name)
+        os.makedirs(self.path)
+
+        self.rows = 0
+        self.capacity = rows
+        self.columns = {}
+        for field in dtype.names:
+            self.columns[field] = np.lib.format.open_memmap(os.path.join(self.path, field + ".npy"), mode="w+",
+                                                            dtype=dtype[field], shape=(rows,))
+        with open(os.path.join(self.path, "columns.json"), "w") as f:
+            json.dump(list(dtype.names), f)
+        self._write_rows()
+
+    @property
+    def full(self):
+        return self.rows >= self.capacity
+
+    def append(self, rows):
+        n = min(len(rows), self.capacity - self.rows)
+        for field, column in self.columns.items():
+            column[self.rows:self.rows + n] = rows[field][:n]
+        self.rows += n
+        # The row count is only advanced after the data is written, so readers never see unwritten rows
+        self._write_rows()
+        return n
+
+    def _write_rows(self):
+        tmp = os.path.join(self.path, "rows.tmp")
+        with open(tmp, "w") as f:
+            f.write(str(self.rows))
+        os.replace(tmp, os.path.join(self.path, "rows"))
+
+    def close(self):
+        for column in self.columns.values():
+            column.flush()
+        self.columns = {}
+
+
+class Segment:
+    """
+    Read-only view of one segment: segment[name] is the memory-mapped column, trimmed to the valid rows
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "columns.json")) as f:
+            self.names = json.load(f)
+        with open(os.path.join(path, "rows")) as f:
+            self.rows = int(f.read())
+        self._columns = {}
+
+    def __getitem__(self, name):
+        column = self._columns.get(name)
+        if column is None:
+            if name not in self.names:
+                raise KeyError(name)
+            column = np.load(os.path.join(self.path, name + ".npy"), mmap_mode="r")[:self.rows]
+            self._columns[name] = column
+        return column
+
+    def __len__(self):
+        return self.rows
+
+    def keys(self):
+        return list(self.names)
+
+    @property
+    def start(self):
+        return self["time"][0] if self.rows else None
+
+    @property
+    def end(self):
+        return self["time"][-1] if self.rows else None
+
+    def slice(self, start, end):
+        """
+        Columns of the rows recorded between the unix times start and end, as views
+        """
+
+        t = self["time"]
+        lo, hi = np.searchsorted(t, [start, end])
+        return dict((name, self[name][lo:hi]) for name in self.names)
+
+    def to_records(self):
+        """
+        Copy the segment into one structured array
+        """
+
+        records = np.empty(self.rows, dtype=[(name, self[name].dtype) for name in self.names])
+        for name in self.names:
+            records[name] = self[name]
+        return records
+
+
+class TelemetryReader:
+    """
+    All segments in a telemetry directory, oldest first
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.segments = []
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if os.path.exists(os.path.join(path, "rows")):
+                segment = Segment(path)
+                if len(segment):
+                    self.segments.append(segment)
+
+    def __iter__(self):
+        return iter(self.segments)
+
+    def between(self, start=None, end=None):
+        """
+        Views of the rows recorded between the unix times start and end, one dict of columns per segment
+        """
+
+        start = -np.inf if start is None else start
+        end = np.inf if end is None else end
+        return [segment.slice(start, end) for segment in self.segments
+                if segment.end >= start and segment.start <= end]
+
+    def column(self, name, start=None, end=None):
+        """
+        One column over all segments between start and end. Unlike between(), this copies the data.
+        """
+
+        parts = [columns[name] for columns in self.between(start, end)]
+        return np.concatenate(parts) if parts else np.empty(0)
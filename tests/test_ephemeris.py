@@ -0,0 +1,85 @@
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+
+from ephemeris import EphemerisTable, datetime_to_jd, jd_to_datetime
+
+JD0 = 2460000.5
+STEP = 60.0
+
+
+def motion(t):
+    """
+    RA/Dec in degrees and their rates in degrees per second of a target moving along a curve
+    """
+
+    ra = 359.9 + 0.01 * np.sin(t / 5000) + 1e-4 * t / 1000
+    dec = 20 + 0.02 * np.cos(t / 3000)
+    return ra, dec, 0.01 / 5000 * np.cos(t / 5000) + 1e-7, -0.02 / 3000 * np.sin(t / 3000)
+
+
+def table(mode, step=STEP, rate_bias=0.0):
+    t = np.arange(0, 4 * 3600 + step, step)
+    ra, dec, ra_rate, dec_rate = motion(t)
+    return EphemerisTable(JD0 + t / 86400, ra % 360, dec, ra_rate + rate_bias, dec_rate - rate_bias, mode=mode)
+
+
+def largest_error_arcsec(eph):
+    t = np.linspace(1, eph.t[-1] - 1, 2001)
+    ra, dec, _, _ = eph.interpolate(JD0 + t / 86400)
+    exact_ra, exact_dec, _, _ = motion(t)
+    dra = ((ra - exact_ra + 180) % 360 - 180) * np.cos(np.radians(exact_dec))
+    return np.hypot(dra, dec - exact_dec).max() * 3600
+
+
+def test_jd_round_trip():
+    dt = datetime(2023, 7, 17, 8, 30, 15, tzinfo=timezone.utc)
+    assert datetime_to_jd(dt) == pytest.approx(2460142.854340278, abs=1e-9)
+    # naive UTC, like datetime.utcnow()
+    assert abs((jd_to_datetime(datetime_to_jd(dt)) - dt.replace(tzinfo=None)).total_seconds()) < 1e-3
+
+
+def test_linear_interpolation_at_and_between_epochs():
+    eph = EphemerisTable([JD0, JD0 + 1 / 1440], [10.0, 11.0], [-5.0, -4.0])
+    ra, dec, ra_rate, dec_rate = eph.interpolate(JD0 + 0.5 / 1440)
+    assert (ra, dec) == (pytest.approx(10.5), pytest.approx(-4.5))
+    assert ra_rate == pytest.approx(1 / 60) and dec_rate == pytest.approx(1 / 60)
+
+
+def test_ra_is_interpolated_across_zero():
+    eph = EphemerisTable([JD0, JD0 + 1 / 1440], [359.5, 0.5], [0.0, 0.0])
+    assert eph.interpolate(JD0 + 0.5 / 1440)[0] == pytest.approx(0.0, abs=1e-9)
+
+
+def test_outside_the_table_raises():
+    eph = table("linear")
+    with pytest.raises(Exception):
+        eph.interpolate(JD0 - 1)
+    with pytest.raises(Exception):
+        eph.interpolate(eph.end_jd + 1)
+
+
+def test_hermite_is_more_accurate_than_linear():
+    assert largest_error_arcsec(table("hermite")) < largest_error_arcsec(table("linear")) / 100
+
+
+@pytest.mark.parametrize("mode", ["linear", "hermite"])
+def test_error_bound_estimates_the_error(mode):
+    eph = table(mode, step=300)
+    # an estimate from a grid twice as coarse, so it can be slightly low
+    assert largest_error_arcsec(eph) <= 1.1 * eph.error_bound_arcsec()
+
+
+@pytest.mark.parametrize("rate_bias", [1e-7, 1e-6])
+def test_error_bound_includes_the_rate_mismatch(rate_bias):
+    # apparent rates with J2000 positions, the error grows with the spacing, not its fourth power
+    eph = table("hermite", step=300, rate_bias=rate_bias)
+    error = largest_error_arcsec(eph)
+    assert error > 10 * largest_error_arcsec(table("hermite", step=300))
+    assert error <= eph.error_bound_arcsec()
+
+
+def test_hermite_needs_rates():
+    with pytest.raises(ValueError):
+        EphemerisTable([JD0, JD0 + 1], [0.0, 1.0], [0.0, 1.0], mode="hermite")
@@ -0,0 +1,105 @@
+import os
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from horizons_cache import SECONDS_PER_DAY, HorizonsCache, contiguous_runs, snap_jd
+
+STEP = 60.0
+START_JD = 2460000.5
+KEY = {"target": "test", "location": "X07"}
+
+
+def jd(steps):
+    return START_JD + steps * STEP / SECONDS_PER_DAY
+
+
+class Spans:
+    """
+    fetch_span that records the requested epochs and returns RA = the epoch's grid position
+    """
+
+    def __init__(self):
+        self.requested = []
+
+    def __call__(self, jds):
+        jds = np.asarray(jds)
+        self.requested.append(len(jds))
+        return {"jd": jds, "ra": np.round((jds - START_JD) * SECONDS_PER_DAY / STEP)}
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return HorizonsCache(str(tmp_path))
+
+
+def test_contiguous_runs():
+    runs = contiguous_runs(np.array([1, 2, 3, 7, 8, 10]))
+    assert [r.tolist() for r in runs] == [[1, 2, 3], [7, 8], [10]]
+    assert contiguous_runs(np.array([], dtype=np.int64)) == []
+
+
+def test_snap_jd():
+    assert snap_jd(jd(3) + 10 / SECONDS_PER_DAY, STEP) == pytest.approx(jd(3), abs=1e-9)
+
+
+def test_only_missing_spans_are_fetched(cache):
+    spans = Spans()
+    rows = cache.fetch(KEY, jd(0), jd(9), STEP, spans)
+    assert rows["ra"].tolist() == list(range(10))
+
+    # overlaps the stored rows at both ends of a gap
+    rows = cache.fetch(KEY, jd(5), jd(14), STEP, spans)
+    assert rows["ra"].tolist() == list(range(5, 15))
+    assert spans.requested == [10, 5]
+
+    rows = cache.fetch(KEY, jd(2), jd(12), STEP, spans)
+    assert rows["ra"].tolist() == list(range(2, 13))
+    assert spans.requested == [10, 5]
+
+
+def test_phase_just_below_a_grid_point_is_the_same_grid(cache):
+    spans = Spans()
+    cache.fetch(KEY, jd(0), jd(9), STEP, spans)
+    cache.fetch(KEY, jd(0) - 0.0004 / SECONDS_PER_DAY, jd(9), STEP, spans)
+    assert spans.requested == [10]
+    assert len([name for name in os.listdir(cache.directory) if name.endswith(".npz")]) == 1
+
+
+def test_expired_rows_are_fetched_again(tmp_path):
+    spans = Spans()
+    HorizonsCache(str(tmp_path)).fetch(KEY, jd(0), jd(9), STEP, spans)
+    time.sleep(0.05)
+    HorizonsCache(str(tmp_path), max_age_seconds=0.01).fetch(KEY, jd(0), jd(9), STEP, spans)
+    assert spans.requested == [10, 10]
+
+
+def test_eviction_keeps_the_cache_below_max_bytes(tmp_path):
+    cache = HorizonsCache(str(tmp_path), max_bytes=0)
+    cache.fetch(KEY, jd(0), jd(9), STEP, Spans())
+    assert [name for name in os.listdir(str(tmp_path)) if name.endswith(".npz")] == []
+
+
+def test_concurrent_fetches_of_one_key_keep_both_spans(cache):
+    # the first fetch is still waiting for its span while the second one stores another span
+    first_fetching = threading.Event()
+    second_stored = threading.Event()
+
+    def slow(jds):
+        first_fetching.set()
+        second_stored.wait(5)
+        return Spans()(jds)
+
+    first = threading.Thread(target=cache.fetch, args=(KEY, jd(0), jd(9), STEP, slow))
+    first.start()
+    first_fetching.wait(5)
+    cache.fetch(KEY, jd(20), jd(29), STEP, Spans())
+    second_stored.set()
+    first.join()
+
+    spans = Spans()
+    assert cache.fetch(KEY, jd(0), jd(9), STEP, spans)["ra"].tolist() == list(range(10))
+    assert cache.fetch(KEY, jd(20), jd(29), STEP, spans)["ra"].tolist() == list(range(20, 30))
+    assert spans.requested == []
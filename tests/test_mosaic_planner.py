@@ -0,0 +1,76 @@
+import math
+import random
+from types import SimpleNamespace
+
+import pytest
+
+import mosaic_planner
+from mosaic_planner import Panel, SlewModel, axis_move_seconds, grid_panels, plan_mosaic, plan_row_major
+
+
+def test_axis_move_seconds():
+    # triangular profile: half the distance accelerating, half braking
+    assert axis_move_seconds(1.0, 10.0, 4.0) == pytest.approx(2 * math.sqrt(1.0 / 4.0))
+    # trapezoidal profile: cruising at the max velocity in between
+    assert axis_move_seconds(-100.0, 10.0, 5.0) == pytest.approx(100.0 / 10.0 + 10.0 / 5.0)
+    assert axis_move_seconds(0.0, 10.0, 5.0) == 0.0
+
+
+def test_slew_wraps_around_24h():
+    model = SlewModel(1.0, 1.0, settle_seconds=0)
+    assert model.slew_seconds(23.9, 0, 0.1, 0) == pytest.approx(model.slew_seconds(0.0, 0, 0.2, 0))
+    assert model.slew_seconds(5.0, 10.0, 5.0, 10.0) == 0.0
+
+
+def status(geometry=0, velocity=None, acceleration=None):
+    axis = SimpleNamespace(max_velocity_degs_per_sec=velocity, acceleration_degs_per_sec_sqr=acceleration)
+    return SimpleNamespace(mount=SimpleNamespace(axis0=axis, axis1=axis, geometry=geometry),
+                           site=SimpleNamespace(latitude_degs=-30.5, lmst_hours=7.0))
+
+
+def test_from_status_without_axis_limits():
+    # PWI4 before 4.0.13
+    model = SlewModel.from_status(status())
+    assert model.axis0 == (mosaic_planner.DEFAULT_MAX_VELOCITY_DEGS_PER_SEC, mosaic_planner.DEFAULT_ACCELERATION_DEGS_PER_SEC_SQR)
+    assert model.slew_seconds(1.0, 0.0, 2.0, 10.0) > 0
+
+
+def test_altaz_model():
+    model = SlewModel.from_status(status(geometry=mosaic_planner.GEOMETRY_ALT_AZ, velocity=2.0, acceleration=1.0))
+    assert model.is_altaz
+    assert not SlewModel.from_status(status(velocity=2.0, acceleration=1.0)).is_altaz
+    # on the meridian a move in Dec is a move in altitude only
+    model.settle_seconds = 0
+    assert model.slew_seconds(7.0, 0.0, 7.0, 10.0) == pytest.approx(axis_move_seconds(10.0, 2.0, 1.0))
+
+
+def test_altaz():
+    alt, az = mosaic_planner.altaz(7.0, -30.5, -30.5, 7.0)
+    assert alt == pytest.approx(90.0)
+    # the celestial equator crosses the meridian in the north, seen from the south
+    alt, az = mosaic_planner.altaz(7.0, 0.0, -30.5, 7.0)
+    assert alt == pytest.approx(59.5) and az == pytest.approx(0.0, abs=1e-9)
+
+
+def test_plan_visits_every_frame_once_and_beats_row_major():
+    panels = grid_panels(7.0, -26.0, 20 / 60 / 15, 20 / 60, 5, 7)
+    model = SlewModel(1.0, 0.5)
+    plan = plan_mosaic(panels, model, filters=range(4), exposure_seconds=180, start=(7.5, -20.0))
+    baseline = plan_row_major(panels, model, filters=range(4), exposure_seconds=180, start=(7.5, -20.0))
+
+    assert sorted(visit.panel for visit in plan.visits) == sorted(panels)
+    assert all(sorted(visit.filters) == [0, 1, 2, 3] for visit in plan.visits)
+    assert plan.total_seconds <= baseline.total_seconds
+    # the filter wheel continues from the filter it ended on
+    for a, b in zip(plan.visits, plan.visits[1:]):
+        assert a.filters[-1] == b.filters[0]
+
+
+def test_scattered_panels_are_improved_by_two_opt():
+    rng = random.Random(1)
+    panels = [Panel(i, 0, rng.uniform(0, 2), rng.uniform(-30, 0)) for i in range(30)]
+    model = SlewModel(1.0, 0.5)
+    order = mosaic_planner.nearest_neighbor_order(panels, model)
+    improved = mosaic_planner.two_opt(order, model)
+    assert sorted(improved) == sorted(panels)
+    assert mosaic_planner.path_seconds(improved, model) <= mosaic_planner.path_seconds(order, model)
@@ -0,0 +1,86 @@
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from astropy.io import fits
+
+from mosaic_planner import Panel, Visit
+from mosaic_sequencer import Frame, MosaicSequencer, fits_coordinates, is_complete_fits, matches, sexagesimal
+
+PANELS = [Panel(0, 0, 10.0, 20.0), Panel(1, 0, 10.1, 20.0)]
+
+
+def make_plan(filters=(0, 1)):
+    return SimpleNamespace(visits=[Visit(panel, list(filters)) for panel in PANELS])
+
+
+def write_image(path, **cards):
+    hdu = fits.PrimaryHDU(np.zeros((8, 8), dtype=np.uint16))
+    for keyword, value in cards.items():
+        hdu.header[keyword] = value
+    hdu.writeto(str(path))
+    return str(path)
+
+
+def test_sexagesimal():
+    assert sexagesimal("12 30 00") == pytest.approx(12.5)
+    assert sexagesimal("-05:30:36") == pytest.approx(-5.51)
+    assert sexagesimal("-00 30 00") == pytest.approx(-0.5)
+    assert sexagesimal(7) == 7.0
+    with pytest.raises(ValueError):
+        sexagesimal("1 2 3 4")
+
+
+def test_truncated_image_is_incomplete(tmp_path):
+    path = write_image(tmp_path / "m_0_0_0.fit")
+    assert is_complete_fits(path)
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 100)
+    assert not is_complete_fits(path)
+    assert not is_complete_fits(str(tmp_path / "missing.fit"))
+
+
+def test_fits_coordinates(tmp_path):
+    panel = write_image(tmp_path / "a.fit", PANELRA=10.0, PANELDEC=20.0, OBJCTRA="00 00 00", OBJCTDEC="00 00 00")
+    assert fits_coordinates(panel) == (10.0, 20.0, None)
+    camera = write_image(tmp_path / "b.fit", OBJCTRA="10 00 01", OBJCTDEC="+20 00 10")
+    ra, dec, tolerance = fits_coordinates(camera)
+    assert matches(PANELS[0], ra, dec, tolerance)
+    assert not matches(PANELS[0], ra, dec)
+    assert fits_coordinates(write_image(tmp_path / "c.fit")) is None
+
+
+def test_matches_wraps_around_24h():
+    panel = Panel(0, 0, 23.9999, 0.0)
+    assert matches(panel, 0.0001, 0.0, tolerance_arcsec=60)
+    assert not matches(panel, 12.0, 0.0, tolerance_arcsec=60)
+
+
+def test_resume_from_journal_and_images(tmp_path):
+    plan = make_plan()
+    sequencer = MosaicSequencer(plan, str(tmp_path))
+    assert len(sequencer.remaining_visits()) == 2
+
+    sequencer.mark_done(PANELS[0], 0, write_image(tmp_path / "j_0_0_0.fit"))
+    # taken before the journal existed, found by its name and header
+    write_image(tmp_path / "m_0_0_1.fit", PANELRA=10.0, PANELDEC=20.0)
+    # from another mosaic in the same directory
+    write_image(tmp_path / "m_1_0_0.fit", PANELRA=5.0, PANELDEC=20.0)
+    # cut off when the run stopped
+    with open(str(tmp_path / "m_1_0_1.fit"), "wb") as f:
+        f.write(b"SIMPLE  =                    T")
+
+    resumed = MosaicSequencer(plan, str(tmp_path))
+    assert set(resumed.done) == {Frame(0, 0, 0), Frame(0, 0, 1)}
+    assert resumed.remaining_visits() == [Visit(PANELS[1], [0, 1])]
+    assert resumed.progress() == "2 of 4 frames done, 2 remaining"
+
+
+def test_journal_ignores_a_cut_off_line(tmp_path):
+    sequencer = MosaicSequencer(make_plan(), str(tmp_path))
+    sequencer.mark_done(PANELS[1], 1, write_image(tmp_path / "j_1_0_1.fit"))
+    with open(sequencer.journal.path, "a") as f:
+        f.write('{"x": 0, "y"')
+
+    assert set(MosaicSequencer(make_plan(), str(tmp_path)).done) == {Frame(1, 0, 1)}
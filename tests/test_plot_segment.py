@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+import plot_segment
+
+
+def vector_table(rows):
+    lines = []
+    for i in range(rows):
+        a = i * 2 * np.pi / 1440
+        lines.append("%.9f, A.D. 2023-Jul-17 %02d:%02d:00.0000, %.16E, %.16E, %.16E, %.16E, %.16E, %.16E," % (
+            plot_segment.to_jd("2023-Jul-17 08:00") + i / 1440, 8 + i // 60, i % 60,
+            4e5 * np.cos(a), 4e5 * np.sin(a), 0.0, -4.6 * np.sin(a), 4.6 * np.cos(a), 0.0))
+    return "\n".join(lines) + "\n"
+
+
+def test_colour_runs():
+    colors = np.array(["yellow", "yellow", "red", "red", "red", "yellow", "yellow"])
+    assert plot_segment.colour_runs(colors) == [(0, 3), (2, 6), (5, 7)]
+
+
+def test_colour_runs_with_a_change_at_the_last_sample():
+    colors = np.array(["yellow", "yellow", "yellow", "red"])
+    # the first run already ends on the last sample, a run of one sample has no curve
+    assert plot_segment.colour_runs(colors) == [(0, 4)]
+    assert plot_segment.colour_runs(np.array(["red"])) == []
+
+
+def test_extract_data():
+    pos, tgt, dates, colors = plot_segment.extract_data(vector_table(120), True, "2023-Jul-17 08:30", "2023-Jul-17 09:00")
+    assert pos.shape == (120, 3) and tgt.shape == (120, 3)
+    assert np.allclose(np.linalg.norm(tgt, axis=1), 1)
+    assert pos[0] == pytest.approx([4e5, 0, 0])
+    assert dates[30].startswith("A.D. 2023-Jul-17 08:30:00")
+    assert colors.tolist() == ["yellow"] * 30 + ["red"] * 31 + ["yellow"] * 59
+
+
+def test_extract_data_rejects_other_tables():
+    with pytest.raises(ValueError):
+        plot_segment.extract_data("2460143.8, A.D. 2023-Jul-17 08:00:00.0000, 1, 2, 3,\n")
+
+
+def test_decimate_stays_within_tolerance():
+    pos, tgt, dates, colors = plot_segment.extract_data(vector_table(1440))
+    tolerance = 1e-4 * np.abs(pos).max()
+    keep = plot_segment.decimate(pos, tgt, tolerance)
+    assert keep[0] == 0 and keep[-1] == len(pos) - 1
+    assert len(keep) < len(pos) / 10
+    k = np.setdiff1d(np.arange(len(pos)), keep)
+    segment = np.searchsorted(keep, k) - 1
+    assert plot_segment.bezier_error(pos, tgt, keep[segment], keep[segment + 1], k).max() <= tolerance
+
+
+def test_bez():
+    pos = np.array([[0.0, 0, 0], [3, 0, 0]])
+    tgt = np.array([[1.0, 0, 0], [1, 0, 0]])
+    assert plot_segment.bez(pos, tgt) == [[(0, 0, 0), (1, 0, 0), (2, 0, 0), (3, 0, 0)]]
+    assert plot_segment.bez(pos[:1], tgt[:1]) == []
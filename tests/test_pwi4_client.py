@@ -0,0 +1,70 @@
+import os
+
+import pytest
+
+from pwi4_client import PWI4
+from pwi4_simulator import start_simulator
+
+
+@pytest.fixture
+def simulator():
+    server = start_simulator(port=0)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_take_image_and_save(simulator, tmp_path):
+    path = str(tmp_path / "image.fits")
+    pwi4 = PWI4(*simulator.server_address)
+    size = pwi4.virtualcamera_take_image_and_save(path, chunk_size=4096)
+    with open(path, "rb") as f:
+        assert f.read(6) == b"SIMPLE"
+    assert os.path.getsize(path) == size
+    assert not os.path.exists(path + ".tmp")
+
+
+def test_failed_take_image_keeps_the_previous_file(simulator, tmp_path):
+    path = tmp_path / "image.fits"
+    path.write_bytes(b"previous")
+    pwi4 = PWI4(*simulator.server_address)
+    simulator.shutdown()
+    simulator.server_close()
+    with pytest.raises(OSError):
+        pwi4.virtualcamera_take_image_and_save(str(path))
+    assert path.read_bytes() == b"previous"
+    assert os.listdir(str(tmp_path)) == ["image.fits"]
+
+
+def test_status_fields_are_converted_on_access():
+    from pwi4_client import PWI4Status
+
+    status = PWI4Status({
+        "pwi4.version": "4.0.99.15",
+        "pwi4.version_field[0]": "4",
+        "mount.is_slewing": "True",
+        "mount.axis0.dist_to_target_arcsec": "1.5",
+        "focuser.position": "not a number",
+    })
+    assert status.pwi4.version == "4.0.99.15"
+    assert status.pwi4.version_field == [4, 0, 0, 0]
+    assert status.mount.is_slewing is True
+    assert status.mount.axis0.dist_to_target_arcsec == 1.5
+    # missing optional keys are None, sections that PWI4 doesn't report too
+    assert status.mount.axis0.measured_velocity_degs_per_sec is None
+    assert status.mount.offsets is None
+    with pytest.raises(ValueError):
+        status.focuser.position
+
+
+def test_status_without_required_keys_fails_when_parsed():
+    from pwi4_client import PWI4Status
+
+    with pytest.raises(KeyError):
+        PWI4Status({"mount.is_slewing": "true"})
+
+
+def test_status_from_the_simulator(simulator):
+    status = PWI4(*simulator.server_address).status()
+    assert status.pwi4.version
+    assert status.mount.axis1.position_degs is not None
@@ -0,0 +1,94 @@
+import itertools
+from types import SimpleNamespace
+
+import pytest
+
+from pwi4_monitor import StatusMonitor, time_to_arrival, wait_until_settled
+
+
+def make_status(dist0, dist1=None, slewing=False, velocity=0.0):
+    def axis(dist):
+        return SimpleNamespace(dist_to_target_arcsec=dist, measured_velocity_degs_per_sec=velocity)
+    return SimpleNamespace(mount=SimpleNamespace(axis0=axis(dist0), axis1=axis(dist0 if dist1 is None else dist1), is_slewing=slewing))
+
+
+class ScriptedPWI4:
+    """
+    status() returns the statuses in turn, then the last one forever
+    """
+
+    def __init__(self, statuses):
+        self.statuses = iter(statuses)
+        self.last = None
+        self.calls = 0
+
+    def status(self):
+        self.calls += 1
+        self.last = next(self.statuses, self.last)
+        if isinstance(self.last, Exception):
+            raise self.last
+        return self.last
+
+
+def test_time_to_arrival():
+    assert time_to_arrival(make_status(36.0, 0.0, velocity=0.01)) == pytest.approx(1.0)
+    assert time_to_arrival(make_status(0.0, 0.0, velocity=None)) == 0.0
+    # PWI4 before 4.0.13 doesn't report the velocity
+    assert time_to_arrival(make_status(36.0, velocity=None)) is None
+
+
+def test_settled_without_velocities():
+    pwi4 = ScriptedPWI4([make_status(3600, slewing=True, velocity=None), make_status(0.1, velocity=None)])
+    result = wait_until_settled(pwi4, min_interval=0.001, max_interval=0.01, timeout=5, verbose=False)
+    assert result.status.mount.axis0.dist_to_target_arcsec == 0.1
+
+
+def test_status_from_before_the_slew_does_not_count():
+    # the first polls after the goto still show the mount resting on the previous target
+    stale = [make_status(0.0)] * 5
+    statuses = stale + [make_status(3600, slewing=True, velocity=1.0)] * 2 + [make_status(0.2)]
+    pwi4 = ScriptedPWI4(statuses)
+    result = wait_until_settled(pwi4, min_interval=0.001, max_interval=0.01, min_seconds=10, timeout=5, verbose=False)
+    assert result.polls >= len(statuses) + 2
+    assert result.status.mount.axis0.dist_to_target_arcsec == 0.2
+
+
+def test_slewing_through_the_target_does_not_count():
+    pwi4 = ScriptedPWI4([make_status(0.1, slewing=True, velocity=1.0)] * 10 + [make_status(0.3)])
+    result = wait_until_settled(pwi4, min_interval=0.001, max_interval=0.01, timeout=5, verbose=False)
+    assert pwi4.calls >= 13
+    assert not result.status.mount.is_slewing
+
+
+def test_settle_timeout():
+    pwi4 = ScriptedPWI4([make_status(3600, slewing=True, velocity=0.0)])
+    with pytest.raises(TimeoutError):
+        wait_until_settled(pwi4, min_interval=0.001, max_interval=0.01, timeout=0.1, verbose=False)
+
+
+def test_monitor_survives_callback_errors():
+    counter = itertools.count()
+    pwi4 = SimpleNamespace(status=lambda: next(counter))
+
+    def failing(status):
+        raise ValueError("callback")
+
+    with StatusMonitor(pwi4, interval=0.001) as monitor:
+        monitor.subscribe(failing)
+        assert monitor.wait_for(lambda s: s >= 5, timeout=5) >= 5
+    assert monitor.callback_error_count >= 5
+    assert isinstance(monitor.last_callback_error, ValueError)
+
+
+def test_wait_fails_when_polls_keep_failing():
+    pwi4 = ScriptedPWI4([ConnectionRefusedError("PWI4 is not running")])
+    with StatusMonitor(pwi4, interval=0.001, max_consecutive_errors=3) as monitor:
+        with pytest.raises(RuntimeError) as e:
+            monitor.wait_for_update(timeout=5)
+    assert isinstance(e.value.__cause__, ConnectionRefusedError)
+
+
+def test_wait_fails_when_not_running():
+    monitor = StatusMonitor(ScriptedPWI4([make_status(0.0)]))
+    with pytest.raises(RuntimeError):
+        monitor.wait_for_update(timeout=1)
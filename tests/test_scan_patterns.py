@@ -0,0 +1,78 @@
+import math
+import threading
+
+import numpy as np
+import pytest
+
+import scan_patterns
+
+
+@pytest.mark.parametrize("dec_degs", [8, 45, 70, -60])
+@pytest.mark.parametrize("position_angle_degs", [0, 45, 90, 250])
+def test_line_matches_directional_offset_by(dec_degs, position_angle_degs):
+    u = pytest.importorskip("astropy.units")
+    from astropy.coordinates import SkyCoord
+
+    line = scan_patterns.Line(position_angle_degs, speed_arcsec_per_sec=1, duration_seconds=3600)
+    track = line.track(150.0, dec_degs, 2460000.5, step_seconds=60)
+    seconds = (track.jd - 2460000.5) * 86400
+    expected = SkyCoord(150.0 * u.deg, dec_degs * u.deg).directional_offset_by(position_angle_degs * u.deg, seconds / 3600 * u.deg)
+    assert SkyCoord(track.ra * u.deg, track.dec * u.deg).separation(expected).arcsec.max() < 1e-3
+
+
+def test_offsets_from_inverts_offset_by():
+    east = np.array([0.0, 100.0, -3000.0, 5.0])
+    north = np.array([0.0, 5.0, 200.0, -7000.0])
+    ra, dec = scan_patterns.offset_by(359.9, 70.0, east, north)
+    e, n = scan_patterns.offsets_from(359.9, 70.0, ra, dec)
+    assert np.allclose(e, east, atol=1e-6) and np.allclose(n, north, atol=1e-6)
+
+
+def test_arc_ends_at_its_end():
+    arc = scan_patterns.Arc(150.0, 70.0, 170.0, 72.0, speed_arcsec_per_sec=10)
+    track = arc.track(150.0, 70.0, 2460000.5, step_seconds=10)
+    assert track.ra[0] == pytest.approx(150.0) and track.dec[0] == pytest.approx(70.0)
+    assert track.ra[-1] == pytest.approx(170.0, abs=1e-9) and track.dec[-1] == pytest.approx(72.0, abs=1e-9)
+
+
+def test_raster_rows_and_duration():
+    raster = scan_patterns.Raster(width_arcsec=600, height_arcsec=300, row_spacing_arcsec=60, speed_arcsec_per_sec=5)
+    # 6 rows of 600'' and 5 steps of 60'' between them
+    assert raster.duration_seconds == pytest.approx((6 * 600 + 5 * 60) / 5)
+    east, north = raster.offsets(raster.breakpoints())
+    assert east.min() == pytest.approx(-300) and east.max() == pytest.approx(300)
+    assert north.min() == pytest.approx(-150) and north.max() == pytest.approx(150)
+
+
+def test_sequence_continues_where_the_previous_pattern_ended():
+    a = scan_patterns.Line(90, speed_arcsec_per_sec=1, duration_seconds=10)
+    b = scan_patterns.Line(0, speed_arcsec_per_sec=2, duration_seconds=5)
+    sequence = scan_patterns.Sequence([a, b])
+    east, north = sequence.offsets(np.array([0.0, 10.0, 15.0]))
+    assert np.allclose(east, [0, 10, 10]) and np.allclose(north, [0, 0, 10])
+
+
+def test_rates_follow_the_track_in_mount_offsets():
+    line = scan_patterns.Line(90, speed_arcsec_per_sec=1, duration_seconds=3600)
+    rates = line.rates(150.0, 70.0, step_seconds=60)
+    track = line.track(150.0, 70.0, 0.0, step_seconds=60)
+    # the mount_offset convention: RA offsets times cos(dec) of the center
+    east = (track.ra - 150.0) * math.cos(math.radians(70.0)) * 3600
+    end = rates.east + rates.east_rate * (rates.end_seconds - rates.start_seconds)
+    assert np.allclose(rates.east, east[:-1]) and np.allclose(end, east[1:])
+    assert np.all(rates.end_seconds > rates.start_seconds)
+
+
+def test_run_rates_stops_when_stop_is_set():
+    class FakePWI4:
+        def __init__(self):
+            self.calls = []
+
+        def mount_offset(self, **kwargs):
+            self.calls.append(kwargs)
+
+    pwi4 = FakePWI4()
+    stop = threading.Event()
+    stop.set()
+    scan_patterns.run_rates(pwi4, scan_patterns.Line(0, 1, 100).rates(10.0, 20.0), stop)
+    assert pwi4.calls == [{"ra_stop_rate": 0, "dec_stop_rate": 0}]
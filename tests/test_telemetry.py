@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from pwi4_client import PWI4Status
+from telemetry import TelemetryReader, TelemetryRecorder
+
+FIELDS = [("mount.ra_j2000_hours", "f8"), ("mount.is_slewing", "?"), ("mount.axis0.dist_to_target_arcsec", "f8")]
+
+
+def make_status(i):
+    return PWI4Status({
+        "pwi4.version": "4.0.99.15",
+        "mount.ra_j2000_hours": str(i / 10),
+        "mount.is_slewing": "true" if i % 2 else "false",
+        "mount.axis0.dist_to_target_arcsec": str(-i),
+    })
+
+
+def test_round_trip(tmp_path):
+    # small segments, so the rows span several of them
+    with TelemetryRecorder(str(tmp_path), FIELDS, buffer_rows=64, segment_rows=25, flush_interval=0.01) as recorder:
+        for i in range(60):
+            recorder.record(make_status(i), t=1000.0 + i)
+            if i % 30 == 29:
+                recorder.flush()
+    assert recorder.recorded_rows == 60 and recorder.dropped_rows == 0
+
+    reader = TelemetryReader(str(tmp_path))
+    assert [len(segment) for segment in reader] == [25, 25, 10]
+    assert reader.column("time").tolist() == [1000.0 + i for i in range(60)]
+    assert np.allclose(reader.column("mount.ra_j2000_hours"), np.arange(60) / 10)
+    assert reader.column("mount.is_slewing").tolist() == [bool(i % 2) for i in range(60)]
+    # end is exclusive
+    assert reader.column("mount.axis0.dist_to_target_arcsec", 1010, 1020).tolist() == [-i for i in range(10, 20)]
+
+    records = reader.segments[0].to_records()
+    assert records.dtype.names == ("time",) + tuple(name for name, _ in FIELDS)
+    # a window over a segment boundary returns a view of each segment
+    assert [len(columns["time"]) for columns in reader.between(1020, 1030)] == [5, 5]
+
+
+def test_full_buffer_drops_rows(tmp_path):
+    recorder = TelemetryRecorder(str(tmp_path), FIELDS, buffer_rows=4)
+    for i in range(6):
+        recorder.record(make_status(i), t=float(i))
+    assert recorder.recorded_rows == 4 and recorder.dropped_rows == 2
+
+
+def test_reader_skips_unknown_columns(tmp_path):
+    with TelemetryRecorder(str(tmp_path), FIELDS) as recorder:
+        recorder.record(make_status(1), t=1.0)
+    segment = TelemetryReader(str(tmp_path)).segments[0]
+    with pytest.raises(KeyError):
+        segment["mount.dec_j2000_degs"]
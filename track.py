@@ -1,22 +1,67 @@
 # pip install astropy astroquery
 
 import os
-from time import sleep, time
+from time import sleep, time, perf_counter
 from datetime import datetime, timedelta
 
 from astroquery.jplhorizons import Horizons
-from astropy.time import Time, TimeDelta
-from astropy.coordinates import SkyCoord, AltAz, EarthLocation
+from astropy.coordinates import EarthLocation
 import astropy.units as u
+import numpy as np
+
+from ephemeris import EphemerisTable, EphemerisPrefetcher, AltAzTable, datetime_to_jd, horizons_rates_to_degs
+from horizons_cache import HorizonsCache, snap_jd
+from pwi4_monitor import StatusMonitor
+from telemetry import TelemetryRecorder
+import instrument
 
 location = EarthLocation(lat=-30.52630901637761*u.deg, lon=-70.85329602458852*u.deg, height=1710*u.m)
 
 obj_name = "Chandrayaan-3"
 obj_id = -158#6 for Saturn
+location_code = "X07"
 
-INTERVAL_SECONDS = 5#*60
+# "hermite" also requests the RA/Dec rates from Horizons, which allows a much sparser grid than "linear"
+INTERPOLATION = "hermite"
+INTERVAL_SECONDS = 60 if INTERPOLATION == "hermite" else 5#*60
 STEPS = 4*15
 
+# warn if the estimated interpolation error of a window is larger than this
+INTERPOLATION_TOLERANCE_ARCSEC = 1.0
+
+# fetch the next window in the background once less than this is left of the current one
+PREFETCH_LEAD_SECONDS = INTERVAL_SECONDS*STEPS/2
+
+# ephemerides are cached on disk, refetch them once they are older than this
+CACHE_MAX_AGE_SECONDS = 24*60*60
+# created by the first load_ephemerides(), so importing this module doesn't create the cache directory
+cache = None
+
+# how often the mount status is polled for the console output
+STATUS_INTERVAL_SECONDS = 0.5
+
+# largest acceptable error of the interpolated Alt/Az, above it every tick does an exact transform
+ALTAZ_TOLERANCE_ARCSEC = 1.0
+
+# "goto" sends a new target every tick, "path" uploads each ephemeris window to the mount
+# as a custom path and only supervises it, which takes host timing and HTTP out of the pointing.
+# "path" needs a PWI4 version with the /mount/custom_path endpoints
+TRACK_MODE = "goto"
+# spacing of the uploaded path points and number of points per add_point_list request
+PATH_STEP_SECONDS = 1
+PATH_CHUNK_SIZE = 1000
+
+# timing percentiles of each stage of the loop are written to this file every METRICS_INTERVAL_SECONDS,
+# e.g. EPHEMERITRACK_METRICS=metrics.txt, as "text" or "prometheus". instrumentation is off if it is not set
+METRICS_FILE = os.environ.get("EPHEMERITRACK_METRICS")
+METRICS_FORMAT = "text"
+METRICS_INTERVAL_SECONDS = 10
+
+# mount status is recorded to this directory at TELEMETRY_INTERVAL_SECONDS, e.g. EPHEMERITRACK_TELEMETRY=telemetry,
+# read it with telemetry.TelemetryReader. nothing is recorded if it is not set
+TELEMETRY_DIRECTORY = os.environ.get("EPHEMERITRACK_TELEMETRY")
+TELEMETRY_INTERVAL_SECONDS = 0.01
+
 #set this to false if you want to test this locally, without actually importing/moving anything
 ACTUALLYTRACK = False
 
@@ -35,13 +80,24 @@ class Every:
 every = Every(1)
 
 
-def track(eph, prod=True):
+def upload_path(pwi4, table, startjd):
+	# sample the rest of the window, the mount interpolates between the points itself
+	jd = np.arange(startjd, table.end_jd, PATH_STEP_SECONDS/86400)
+	ra, dec, _, _ = table.interpolate(jd)
+	pwi4.mount_custom_path_upload(list(zip(jd, ra/15, dec)), coord_type="radec", chunk_size=PATH_CHUNK_SIZE)
+	return len(jd)
 
-	if prod:
+def track(eph, prod=True, pwi4=None, run_seconds=None, on_tick=None):
+	# pwi4, run_seconds and on_tick(nowjd) are for benchmarks/run_benchmarks.py, which
+	# runs the loop against a simulated PWI4 for a fixed time and records every tick
+
+	if prod and pwi4 is None:
 		from pwi4_client import PWI4
 		print("Connecting to PWI4...")
 		pwi4 = PWI4()
 
+	if prod:
+		instrument.instrument_pwi4(pwi4)
 		s = pwi4.status()
 		print("Mount connected:", s.mount.is_connected)
 
@@ -55,105 +111,137 @@ def track(eph, prod=True):
 		print("Slewing...")
 		pwi4.mount_tracking_on()
 
-	# so the previous line is not erased, print an empty one
-	nlines = 2
-	print("\n"*nlines, end="")
-	while True:
-		now = datetime.utcnow()#datetime.strptime(t_0, "%Y-%m-%d %H:%M") + (datetime.utcnow() - fakestart)# + timedelta(hours=4.4)#XXX#SUBTRACT
-		start = list(eph)[0]#just for testing
-		end = None
-		for t,c in eph.items():
-		    if t >= now:
-		        end = t
-		        break
-		    start = t
-
-		if end is None:
-			raise Exception("ran out of ephemerides need new ones")
-		if start == end:
-			raise Exception("need earlier ephemerides")
-			exit(1)
-		timediff = (end-start).total_seconds()
-		factor = (now-start).total_seconds()
-		p = factor/timediff
-		#print(factor, timediff, p)
-
-		start_ra = eph[start].ra.to_value()
-		end_ra = eph[end].ra.to_value()
-		start_dec = eph[start].dec.to_value()
-		end_dec = eph[end].dec.to_value()
-
-		# °/s
-		ra_rate = (end_ra - start_ra)/timediff
-		dec_rate = (end_dec - start_dec)/timediff
-		
-		# ''/s
-		rate = (ra_rate**2+dec_rate**2)**0.5 * 60 * 60
-
-		#print(start_ra, end_ra, start_dec, end_dec)
-		ra = start_ra * (1-p) + end_ra * (p)
-		dec = start_dec * (1-p) + end_dec * (p)
-
-		coord = SkyCoord(ra/15, dec, unit=(u.hourangle, u.deg))
-
-		obstime = now#Time.now()
-		altaz = coord.transform_to(AltAz(obstime=obstime, location=location))
-
-		mountstr = ""
-		if prod:
-		    pwi4.mount_goto_ra_dec_j2000(ra/15, dec)
-
-		    s = pwi4.status()
-
-		    mountstr = f"Actual RA: {s.mount.ra_j2000_hours:.5f} hours;  Actual Dec: {s.mount.dec_j2000_degs:.4f} degs, Axis0 dist: {s.mount.axis0.dist_to_target_arcsec:.1f} arcsec, Axis1 dist: {s.mount.axis1.dist_to_target_arcsec:.1f} arcsec"
+		# the status is polled once in the background instead of after every command
+		monitor = StatusMonitor(pwi4, interval=TELEMETRY_INTERVAL_SECONDS if TELEMETRY_DIRECTORY else STATUS_INTERVAL_SECONDS)
+		if TELEMETRY_DIRECTORY:
+			recorder = TelemetryRecorder(TELEMETRY_DIRECTORY).start()
+			monitor.subscribe(recorder.record)
+		monitor.start()
 
-		if every:
+	# stopped however the loop ends, the __main__ loop calls track() again after every exception
+	try:
+		# so the previous line is not erased, print an empty one
+		nlines = 2
+		print("\n"*nlines, end="")
+		uploaded_generation = None
+		started = time()
+		while run_seconds is None or time()-started < run_seconds:
+			tickstart = perf_counter()
+			now = datetime.utcnow()#datetime.strptime(t_0, "%Y-%m-%d %H:%M") + (datetime.utcnow() - fakestart)# + timedelta(hours=4.4)#XXX#SUBTRACT
+
+			nowjd = datetime_to_jd(now)
+			# the prefetcher may swap in a new window at any time, use the same one for this whole tick
+			generation = eph.generation
+			table = eph.table
+
+			# raises if now is not covered by the ephemerides
+			with instrument.span("interpolate"):
+				ra, dec, ra_rate, dec_rate = table.interpolate(nowjd)
+
+			# ''/s
+			rate = (ra_rate**2+dec_rate**2)**0.5 * 60 * 60
+
+			mountstr = ""
+			if prod and TRACK_MODE == "path":
+				# the new window overlaps the old one, so the mount switches paths without a jump
+				if generation != uploaded_generation:
+					with instrument.span("upload_path"):
+						npoints = upload_path(pwi4, table, nowjd)
+					uploaded_generation = generation
+					mountstr = f"Uploaded path with {npoints} points"
+			elif prod:
+				with instrument.span("goto"):
+					pwi4.mount_goto_ra_dec_j2000(ra/15, dec)
+
+			if every:
 			
-			print("\033[A                             \033[A\n"*nlines, end="")
-			print(f"{now} RA: {coord.ra:.4f} DEC: {coord.dec:.4f} ALT: {altaz.alt:.4f} AZ: {altaz.az:.4f} RATE: {rate:.4f}''/s ")
-			print(mountstr)
-
-
-		#if not s.mount.is_slewing:
-		#    break
-		sleep(0.01)
+				s = monitor.latest if prod else None
+				if s is not None:
+					mountstr = f"Actual RA: {s.mount.ra_j2000_hours:.5f} hours;  Actual Dec: {s.mount.dec_j2000_degs:.4f} degs, Axis0 dist: {s.mount.axis0.dist_to_target_arcsec:.1f} arcsec, Axis1 dist: {s.mount.axis1.dist_to_target_arcsec:.1f} arcsec"
+
+				print("\033[A                             \033[A\n"*nlines, end="")
+				coverage = eph.remaining_seconds()
+				worst = eph.worst_remaining_seconds
+				coveragestr = f"COVERAGE: {coverage:.0f}s" + (f" (worst {worst:.0f}s)" if worst is not None else "")
+				with instrument.span("altaz"):
+					alt, az = table.altaz.at(nowjd)
+				with instrument.span("print"):
+					print(f"{now} RA: {ra:.4f} deg DEC: {dec:.4f} deg ALT: {alt:.4f} deg AZ: {az:.4f} deg RATE: {rate:.4f}''/s {coveragestr}")
+					print(mountstr)
+
+			instrument.record("tick", perf_counter()-tickstart)
+			if on_tick is not None:
+				on_tick(nowjd)
+
+			#if not s.mount.is_slewing:
+			#    break
+			# in path mode the mount follows the path on its own, the loop only supervises
+			sleep(0.01 if TRACK_MODE == "goto" else 0.1)
+	finally:
+		if prod:
+			monitor.stop()
+			if TELEMETRY_DIRECTORY:
+				recorder.stop()
 
 	#print("Slew complete. Tracking...")
 
 	#pwi4.mount_tracking_off()
 	#pwi4.mount_stop()
 
-while True:
-	t_0 = datetime.utcnow() - timedelta(seconds=INTERVAL_SECONDS)#"2023-08-01 00:00"#
-	fakestart = datetime.utcnow()
-
-	print(f"Loading ephemerides for {obj_name}...")
-	epochs = [(Time(t_0)+TimeDelta(INTERVAL_SECONDS*i, format="sec")).jd for i in range(-1, STEPS)]
-
-	obj = Horizons(id=obj_id, location="X07", epochs=epochs)
+def query_horizons(jds):
+	obj = Horizons(id=obj_id, location=location_code, epochs=list(jds))
 
 	#print(dir(obj.ephemerides()))
 
 	eph = obj.ephemerides()
 	#eph.show_in_browser()
 
-	columns = eph.columns.keys()
+	columns = {"jd": eph["datetime_jd"], "ra": eph["RA"], "dec": eph["DEC"]}
+	if INTERPOLATION == "hermite":
+		columns["ra_rate"], columns["dec_rate"] = horizons_rates_to_degs(eph["RA_rate"], eph["DEC_rate"], eph["DEC"])
+	return columns
 
-	trackeph = {}
+def load_ephemerides(t_0):
+	global cache
+	if cache is None:
+		cache = HorizonsCache(max_age_seconds=CACHE_MAX_AGE_SECONDS)
 
-	for i in range(len(eph)):
-		utctime = datetime.strptime(eph["datetime_str"][i][:-4], "%Y-%b-%d %H:%M:%S")
-		ra = eph["RA"][i]
-		dec = eph["DEC"][i]
-		#print(ra,dec)
-		coord = SkyCoord(ra, dec, unit=(u.deg, u.deg))
-		#print(utctime, coord)
-		trackeph[utctime] = coord
+	print(f"Loading ephemerides for {obj_name}...")
+	# epochs lie on a fixed grid, so windows that overlap earlier ones (e.g. after a restart)
+	# are mostly served from the cache and only the missing epochs are queried
+	start_jd = snap_jd(datetime_to_jd(t_0), INTERVAL_SECONDS) - INTERVAL_SECONDS/86400
+	stop_jd = start_jd + STEPS*INTERVAL_SECONDS/86400
+
+	key = {"target": obj_id, "location": location_code, "quantities": "ra,dec,rates" if INTERPOLATION == "hermite" else "ra,dec"}
+	with instrument.span("load_ephemerides"):
+		columns = cache.fetch(key, start_jd, stop_jd, INTERVAL_SECONDS, query_horizons)
+
+	trackeph = EphemerisTable(columns["jd"], columns["ra"], columns["dec"], columns.get("ra_rate"), columns.get("dec_rate"), mode=INTERPOLATION)
+	error = trackeph.error_bound_arcsec()
+	print(f"Estimated {INTERPOLATION} interpolation error: {error:.3f} arcsec")
+	if error > INTERPOLATION_TOLERANCE_ARCSEC:
+		print(f"Warning: this is above {INTERPOLATION_TOLERANCE_ARCSEC} arcsec, consider a smaller INTERVAL_SECONDS")
+	# one batched Alt/Az transform for the whole window instead of one per tick
+	trackeph.altaz = AltAzTable.from_ephemeris(trackeph, location, tolerance_arcsec=ALTAZ_TOLERANCE_ARCSEC)
+	if trackeph.altaz.exact:
+		print(f"Interpolated Alt/Az is off by {trackeph.altaz.error_arcsec:.2f} arcsec, using exact transforms")
 	print("Loaded ephemerides.")#TODO print first and last time
+	return trackeph
 
-	try:
-		track(trackeph, ACTUALLYTRACK)
-	except Exception as e:
-		print(e)
-		# if this was even smarter it would preload the next ephemerides in a separate thread
-		print("Exception encountered, loading new ephemerides...")
+if __name__ == "__main__":
+	if METRICS_FILE:
+		instrument.enable()
+		instrument.Reporter(METRICS_FILE, METRICS_INTERVAL_SECONDS, METRICS_FORMAT).start()
+
+	# loads the first window now, then keeps fetching the next one in a separate thread
+	prefetcher = EphemerisPrefetcher(load_ephemerides, lead_seconds=PREFETCH_LEAD_SECONDS, overlap_seconds=INTERVAL_SECONDS)
+	prefetcher.start()
+
+	while True:
+		try:
+			track(prefetcher, ACTUALLYTRACK)
+		except Exception as e:
+			print(e)
+			# only happens if the prefetcher could not keep up, e.g. Horizons was unreachable
+			print("Exception encountered, loading new ephemerides...")
+			prefetcher.refresh()